@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import sys
+
+# the loggers of the core modules write to logs/ as soon as they are imported
+os.makedirs("logs", exist_ok=True)
+
+from core.benchmark import run_benchmarks  # pylint: disable=wrong-import-position
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the storage, collectors, renderer and whole runs of Smaug."
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="Measurements per benchmark, the median is compared. Default is 5",
+    )
+    parser.add_argument(
+        "-k",
+        "--filter",
+        type=str,
+        default=None,
+        help="Only run the benchmarks whose name contains this text",
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Use fewer sizes and instances, e.g. for CI",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Save the results as JSON (path), e.g. to use them as a baseline",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Compare the results with an earlier JSON output (path)"
+             " and exit with 1 on a regression",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Slowdown of the median over the baseline that counts as a regression."
+             " Default is 0.2 (20%%)",
+    )
+
+    args = parser.parse_args()
+    report = run_benchmarks(args.repeat, args.filter, args.quick)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(report.to_json())
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = report.compare(baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression.name} {regression.baseline:.6g}s"
+                  f" -> {regression.current:.6g}s ({regression.ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
@@ -0,0 +1,284 @@
+"""This module contains streaming aggregates for live metrics."""
+
+import math
+import random
+import statistics
+from collections import deque
+from typing import Callable, Sequence
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Exact percentile with linear interpolation, for small in-memory samples."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = q * (len(ordered) - 1)
+    lower = math.floor(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def bootstrap_interval(samples: Sequence[Sequence[float]],
+                       statistic: Callable[..., float] = statistics.median,
+                       confidence: float = 0.95, resamples: int = 2000,
+                       seed: int | None = None) -> tuple[float, float]:
+    """Percentile bootstrap confidence interval of ``statistic``.
+
+    ``statistic`` is called with one resample of every sample, so that it
+    can also compare two samples, e.g. the ratio of their medians.
+    """
+    if not all(samples):
+        return 0.0, 0.0
+    rng = random.Random(seed)
+    estimates = [
+        statistic(*(rng.choices(sample, k=len(sample)) for sample in samples))
+        for _ in range(resamples)
+    ]
+    alpha = (1 - confidence) / 2
+    return percentile(estimates, alpha), percentile(estimates, 1 - alpha)
+
+
+class RunningStats:
+    """Running count, mean, variance, min and max (Welford's algorithm).
+
+    Samples can be weighted, e.g. by the time they stand for; the mean and
+    the variance are then weighted by it (West's algorithm).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.weight = 0.0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        self.count += 1
+        self.weight += weight
+        delta = value - self.mean
+        self.mean += delta * weight / self.weight
+        self._m2 += weight * delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def remove(self, value: float, weight: float = 1.0) -> None:
+        if self.count <= 1 or self.weight - weight <= 0:
+            self.__init__()
+            return
+        delta = value - self.mean
+        self.mean = (self.mean * self.weight - value * weight) / (self.weight - weight)
+        self._m2 = max(0.0, self._m2 - weight * delta * (value - self.mean))
+        self.weight -= weight
+        self.count -= 1
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / self.weight if self.weight else 0.0
+
+
+class QuantileSketch:
+    """Log-bucketed quantile sketch with bounded memory and relative error.
+
+    Every value is counted in a bucket whose bounds grow geometrically, so a
+    quantile read is accurate to ``relative_accuracy`` of the true value.
+    Buckets hold the total weight of their values, 1 per value by default.
+    When more than ``max_buckets`` buckets are in use, the lowest ones are
+    collapsed together, trading accuracy at the low end for fixed memory.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048,
+                 min_value: float = 1e-9):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.count = 0
+        self.weight = 0.0
+        self._zero_weight = 0.0
+        self._positive: dict[int, float] = {}
+        self._negative: dict[int, float] = {}
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def _store(self, value: float) -> tuple[dict[int, float] | None, float]:
+        if value > self.min_value:
+            return self._positive, value
+        if value < -self.min_value:
+            return self._negative, -value
+        return None, 0.0
+
+    def _collapse(self, store: dict[int, float]) -> None:
+        keys = sorted(store)
+        lowest = keys[len(keys) - self.max_buckets]
+        for key in keys[:len(keys) - self.max_buckets]:
+            store[lowest] += store.pop(key)
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        self.count += 1
+        self.weight += weight
+        store, magnitude = self._store(value)
+        if store is None:
+            self._zero_weight += weight
+            return
+        key = self._key(magnitude)
+        store[key] = store.get(key, 0.0) + weight
+        if len(store) > self.max_buckets:
+            self._collapse(store)
+
+    def remove(self, value: float, weight: float = 1.0) -> None:
+        store, magnitude = self._store(value)
+        if store is None:
+            if self._zero_weight > 0:
+                self._zero_weight = max(0.0, self._zero_weight - weight)
+                self._forget(weight)
+            return
+        key = self._key(magnitude)
+        if key not in store and store:
+            key = min(store)  # the value was folded into a collapsed bucket
+        if store.get(key):
+            store[key] -= weight
+            # weights are floats, drop buckets that are empty up to rounding
+            if store[key] <= 1e-12 * max(1.0, self.weight):
+                del store[key]
+            self._forget(weight)
+
+    def _forget(self, weight: float) -> None:
+        self.count -= 1
+        self.weight = max(0.0, self.weight - weight) if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        # snapshot the buckets, the sketch may be fed from another thread
+        buckets = [
+            (-self._value(key), weight)
+            for key, weight in sorted(self._negative.items(), reverse=True)
+        ]
+        if self._zero_weight > 0:
+            buckets.append((0.0, self._zero_weight))
+        buckets.extend((self._value(key), weight) for key, weight in sorted(self._positive.items()))
+        # the lowest value with a share q of the weight at or below it; for samples
+        # weighted by time, the value the metric stayed at or below for that share
+        rank = q * self.weight
+        seen = 0.0
+        for value, weight in buckets:
+            seen += weight
+            if seen >= rank:
+                return value
+        # the float weights may add up to just below the total
+        return buckets[-1][0] if buckets else 0.0
+
+
+class WindowedStats:
+    """Aggregates over the samples of the last ``window`` seconds."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch()
+        self._samples: deque[tuple[float, float, float]] = deque()
+        self._min: deque[tuple[float, float]] = deque()
+        self._max: deque[tuple[float, float]] = deque()
+
+    def add(self, value: float, timestamp: float, weight: float = 1.0) -> None:
+        self._samples.append((timestamp, value, weight))
+        self.stats.add(value, weight)
+        self.sketch.add(value, weight)
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((timestamp, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((timestamp, value))
+        self._evict(timestamp)
+
+    def _evict(self, now: float) -> None:
+        oldest = now - self.window
+        while self._samples and self._samples[0][0] < oldest:
+            _, value, weight = self._samples.popleft()
+            self.stats.remove(value, weight)
+            self.sketch.remove(value, weight)
+        while self._min and self._min[0][0] < oldest:
+            self._min.popleft()
+        while self._max and self._max[0][0] < oldest:
+            self._max.popleft()
+
+    @property
+    def min(self) -> float:
+        return self._min[0][1] if self._min else math.inf
+
+    @property
+    def max(self) -> float:
+        return self._max[0][1] if self._max else -math.inf
+
+
+class MetricAggregates:
+    """Whole-run and sliding-window aggregates of a single metric.
+
+    Samples are weighted by the time they stand for, so that the aggregates
+    stay time-weighted when the sampling interval changes.
+    """
+
+    def __init__(self, windows: tuple[float, ...] = ()):
+        self.stats = RunningStats()
+        self.sketch = QuantileSketch()
+        self.windows = {window: WindowedStats(window) for window in windows}
+
+    def add(self, value: float, timestamp: float, weight: float = 1.0) -> None:
+        self.stats.add(value, weight)
+        self.sketch.add(value, weight)
+        for window in self.windows.values():
+            window.add(value, timestamp, weight)
+
+    def _source(self, window: float | None) -> RunningStats | WindowedStats:
+        if window is None:
+            return self
+        if window not in self.windows:
+            raise ValueError(f"Window {window} is not tracked")
+        return self.windows[window]
+
+    def mean(self, window: float | None = None) -> float:
+        return self._source(window).stats.mean
+
+    def variance(self, window: float | None = None) -> float:
+        return self._source(window).stats.variance
+
+    def min(self, window: float | None = None) -> float:
+        source = self._source(window)
+        value = source.min if window is not None else source.stats.min
+        return value if source.stats.count else 0.0
+
+    def max(self, window: float | None = None) -> float:
+        source = self._source(window)
+        value = source.max if window is not None else source.stats.max
+        return value if source.stats.count else 0.0
+
+    def quantile(self, q: float, window: float | None = None) -> float:
+        return self._source(window).sketch.quantile(q)
+
+    def summary(self, window: float | None = None) -> dict[str, float]:
+        return {
+            "average": self.mean(window),
+            "min": self.min(window),
+            "max": self.max(window),
+            "stddev": math.sqrt(self.variance(window)),
+            "p50": self.quantile(0.5, window),
+            "p95": self.quantile(0.95, window),
+            "p99": self.quantile(0.99, window),
+        }
+
+
+class BatchAggregates(dict):
+
+    def __init__(self, windows: tuple[float, ...] = ()):
+        super().__init__()
+        self.windows = tuple(windows)
+
+    def __missing__(self, key: str) -> MetricAggregates:
+        self[key] = MetricAggregates(self.windows)
+        return self[key]
@@ -0,0 +1,269 @@
+"""This module contains the benchmark suite of Smaug's own hot paths."""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Iterator
+
+from .metrics import Metric, MetricList
+from .monitoring import (
+    CPUMonitor, DiskIOMonitor, DiskMonitor, InstanceMonitor, MemoryMonitor,
+    NetworkMonitor, ProcessMonitor,
+)
+from .scheduler import TickContext
+from .storage import RingBufferStorage, TempStorage
+from .tail import BatchTailBuffer
+from .visual import MetricsDisplay
+from .logger import setup_logger
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+MAIN_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+SYNTHETIC_SCRIPT = """\
+import time
+for i in range(20):
+    print("line", i, flush=True)
+    time.sleep(0.05)
+"""
+
+
+@dataclass
+class BenchmarkCase:
+
+    name: str
+    func: Callable[[], None]
+    number: int  # calls per measurement, the result is the time of one call
+    timer: Callable[[], float] = time.perf_counter
+
+
+@dataclass
+class BenchmarkResult:
+
+    name: str
+    number: int
+    times: list[float]  # seconds per call of every repetition
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.times)
+
+    @property
+    def best(self) -> float:
+        return min(self.times)
+
+    def to_dict(self) -> dict:
+        return dict(asdict(self), median=self.median, best=self.best)
+
+
+@dataclass
+class Regression:
+
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float("inf")
+
+
+@dataclass
+class BenchmarkReport:
+
+    metadata: dict
+    results: list[BenchmarkResult] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "metadata": self.metadata,
+            "results": {result.name: result.to_dict() for result in self.results},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def compare(self, baseline: dict, threshold: float) -> list[Regression]:
+        """Return the results whose median is over ``threshold`` slower than the baseline."""
+        regressions = []
+        for result in self.results:
+            base = baseline.get("results", {}).get(result.name)
+            if base is None:
+                continue
+            if result.median > base["median"] * (1 + threshold):
+                regressions.append(Regression(result.name, base["median"], result.median))
+        return regressions
+
+    def __str__(self) -> str:
+        width = max((len(result.name) for result in self.results), default=4)
+        header = f"{'name':<{width}} | {'median':>12} | {'best':>12} | {'calls':>6}"
+        lines = [header, "-" * len(header)]
+        for result in self.results:
+            lines.append(
+                f"{result.name:<{width}} | {format_time(result.median):>12} "
+                f"| {format_time(result.best):>12} | {result.number:>6}"
+            )
+        return "\n".join(lines)
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+
+def get_metadata() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "started_at": time.time(),
+    }
+
+
+def get_children_cpu_time() -> float:
+    """Return the user and system time of the waited-for child processes."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def spawn_sleepers(count: int) -> list[subprocess.Popen]:
+    return [
+        subprocess.Popen([sys.executable, "-c", "import time; time.sleep(3600)"])
+        for _ in range(count)
+    ]
+
+
+def bench_storage(sizes: tuple[int, ...]) -> Iterator[BenchmarkCase]:
+    for storage_class in (TempStorage, RingBufferStorage):
+        kind = storage_class.__name__
+        for size in sizes:
+            def save(size=size, storage_class=storage_class):
+                storage = storage_class()
+                for epoch in range(size):
+                    storage.save_record(Metric("cpu usage", float(epoch), epoch))
+
+            yield BenchmarkCase(f"storage {kind} save_record x{size}", save, 1)
+
+            storage = storage_class()
+            for epoch in range(size):
+                storage.save_record(Metric("cpu usage", float(epoch), epoch))
+            yield BenchmarkCase(
+                f"storage {kind} get_last_records {size}", storage.get_last_records, 5
+            )
+
+
+def bench_monitors(instances: int) -> Iterator[BenchmarkCase]:
+    processes = spawn_sleepers(instances)
+    try:
+        instance_monitor = InstanceMonitor()
+        for process in processes:
+            instance_monitor.track(process.pid)
+        monitors = [
+            CPUMonitor(), MemoryMonitor(), instance_monitor,
+            NetworkMonitor(instance_monitor), DiskIOMonitor(instance_monitor),
+            DiskMonitor(), ProcessMonitor(),
+        ]
+        for monitor in monitors:
+            # a fresh context per call, so that no read is served from the tick cache
+            yield BenchmarkCase(
+                f"monitor {monitor.__class__.__name__} record_stats {instances} instances",
+                lambda monitor=monitor: monitor.record_stats(TickContext()),
+                20,
+            )
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+
+
+def get_synthetic_metrics(count: int, epoch: int) -> MetricList:
+    return MetricList([
+        Metric(f"instance {index} cpu usage", round((index * 7 + epoch) % 100 / 3, 3), epoch)
+        for index in range(count)
+    ])
+
+
+def bench_display(metric_counts: tuple[int, ...]) -> Iterator[BenchmarkCase]:
+    tails = BatchTailBuffer()
+    for line in range(200):
+        tails[0].append(f"log line {line}".encode())
+    for count in metric_counts:
+        display = MetricsDisplay(tails)
+        display.stop()
+        display.get_terminal_size = lambda: os.terminal_size((200, count + 10))
+        frames = [get_synthetic_metrics(count, epoch) for epoch in range(2)]
+        state = {"frame": 0}
+
+        def render(display=display, frames=frames, state=state):
+            # alternate two frames, so that every call has cells to redraw
+            state["frame"] ^= 1
+            display.metrics = frames[state["frame"]]
+            with contextlib.redirect_stdout(io.StringIO()):
+                display.display()
+
+        yield BenchmarkCase(f"display render {count} metrics", render, 20)
+
+
+def bench_end_to_end(instances: tuple[int, ...]) -> Iterator[BenchmarkCase]:
+    work_dir = tempfile.mkdtemp(prefix="smaug_bench_")
+    os.makedirs(os.path.join(work_dir, "logs"))
+    script = os.path.join(work_dir, "synthetic.py")
+    with open(script, "w", encoding="utf-8") as file:
+        file.write(SYNTHETIC_SCRIPT)
+    env = dict(os.environ, XDG_CACHE_HOME=os.path.join(work_dir, "cache"))
+    try:
+        for count in instances:
+            command = [sys.executable, MAIN_FILE, "-mf", script, "-n", str(count), "--headless"]
+
+            def run(command=command):
+                subprocess.run(command, cwd=work_dir, env=env, check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            # the warm-up call of the first case builds the cached venv
+            yield BenchmarkCase(f"end-to-end {count} instances wall time", run, 1)
+            # Smaug and the scripts, which mostly sleep, so this is Smaug's overhead
+            yield BenchmarkCase(f"end-to-end {count} instances cpu time", run, 1,
+                                get_children_cpu_time)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def get_cases(quick: bool = False) -> Iterator[BenchmarkCase]:
+    yield from bench_storage((100, 1000) if quick else (100, 1000, 10000))
+    yield from bench_monitors(2 if quick else 8)
+    yield from bench_display((20,) if quick else (20, 100))
+    yield from bench_end_to_end((1,) if quick else (1, 8))
+
+
+def run_case(case: BenchmarkCase, repeat: int) -> BenchmarkResult:
+    case.func()  # warm up caches and lazily opened readers
+    times = []
+    for _ in range(repeat):
+        start = case.timer()
+        for _ in range(case.number):
+            case.func()
+        times.append((case.timer() - start) / case.number)
+    return BenchmarkResult(case.name, case.number, times)
+
+
+def run_benchmarks(repeat: int = 5, pattern: str | None = None,
+                   quick: bool = False) -> BenchmarkReport:
+    report = BenchmarkReport(get_metadata())
+    for case in get_cases(quick):
+        if pattern and pattern not in case.name:
+            continue
+        logger.info("Running benchmark %s", case.name)
+        report.results.append(run_case(case, repeat))
+    return report
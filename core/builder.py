@@ -1,45 +1,281 @@
 """ A module to build a project."""
 
+import errno
+import fcntl
+import fnmatch
+import hashlib
 import os
+import platform
 import shutil
 import subprocess
+import sys
 import tempfile
+import time
 import venv
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 
 from .logger import setup_logger
 
 logger = setup_logger(f"smaug_{os.getpid()}")
 
+DEFAULT_IGNORE_PATTERNS = (
+    ".git/",
+    "__pycache__/",
+    "*.py[cod]",
+    "venv/",
+    ".venv/",
+    "logs/",
+    ".idea/",
+    ".mypy_cache/",
+    ".pytest_cache/",
+    ".ruff_cache/",
+    ".tox/",
+    ".nox/",
+)
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+# modules started inside the scripts through sitecustomize, e.g. the stack sampler
+INJECT_SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inject")
+INJECT_DIR_NAME = "smaug_inject"
+FICLONE = 0x40049409  # ioctl request of a copy-on-write clone (Btrfs, XFS)
+
+
+def get_default_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "smaug", "venvs")
+
+
+def get_dir_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                continue
+    return size
+
+
+class VenvCache:
+    """Built virtual environments keyed by requirements and interpreter.
+
+    Entries are reused across runs and evicted least recently used first
+    once the cache grows over ``max_size`` megabytes. An entry is held with
+    a shared lock while a run uses it, so it is never evicted from under a
+    running script.
+    """
+
+    complete_marker = ".smaug_complete"
+
+    def __init__(self, cache_dir: str | None = None, max_size: int = 2048):
+        self.cache_dir = cache_dir or get_default_cache_dir()
+        self.max_size = max_size * 1024 * 1024  # in megabytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_key(self, requirements_path: str | None) -> str:
+        digest = hashlib.sha256()
+        digest.update(sys.version.encode())
+        digest.update(os.path.realpath(sys.executable).encode())
+        digest.update(platform.machine().encode())
+        if requirements_path and os.path.exists(requirements_path):
+            with open(requirements_path, "rb") as requirements:
+                digest.update(requirements.read())
+        return digest.hexdigest()[:32]
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.lock")
+
+    def acquire(self, key: str, build: Callable[[str], bool]) -> tuple[str, int]:
+        """Return the venv of ``key`` and a descriptor holding its shared lock.
+
+        ``build`` creates the venv in the given directory on a cache miss and
+        returns whether it succeeded; failed builds are not cached.
+        """
+        path = os.path.join(self.cache_dir, key)
+        lock_fd = os.open(self._lock_path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        marker = os.path.join(path, self.complete_marker)
+        if os.path.exists(marker):
+            logger.info("Reusing cached virtual environment %s", path)
+            os.utime(marker)
+        else:
+            logger.info("No cached virtual environment for %s, building it", key)
+            shutil.rmtree(path, ignore_errors=True)
+            if build(path):
+                with open(marker, "w", encoding="utf-8") as file:
+                    file.write(str(time.time()))
+        # downgrade, other runs may share the entry but nobody may evict it
+        fcntl.flock(lock_fd, fcntl.LOCK_SH)
+        self.evict(keep=key)
+        return path, lock_fd
+
+    def release(self, lock_fd: int) -> None:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+    def entries(self) -> list[tuple[float, str]]:
+        """Return (last use, key) of every complete entry, oldest first."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            marker = os.path.join(self.cache_dir, key, self.complete_marker)
+            if os.path.exists(marker):
+                entries.append((os.path.getmtime(marker), key))
+        return sorted(entries)
+
+    def evict(self, keep: str | None = None) -> None:
+        entries = self.entries()
+        sizes = {key: get_dir_size(os.path.join(self.cache_dir, key)) for _, key in entries}
+        total = sum(sizes.values())
+        for _, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            lock_fd = os.open(self._lock_path(key), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(lock_fd)
+                continue  # a running script uses the entry
+            logger.info("Evicting cached virtual environment %s", key)
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= sizes[key]
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+
+
+class IgnoreRules:
+    """A .gitignore-style subset: globs, negation, anchoring and directory-only rules."""
+
+    def __init__(self, patterns: list[str] | tuple[str, ...] = ()):
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            pattern = pattern.lstrip("!")
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            if pattern.startswith("**/"):
+                pattern = pattern[3:]
+            anchored = "/" in pattern
+            self.rules.append((pattern.lstrip("/"), negate, dir_only, anchored))
+
+    @classmethod
+    def from_dir(cls, dir_path: str, extra: list[str] | tuple[str, ...] = ()) -> "IgnoreRules":
+        patterns = list(DEFAULT_IGNORE_PATTERNS)
+        gitignore = os.path.join(dir_path, ".gitignore")
+        if os.path.exists(gitignore):
+            with open(gitignore, "r", encoding="utf-8") as file:
+                patterns.extend(file.read().splitlines())
+        patterns.extend(extra)
+        return cls(patterns)
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        name = os.path.basename(rel_path)
+        ignored = False
+        for pattern, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatchcase(rel_path if anchored else name, pattern):
+                ignored = not negate
+        return ignored
+
 
 class Builder:
 
-    def __init__(self):
+    def __init__(self, venv_cache: VenvCache | None = None,
+                 exclude: list[str] | tuple[str, ...] = (), link_mode: str = "auto"):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Unknown link mode {link_mode}, expected one of {LINK_MODES}")
         self.build_dir = tempfile.mkdtemp(prefix="smaug_")
         self.venv_dir = os.path.join(self.build_dir, "venv")
+        self.venv_cache = venv_cache
+        self.exclude = exclude
+        self.link_mode = link_mode
+        self.staging_time = 0.0
+        self._venv_lock_fd = None
+        self._can_reflink = link_mode in ("auto", "reflink")
+        # hardlinks share their content with the originals, so only when asked for
+        self._can_hardlink = link_mode == "hardlink"
         logger.info(
             "Initialized Builder with build_dir: %s and venv_dir: %s",
             self.build_dir,
             self.venv_dir,
         )
 
+    def _reflink(self, src: str, dst: str) -> None:
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        shutil.copystat(src, dst)
+
+    def _stage_file(self, src: str, dst: str) -> str:
+        """Stage one file and return how it was staged."""
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return "symlink"
+        if self._can_reflink:
+            try:
+                self._reflink(src, dst)
+                return "reflink"
+            except OSError:
+                # unsupported by this filesystem, do not try again
+                self._can_reflink = False
+                if os.path.exists(dst):
+                    os.remove(dst)
+        if self._can_hardlink:
+            try:
+                os.link(src, dst)
+                return "hardlink"
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                    raise
+                self._can_hardlink = False
+        shutil.copy2(src, dst)
+        return "copy"
+
     def copy_files(self, dir_path: str) -> None:
         logger.info("Starting to copy files from %s to %s", dir_path, self.build_dir)
-        for item in os.listdir(dir_path):
-            s = os.path.join(dir_path, item)
-            d = os.path.join(self.build_dir, item)
-            if os.path.isdir(s):
-                shutil.copytree(s, d, dirs_exist_ok=True)
-            else:
-                shutil.copy2(s, d)
-        logger.info("Finished copying files from %s to %s", dir_path, self.build_dir)
-
-    def create_venv(self) -> None:
-        logger.info("Starting to create virtual environment in %s", self.venv_dir)
-        venv.create(self.venv_dir, with_pip=True)
-        logger.info("Finished creating virtual environment in %s", self.venv_dir)
-
-    def install_dependencies(self) -> None:
-        pip_exe = os.path.join(self.venv_dir, "bin", "pip")
+        start = time.perf_counter()
+        rules = IgnoreRules.from_dir(dir_path, self.exclude)
+        files = []
+        for root, dirs, filenames in os.walk(dir_path):
+            rel_root = os.path.relpath(root, dir_path)
+            rel_root = "" if rel_root == "." else rel_root
+            dirs[:] = [
+                d for d in dirs
+                if not rules.is_ignored(os.path.join(rel_root, d), True)
+                # virtual environments are rebuilt, never staged
+                and not os.path.exists(os.path.join(root, d, "pyvenv.cfg"))
+            ]
+            os.makedirs(os.path.join(self.build_dir, rel_root), exist_ok=True)
+            for filename in filenames:
+                rel_path = os.path.join(rel_root, filename)
+                if not rules.is_ignored(rel_path, False):
+                    files.append(
+                        (os.path.join(root, filename), os.path.join(self.build_dir, rel_path))
+                    )
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as pool:
+            methods = list(pool.map(lambda pair: self._stage_file(*pair), files))
+        self.staging_time = time.perf_counter() - start
+        logger.info(
+            "Finished copying %s files from %s to %s in %.3fs (%s)",
+            len(files),
+            dir_path,
+            self.build_dir,
+            self.staging_time,
+            ", ".join(f"{methods.count(m)} {m}" for m in sorted(set(methods))),
+        )
+
+    def create_venv(self, venv_dir: str | None = None) -> None:
+        venv_dir = venv_dir or self.venv_dir
+        logger.info("Starting to create virtual environment in %s", venv_dir)
+        venv.create(venv_dir, with_pip=True)
+        logger.info("Finished creating virtual environment in %s", venv_dir)
+
+    def install_dependencies(self, venv_dir: str | None = None) -> bool:
+        pip_exe = os.path.join(venv_dir or self.venv_dir, "bin", "pip")
         logger.info("Starting to install dependencies using %s", pip_exe)
         try:
             requirements_abs_path = os.path.join(self.build_dir, "requirements.txt")
@@ -54,18 +290,39 @@ class Builder:
             logger.error("Command %s failed with return code %s", e.cmd, e.returncode)
             logger.info("Output: %s", e.stdout.decode())
             logger.error("Error: %s", e.stderr.decode())
+            return False
         logger.info("Finished installing dependencies")
+        return True
+
+    def _build_venv(self, venv_dir: str) -> bool:
+        self.create_venv(venv_dir)
+        if "requirements.txt" in os.listdir(self.build_dir):
+            return self.install_dependencies(venv_dir)
+        return True
 
     def build(self, dir_path: str) -> None:
         logger.info("Starting to build the project from %s", dir_path)
         self.copy_files(dir_path)
-        self.create_venv()
         logger.info("Files in directory: %s", os.listdir(self.build_dir))
-        if "requirements.txt" in os.listdir(self.build_dir):
-            self.install_dependencies()
+        if self.venv_cache is None:
+            self._build_venv(self.venv_dir)
+        else:
+            key = self.venv_cache.get_key(os.path.join(self.build_dir, "requirements.txt"))
+            cached_venv_dir, self._venv_lock_fd = self.venv_cache.acquire(key, self._build_venv)
+            os.symlink(cached_venv_dir, self.venv_dir)
         logger.info("Finished building the project from %s", dir_path)
 
+    def install_injected_modules(self) -> str:
+        """Copy the injected modules to the build directory, return it for PYTHONPATH."""
+        inject_dir = os.path.join(self.build_dir, INJECT_DIR_NAME)
+        if not os.path.isdir(inject_dir):
+            shutil.copytree(INJECT_SOURCE_DIR, inject_dir,
+                            ignore=shutil.ignore_patterns("__pycache__"))
+        return inject_dir
+
     def __del__(self) -> None:
+        if self._venv_lock_fd is not None:
+            self.venv_cache.release(self._venv_lock_fd)
         logger.info("Deleting the build directory %s", self.build_dir)
         shutil.rmtree(self.build_dir)
         logger.info("Deleted the build directory %s", self.build_dir)
@@ -0,0 +1,252 @@
+"""This module contains the capture of the output of launched scripts."""
+
+import os
+import selectors
+import struct
+import subprocess
+import threading
+import time
+from typing import IO, Callable
+
+from .logger import setup_logger
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+# called with a raw output line (without the line break) and whether it came from stderr
+LineHandler = Callable[[bytes, bool], None]
+
+# file offset and timestamp of an entry of the side index of a raw output file
+INDEX_STRUCT = struct.Struct("<qd")
+
+
+class RawSink:
+    """Moves pipe bytes straight into a file, splice(2)-ing where possible.
+
+    Every ``index_every`` bytes the file offset and the current time are
+    appended to ``<path>.idx`` so the output can be placed in time without
+    timestamping each line.
+    """
+
+    use_splice = hasattr(os, "splice")
+
+    def __init__(self, path: str, index_every: int = 64 * 1024):
+        self.path = path
+        self.index_every = index_every
+        self.offset = 0
+        self._next_index = 0
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+        self._index_fd = os.open(
+            f"{path}.idx", os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644
+        )
+
+    def transfer(self, pipe_fd: int, size: int) -> int:
+        """Move up to ``size`` bytes, return 0 once the pipe is closed."""
+        if RawSink.use_splice:
+            try:
+                moved = os.splice(pipe_fd, self._fd, size, offset_dst=self.offset)
+            except (BlockingIOError, InterruptedError):
+                raise
+            except OSError:
+                # the filesystem or kernel does not support splice, fall back for good
+                RawSink.use_splice = False
+                return self.transfer(pipe_fd, size)
+        else:
+            data = os.read(pipe_fd, size)
+            moved = os.pwrite(self._fd, data, self.offset) if data else 0
+        if moved and self.offset >= self._next_index:
+            os.write(self._index_fd, INDEX_STRUCT.pack(self.offset, time.time()))
+            self._next_index = self.offset + self.index_every
+        self.offset += moved
+        return moved
+
+    def close(self) -> None:
+        os.close(self._fd)
+        os.close(self._index_fd)
+
+
+def lookup_raw_timestamp(path: str, offset: int) -> float | None:
+    """Return the time of the index entry at or before ``offset`` of a raw output file.
+
+    The index file is binary-searched in place rather than read whole.
+    """
+    try:
+        file = open(f"{path}.idx", "rb")  # pylint: disable=consider-using-with
+    except FileNotFoundError:
+        return None
+    with file:
+        low, high = 0, os.fstat(file.fileno()).st_size // INDEX_STRUCT.size
+        timestamp = None
+        while low < high:
+            middle = (low + high) // 2
+            file.seek(middle * INDEX_STRUCT.size)
+            entry_offset, entry_time = INDEX_STRUCT.unpack(file.read(INDEX_STRUCT.size))
+            if entry_offset <= offset:
+                timestamp = entry_time
+                low = middle + 1
+            else:
+                high = middle
+        return timestamp
+
+
+class _Stream:
+
+    def __init__(self, fd: int, is_error: bool, handler: LineHandler | None,
+                 sink: RawSink | None = None, owns_fd: bool = False,
+                 file: IO[bytes] | None = None):
+        self.fd = fd
+        self.is_error = is_error
+        self.handler = handler
+        self.sink = sink
+        self.owns_fd = owns_fd  # closed with the stream, it has no file object
+        self.file = file  # the Popen pipe, closed with the stream
+        self.buffer = bytearray()
+
+
+class OutputCapture:
+    """Multiplexes the stdout and stderr pipes of every child in one thread.
+
+    Pipes are switched to non-blocking mode and read in chunks whenever they
+    are readable, so a chatty stderr can never block behind a full stdout.
+    Lines are handed over as bytes, decoding is left to the handler. Raw
+    streams skip line splitting and are moved straight to a RawSink.
+    """
+
+    def __init__(self, chunk_size: int = 65536, max_line: int = 1024 * 1024):
+        self.chunk_size = chunk_size
+        self.max_line = max_line
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ, None)
+        self._pending: list[_Stream] = []
+        self._lock = threading.Lock()
+        self._stop_flag = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, process: subprocess.Popen, handler: LineHandler) -> None:
+        streams = []
+        for pipe, is_error in ((process.stdout, False), (process.stderr, True)):
+            if pipe is None:
+                continue
+            fd = pipe.fileno()
+            os.set_blocking(fd, False)
+            streams.append(_Stream(fd, is_error, handler, file=pipe))
+        self._add_streams(streams)
+
+    def add_fd(self, fd: int, handler: LineHandler) -> None:
+        """Hand the lines of a bare pipe to ``handler``; the fd is closed at its end."""
+        os.set_blocking(fd, False)
+        self._add_streams([_Stream(fd, False, handler, owns_fd=True)])
+
+    def add_raw(self, process: subprocess.Popen, path_prefix: str,
+                index_every: int = 64 * 1024) -> None:
+        """Write stdout to ``<path_prefix>.out`` and stderr to ``<path_prefix>.err``."""
+        streams = []
+        for pipe, is_error in ((process.stdout, False), (process.stderr, True)):
+            if pipe is None:
+                continue
+            fd = pipe.fileno()
+            os.set_blocking(fd, False)
+            sink = RawSink(f"{path_prefix}.{'err' if is_error else 'out'}", index_every)
+            streams.append(_Stream(fd, is_error, None, sink, file=pipe))
+        self._add_streams(streams)
+
+    def _add_streams(self, streams: list[_Stream]) -> None:
+        with self._lock:
+            self._pending.extend(streams)
+        os.write(self._wakeup_write, b"\0")
+
+    def _register_pending(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for stream in pending:
+            self._selector.register(stream.fd, selectors.EVENT_READ, stream)
+
+    def _emit_lines(self, stream: _Stream) -> None:
+        buffer = stream.buffer
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            stream.handler(bytes(buffer[start:end]), stream.is_error)
+            start = end + 1
+        del buffer[:start]
+        if len(buffer) > self.max_line:
+            # a line without a break must not grow without bound
+            stream.handler(bytes(buffer), stream.is_error)
+            buffer.clear()
+
+    def _close_stream(self, stream: _Stream) -> None:
+        self._selector.unregister(stream.fd)
+        if stream.sink is not None:
+            stream.sink.close()
+        if stream.buffer:
+            stream.handler(bytes(stream.buffer), stream.is_error)
+            stream.buffer.clear()
+        if stream.owns_fd:
+            os.close(stream.fd)
+        elif stream.file is not None:
+            stream.file.close()
+
+    def _read(self, stream: _Stream) -> None:
+        if stream.sink is not None:
+            try:
+                moved = stream.sink.transfer(stream.fd, self.chunk_size)
+            except BlockingIOError:
+                return
+            except OSError:
+                moved = 0
+            if not moved:
+                self._close_stream(stream)
+            return
+        try:
+            data = os.read(stream.fd, self.chunk_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close_stream(stream)
+            return
+        stream.buffer += data
+        self._emit_lines(stream)
+
+    def _poll(self, timeout: float | None) -> int:
+        events = self._selector.select(timeout)
+        for key, _ in events:
+            if key.data is None:
+                try:
+                    os.read(self._wakeup_read, 4096)
+                except BlockingIOError:
+                    pass
+                self._register_pending()
+                continue
+            try:
+                self._read(key.data)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to capture the output of fd %s", key.fd)
+        return len(events)
+
+    def _run(self) -> None:
+        while not self._stop_flag:
+            self._poll(None)
+        self._register_pending()
+        # drain what the children wrote before they were stopped
+        while len(self._selector.get_map()) > 1 and self._poll(0.1):
+            pass
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                self._close_stream(key.data)
+
+    def stop(self) -> None:
+        if self._stop_flag:
+            return  # already stopped, the fds may have been reused since
+        self._stop_flag = True
+        os.write(self._wakeup_write, b"\0")
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._selector.close()
+        os.close(self._wakeup_read)
+        os.close(self._wakeup_write)
@@ -0,0 +1,64 @@
+"""Imported at startup by the scripts Smaug launches; starts the helpers Smaug asked for.
+
+Smaug puts this directory first on PYTHONPATH and describes the helpers in
+SMAUG_* environment variables. They are only honoured by the direct children
+of Smaug, whose parent pid matches SMAUG_PARENT_PID, and removed from the
+environment, so that the processes the scripts start run untouched.
+"""
+
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+_INJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _pop_environ() -> dict[str, str]:
+    settings = {key: os.environ.pop(key) for key in list(os.environ) if key.startswith("SMAUG_")}
+    if settings.get("SMAUG_PARENT_PID") != str(os.getppid()):
+        return {}
+    return settings
+
+
+def _start_helpers(settings: dict[str, str]) -> None:
+    if "SMAUG_PROFILE_FD" in settings:
+        import smaug_profiler  # pylint: disable=import-outside-toplevel
+
+        smaug_profiler.start(
+            int(settings["SMAUG_PROFILE_FD"]),
+            float(settings.get("SMAUG_PROFILE_HZ", 100)),
+            settings.get("SMAUG_ROOT", ""),
+        )
+    if "SMAUG_MEMORY_FD" in settings:
+        import smaug_memory  # pylint: disable=import-outside-toplevel
+
+        smaug_memory.start(
+            int(settings["SMAUG_MEMORY_FD"]),
+            float(settings.get("SMAUG_MEMORY_INTERVAL", 5)),
+            int(settings.get("SMAUG_MEMORY_DEPTH", 1)),
+            int(settings.get("SMAUG_MEMORY_TOP", 10)),
+            settings.get("SMAUG_ROOT", ""),
+        )
+    if "SMAUG_TELEMETRY_SHM" in settings:
+        import smaug_telemetry  # pylint: disable=import-outside-toplevel
+
+        smaug_telemetry.connect(settings["SMAUG_TELEMETRY_SHM"])
+
+
+def _chain_sitecustomize() -> None:
+    """Run the sitecustomize this one shadows, e.g. the one of the venv."""
+    path = [entry for entry in sys.path if os.path.abspath(entry or ".") != _INJECT_DIR]
+    spec = importlib.machinery.PathFinder.find_spec("sitecustomize", path)
+    if spec is None or spec.loader is None:
+        return
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+
+try:
+    _start_helpers(_pop_environ())
+except Exception as error:  # pylint: disable=broad-except
+    # a failing helper must not keep the script from running
+    print(f"smaug: failed to start the injected helpers: {error!r}", file=sys.stderr)
+_chain_sitecustomize()
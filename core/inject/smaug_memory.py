@@ -0,0 +1,117 @@
+"""Allocation tracer that Smaug injects into the scripts it profiles.
+
+tracemalloc is started before the script runs and a thread snapshots it every
+``interval`` seconds. Each snapshot is sent to Smaug as one JSON line with
+the traced and peak memory and the top allocation sites by size, each with
+its growth since the previous snapshot and since the first one.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+_tracer = None
+
+
+class Tracer:
+
+    def __init__(self, fd: int, interval: float, depth: int = 1, top: int = 10,
+                 root: str = ""):
+        self.fd = fd
+        self.interval = interval
+        self.depth = depth
+        self.top = top
+        self.root = root.rstrip(os.sep) + os.sep if root else ""
+        self.key = "traceback" if depth > 1 else "lineno"
+        self._first: dict[tracemalloc.Traceback, int] | None = None
+        self._previous: dict[tracemalloc.Traceback, int] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="smaug-memory", daemon=True)
+        # the injected modules, the tracebacks they keep and the import machinery are noise
+        self._ignored = (os.path.dirname(os.path.abspath(__file__)) + os.sep,
+                         tracemalloc.__file__, "<")
+
+    def _is_ignored(self, traceback: tracemalloc.Traceback) -> bool:
+        return any(frame.filename.startswith(self._ignored) for frame in traceback)
+
+    def _format_frame(self, frame: tracemalloc.Frame) -> str:
+        filename = frame.filename
+        if self.root and filename.startswith(self.root):
+            filename = filename[len(self.root):]
+        return f"{filename}:{frame.lineno}"
+
+    def snapshot(self) -> dict:
+        traced, peak = tracemalloc.get_traced_memory()
+        # filtering the grouped statistics is far cheaper than filter_traces()
+        stats = [
+            stat for stat in tracemalloc.take_snapshot().statistics(self.key)
+            if not self._is_ignored(stat.traceback)
+        ]
+        sizes = {stat.traceback: stat.size for stat in stats}
+        if self._first is None:
+            self._first = sizes
+        sites = []
+        for stat in stats[:self.top]:
+            # tracemalloc orders the frames from the oldest to the most recent
+            frames = [self._format_frame(frame) for frame in reversed(stat.traceback)]
+            sites.append({
+                "site": frames[0],
+                "traceback": frames,  # most recent call first
+                "size": stat.size,
+                "count": stat.count,
+                "size_diff": stat.size - self._previous.get(stat.traceback, 0),
+                "growth": stat.size - self._first.get(stat.traceback, 0),
+            })
+        self._previous = sizes
+        return {"timestamp": time.time(), "traced": traced, "peak": peak, "sites": sites}
+
+    def send(self) -> None:
+        with self._lock:
+            if self.fd is None or not tracemalloc.is_tracing():
+                return
+            data = json.dumps(self.snapshot()) + "\n"
+            try:
+                _write_all(self.fd, data.encode())
+            except OSError:
+                self.fd = None  # Smaug went away
+
+    def start(self) -> None:
+        tracemalloc.start(self.depth)
+        self._thread.start()
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._forget)
+
+    def _forget(self) -> None:
+        # a forked child has no tracer thread and must not write to the parent's pipe
+        self.fd = None
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.send()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join(self.interval + 1)
+        self.send()  # the state at exit, for short scripts the only snapshot
+        tracemalloc.stop()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def start(fd: int, interval: float, depth: int = 1, top: int = 10, root: str = "") -> Tracer:
+    global _tracer  # pylint: disable=global-statement
+    os.set_inheritable(fd, False)
+    _tracer = Tracer(fd, interval, depth, top, root)
+    _tracer.start()
+    return _tracer
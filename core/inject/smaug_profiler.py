@@ -0,0 +1,152 @@
+"""Signal-based stack sampler that Smaug injects into the scripts it profiles.
+
+An ITIMER_PROF timer raises SIGPROF every 1/hz seconds of CPU time the
+process uses. The signal is blocked in the threads of the script and taken
+with sigtimedwait() by a sampler thread instead of a handler, so that it
+never interrupts the script's system calls and is not lost while the main
+thread waits. On every signal the sampler folds the stack of each thread
+that used CPU since the previous sample into one line, root frame first,
+and counts the CPU time of the thread in samples of 1/hz seconds.
+
+Once per ``flush_interval`` the counts are sent to Smaug as collapsed
+stacks, ``frame;frame;frame count`` per line, which flamegraph tools read
+as is.
+"""
+
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+
+_sampler = None
+
+
+class Sampler:
+
+    def __init__(self, fd: int, hz: float, root: str = "", flush_interval: float = 1.0):
+        self.fd = fd
+        self.hz = hz
+        self.root = root.rstrip(os.sep) + os.sep if root else ""
+        self.flush_interval = flush_interval
+        self.counts: dict[str, int] = {}
+        self._labels: dict[object, str] = {}
+        self._thread_clocks: dict[int, float] = {}  # CPU time of every thread at the last sample
+        self._carry: dict[int, float] = {}  # CPU time not counted yet, in samples
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="smaug-profiler", daemon=True)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if self.root and filename.startswith(self.root):
+                filename = filename[len(self.root):]
+            else:
+                # shorten library paths to their import path
+                prefixes = [entry for entry in sys.path if entry and filename.startswith(entry)]
+                if prefixes:
+                    filename = filename[len(max(prefixes, key=len)):].lstrip(os.sep)
+            # ';' separates the frames, the count follows the last space
+            label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def _fold(self, frame) -> str:
+        stack = []
+        while frame is not None:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _get_cpu_samples(self, thread_id: int, clocks: dict[int, float]) -> int:
+        """Return the samples of CPU time a thread used since the previous sample."""
+        try:
+            clock = time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+        except (OSError, AttributeError):
+            return 1  # no per-thread clock, count the thread once
+        clocks[thread_id] = clock
+        carry = self._carry.get(thread_id, 0.0)
+        carry += (clock - self._thread_clocks.get(thread_id, clock)) * self.hz
+        samples = int(carry)
+        self._carry[thread_id] = carry - samples
+        return samples
+
+    def sample(self) -> None:
+        clocks: dict[int, float] = {}
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        # the threads of the injected helpers are not part of the script
+        helpers = {
+            thread.ident for thread in threading.enumerate() if thread.name.startswith("smaug-")
+        }
+        with self._lock:
+            for thread_id, frame in frames.items():
+                if thread_id in helpers:
+                    continue
+                samples = self._get_cpu_samples(thread_id, clocks)
+                if samples:
+                    stack = self._fold(frame)
+                    self.counts[stack] = self.counts.get(stack, 0) + samples
+        self._thread_clocks = clocks
+        self._carry = {thread_id: self._carry[thread_id] for thread_id in clocks}
+
+    def start(self) -> None:
+        # threads inherit the signal mask, block SIGPROF before any other thread starts
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGPROF})
+        self._thread.start()
+        period = 1 / self.hz
+        signal.setitimer(signal.ITIMER_PROF, period, period)
+        atexit.register(self.stop)
+        os.register_at_fork(after_in_child=self._forget)
+
+    def _forget(self) -> None:
+        # a forked child has no sampler thread and must not write to the parent's pipe
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGPROF})
+        self.fd = None
+
+    def flush(self) -> None:
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        if self.fd is None or not counts:
+            return
+        data = "".join(f"{stack} {count}\n" for stack, count in counts.items())
+        try:
+            _write_all(self.fd, data.encode())
+        except OSError:
+            self.fd = None  # Smaug went away
+
+    def _run(self) -> None:
+        last_flush = time.monotonic()
+        while not self._stop_event.is_set():
+            timeout = max(0.0, last_flush + self.flush_interval - time.monotonic())
+            if signal.sigtimedwait({signal.SIGPROF}, timeout) is not None:
+                self.sample()
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def stop(self) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        self._stop_event.set()
+        self._thread.join(self.flush_interval + 1)
+        self.flush()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def start(fd: int, hz: float, root: str = "") -> Sampler:
+    global _sampler  # pylint: disable=global-statement
+    os.set_inheritable(fd, False)
+    _sampler = Sampler(fd, hz, root)
+    _sampler.start()
+    return _sampler
@@ -0,0 +1,182 @@
+"""Telemetry shim that Smaug injects into the scripts it runs with --telemetry.
+
+Smaug creates a shared memory segment per instance; the shim maps it and
+writes every metric into a fixed slot, so publishing a value is a plain
+memory write and Smaug reads all of them on each tick without a system call.
+The shim publishes GC collections and pause times on its own, from a gc
+callback; it starts no thread. Scripts can publish their own metrics::
+
+    try:
+        import smaug_telemetry
+    except ImportError:  # not run by Smaug with --telemetry
+        smaug_telemetry = None
+
+    if smaug_telemetry is not None:
+        items = smaug_telemetry.counter("items")  # Smaug shows the total and the rate
+        items.add()
+        smaug_telemetry.gauge("queue size").set(len(queue))
+        smaug_telemetry.watch_event_loop()  # from a coroutine, reports the loop lag
+
+In the processes the scripts start, once the segment is full and in forked
+children, the metrics are written to a scratch buffer and the calls cost the
+same.
+
+This module defines the segment layout, core/telemetry.py imports it:
+a header (magic, version, slot capacity, published slots) followed by 64-byte
+slots (NUL-padded UTF-8 name, kind, float64 value). A slot is written before
+the published count covers it.
+"""
+
+import gc
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"SMTL"
+VERSION = 1
+# magic, version, slot capacity, published slots
+HEADER_STRUCT = struct.Struct("<4sHHI")
+COUNT_OFFSET = 8
+HEADER_SIZE = 16
+# name, kind, value
+SLOT_STRUCT = struct.Struct("<48sB7xd")
+VALUE_OFFSET = 56
+VALUE_STRUCT = struct.Struct("<d")
+COUNT_STRUCT = struct.Struct("<I")
+GAUGE, COUNTER = 0, 1
+SHM_DIR = "/dev/shm"
+
+_channel = None
+
+
+class _Scratch:
+    """Where the metrics go outside of Smaug, once the segment is full or after a fork."""
+
+    def __init__(self, size: int = VALUE_STRUCT.size):
+        self.buffer = bytearray(size)
+
+
+class Gauge:
+    """A value that is overwritten, e.g. a queue size."""
+
+    def __init__(self, channel, offset: int):
+        self._channel = channel
+        self._offset = offset
+
+    def set(self, value: float) -> None:
+        VALUE_STRUCT.pack_into(self._channel.buffer, self._offset, value)
+
+
+class Counter:
+    """A total that only grows, e.g. processed items; Smaug also shows its rate."""
+
+    def __init__(self, channel, offset: int):
+        self._channel = channel
+        self._offset = offset
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def add(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+            VALUE_STRUCT.pack_into(self._channel.buffer, self._offset, self.value)
+
+
+class Channel:
+
+    def __init__(self, buffer):
+        magic, version, self.capacity, self.count = HEADER_STRUCT.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a Smaug telemetry segment")
+        self.buffer = buffer
+        self._metrics: dict[str, Gauge | Counter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, kind: int) -> Gauge | Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                channel, offset = _Scratch(), 0
+                if self.count < self.capacity:
+                    slot = HEADER_SIZE + self.count * SLOT_STRUCT.size
+                    SLOT_STRUCT.pack_into(self.buffer, slot, name.encode()[:48], kind, 0.0)
+                    self.count += 1
+                    COUNT_STRUCT.pack_into(self.buffer, COUNT_OFFSET, self.count)
+                    channel, offset = self, slot + VALUE_OFFSET
+                metric = Counter(channel, offset) if kind == COUNTER else Gauge(channel, offset)
+                self._metrics[name] = metric
+            return metric
+
+    def detach(self) -> None:
+        # the mapping is shared with the parent after a fork; the child writes elsewhere
+        self.buffer = bytearray(len(self.buffer))
+        self.capacity = 0
+
+
+def gauge(name: str) -> Gauge:
+    if _channel is None:
+        return Gauge(_Scratch(), 0)
+    return _channel.get(name, GAUGE)
+
+
+def counter(name: str) -> Counter:
+    if _channel is None:
+        return Counter(_Scratch(), 0)
+    return _channel.get(name, COUNTER)
+
+
+def watch_event_loop(loop=None, interval: float = 0.1) -> None:
+    """Report how late the callbacks of an asyncio loop run, as ``event loop lag`` in ms."""
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    loop = loop or asyncio.get_running_loop()
+    lag = gauge("event loop lag")
+
+    def check(expected: float) -> None:
+        lag.set(max(0.0, loop.time() - expected) * 1000)
+        due = loop.time() + interval
+        loop.call_at(due, check, due)
+
+    check(loop.time())
+
+
+class _GCWatcher:
+
+    def __init__(self):
+        self.collections = counter("gc collections")
+        self.pause_time = counter("gc pause time")  # ms
+        self.max_pause = gauge("gc max pause")  # ms
+        self._max_pause = 0.0
+        self._started = 0.0
+
+    def __call__(self, phase: str, info: dict) -> None:
+        if phase == "start":
+            self._started = time.perf_counter()
+            return
+        pause = (time.perf_counter() - self._started) * 1000
+        self.collections.add()
+        self.pause_time.add(pause)
+        if pause > self._max_pause:
+            self._max_pause = pause
+            self.max_pause.set(pause)
+
+
+def connect(name: str) -> Channel:
+    """Map the segment Smaug created and start publishing the built-in metrics.
+
+    The segment is mapped directly rather than through SharedMemory, which
+    registers it with a resource tracker that starts a process of its own
+    and unlinks the segment when the script exits; Smaug owns the segment.
+    """
+    global _channel  # pylint: disable=global-statement
+    fd = os.open(os.path.join(SHM_DIR, name.lstrip("/")), os.O_RDWR)
+    try:
+        buffer = mmap.mmap(fd, 0)
+    finally:
+        os.close(fd)
+    _channel = Channel(buffer)
+    os.register_at_fork(after_in_child=_channel.detach)
+    gc.callbacks.append(_GCWatcher())
+    return _channel
@@ -1,8 +1,11 @@
 """This module contains classes for metrics and metric lists."""
 
+from array import array
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Iterable
 import pickle
+import struct
+import sys
 
 
 MAX_VALUES = {
@@ -13,6 +16,15 @@ MAX_VALUES = {
     "swap memory usage": 100,
     "swap memory usage average": 100,
     "disk usage": 100,
+    "device utilization": 100,
+    "cpu user": 100,
+    "cpu system": 100,
+    "cpu iowait": 100,
+    "cpu steal": 100,
+    "core usage": 100,
+    "instance cpu share": 100,
+    "instance busiest thread": 100,
+    "tree cpu share": 100,
 }
 QUANTITIES = {
     "cpu usage": "%",
@@ -25,33 +37,205 @@ QUANTITIES = {
     "disk usage difference": "%",
     "execution time": "s",
     "total thread usage": "n",
-    "app size":"B"
+    "app size":"B",
+    "staging time": "s",
+    "cpu user": "%",
+    "cpu system": "%",
+    "cpu iowait": "%",
+    "cpu steal": "%",
+    "core usage": "%",
+    "instance cpu usage": "%",
+    "instance cpu share": "%",
+    "instance user cpu": "%",
+    "instance system cpu": "%",
+    "instance busiest thread": "%",
+    "instance active threads": "n",
+    "instance rss": "B",
+    "instance pss": "B",
+    "instance peak rss": "B",
+    "instance traced memory": "B",
+    "instance traced peak": "B",
+    "tree cpu usage": "%",
+    "tree cpu share": "%",
+    "tree rss": "B",
+    "tree pss": "B",
+    "tree peak rss": "B",
+    "network receive rate": "B/s",
+    "network transmit rate": "B/s",
+    "network receive packets": "n/s",
+    "network transmit packets": "n/s",
+    "instance receive rate": "B/s",
+    "instance transmit rate": "B/s",
+    "instance read rate": "B/s",
+    "instance write rate": "B/s",
+    "instance cancelled write rate": "B/s",
+    "instance read syscalls": "n/s",
+    "instance write syscalls": "n/s",
+    "tree read rate": "B/s",
+    "tree write rate": "B/s",
+    "device read rate": "B/s",
+    "device write rate": "B/s",
+    "device utilization": "%",
+    "device queue depth": "n",
+    "device latency": "ms",
+    "smaug cpu usage": "%",
+    "smaug cpu time": "s",
+    "smaug rss": "B",
+    "smaug threads": "n",
+    "smaug tick jitter": "ms",
+    "smaug missed ticks": "n",
+    "smaug collector latency": "ms",
+    "smaug render time": "ms",
+    "smaug dropped frames": "n",
+    "instance gc collections": "n",
+    "instance gc collections rate": "n/s",
+    "instance gc pause time": "ms",
+    "instance gc pause time rate": "ms/s",
+    "instance gc max pause": "ms",
+    "instance event loop lag": "ms",
 }
+AGGREGATE_SUFFIXES = ("average", "min", "max", "stddev", "p50", "p95", "p99")
 
+# binary metric: epoch (int64), interval (float64), value kind, name length,
+# then the name and the value
+METRIC_HEADER_STRUCT = struct.Struct("<qdBH")
+VALUE_INT = 0
+VALUE_FLOAT = 1
+VALUE_STR = 2
+VALUE_PICKLE = 3
+INT_STRUCT = struct.Struct("<q")
+FLOAT_STRUCT = struct.Struct("<d")
+LENGTH_STRUCT = struct.Struct("<I")
 
-@dataclass
+# binary batch: sample count and size of the names, then the names separated by
+# NUL bytes, padded to 8 bytes, then the epochs (int64) and values (float64)
+BATCH_HEADER_STRUCT = struct.Struct("<II")
+
+
+def get_base_name(name: str) -> str:
+    """Strip aggregate and window suffixes, e.g. 'cpu usage p95 60s' -> 'cpu usage'.
+
+    Per-instance and per-core names lose their number: 'instance 4242 rss' -> 'instance rss',
+    per-interface and per-device names their interface or device:
+    'network eth0 drops' -> 'network drops', 'device sda latency' -> 'device latency'.
+    """
+    words = name.split(" ")
+    if len(words) > 2 and words[0] in ("instance", "core") and words[1].isdigit():
+        words = words[:1] + words[2:]
+    elif len(words) > 2 and words[0] in ("network", "device"):
+        words = words[:1] + words[2:]
+    window = words[-1][:-1].replace(".", "", 1)
+    if len(words) > 1 and words[-1].endswith("s") and window.isdigit():
+        words = words[:-1]
+    if len(words) > 1 and words[-1] in AGGREGATE_SUFFIXES:
+        words = words[:-1]
+    if len(words) > 3 and words[:2] == ["smaug", "collector"]:
+        # collector names may contain spaces, e.g. 'smaug collector disk io latency'
+        words = words[:2] + words[-1:]
+    return " ".join(words)
+
+
+def get_instance_pid(name: str) -> int | None:
+    """Return the pid of a per-instance metric, e.g. 'instance 4242 rss' -> 4242."""
+    words = name.split(" ", 2)
+    if len(words) > 2 and words[0] == "instance" and words[1].isdigit():
+        return int(words[1])
+    return None
+
+
+def get_max_value(name: str) -> int | float:
+    return MAX_VALUES.get(name, MAX_VALUES.get(get_base_name(name), 0))
+
+
+def get_quantity(name: str) -> str:
+    base_name = get_base_name(name)
+    if name not in QUANTITIES and base_name not in QUANTITIES and base_name.endswith(" rate"):
+        # the rate of a counter the scripts publish, e.g. 'instance 4242 items rate'
+        return "n/s"
+    return QUANTITIES.get(name, QUANTITIES.get(base_name, "n"))
+
+
+def to_little_endian(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def cast_little_endian(column: memoryview, typecode: str) -> memoryview:
+    """View little-endian bytes as numbers, without a copy on little-endian hosts."""
+    if sys.byteorder != "little":
+        swapped = array(typecode, column.tobytes())
+        swapped.byteswap()
+        return memoryview(swapped)
+    return column.cast(typecode)
+
+
+@dataclass(slots=True)
 class Metric:
 
     name: str
     value: Any
     epoch: int
+    interval: float = 0.0  # seconds since the previous sample of the metric, 0 if unknown
+
+    def __post_init__(self):
+        # the same names come back every tick, share one string per name
+        self.name = sys.intern(self.name)
 
     @classmethod
     def from_dict(cls, data: dict[str, Any]) -> "Metric":
-        return cls(data["name"], data["value"], data["epoch"])
+        return cls(data["name"], data["value"], data["epoch"], data.get("interval", 0.0))
 
     def to_dict(self) -> dict[str, Any]:
-        return {"name": self.name, "value": self.value, "epoch": self.epoch}
+        return {"name": self.name, "value": self.value, "epoch": self.epoch,
+                "interval": self.interval}
 
     def keys(self) -> list[str]:
         return self.to_dict().keys()
 
     def to_bytes(self) -> bytes:
-        return pickle.dumps(self.to_dict())
+        name = self.name.encode()
+        value = self.value
+        kind, payload = VALUE_PICKLE, None
+        if type(value) is int and -2**63 <= value < 2**63:  # not bool
+            kind, payload = VALUE_INT, INT_STRUCT.pack(value)
+        elif type(value) is float:
+            kind, payload = VALUE_FLOAT, FLOAT_STRUCT.pack(value)
+        elif type(value) is str:
+            encoded = value.encode()
+            kind, payload = VALUE_STR, LENGTH_STRUCT.pack(len(encoded)) + encoded
+        else:
+            encoded = pickle.dumps(value)
+            payload = LENGTH_STRUCT.pack(len(encoded)) + encoded
+        header = METRIC_HEADER_STRUCT.pack(self.epoch, self.interval, kind, len(name))
+        return header + name + payload
+
+    @classmethod
+    def unpack_from(cls, buffer, offset: int = 0) -> tuple["Metric", int]:
+        """Decode the metric at ``offset`` of a buffer, return it and the offset after it."""
+        data = memoryview(buffer)
+        epoch, interval, kind, name_size = METRIC_HEADER_STRUCT.unpack_from(data, offset)
+        offset += METRIC_HEADER_STRUCT.size
+        name = str(data[offset:offset + name_size], "utf-8")
+        offset += name_size
+        if kind == VALUE_INT:
+            value = INT_STRUCT.unpack_from(data, offset)[0]
+            offset += INT_STRUCT.size
+        elif kind == VALUE_FLOAT:
+            value = FLOAT_STRUCT.unpack_from(data, offset)[0]
+            offset += FLOAT_STRUCT.size
+        else:
+            size = LENGTH_STRUCT.unpack_from(data, offset)[0]
+            offset += LENGTH_STRUCT.size
+            payload = data[offset:offset + size]
+            value = str(payload, "utf-8") if kind == VALUE_STR else pickle.loads(payload)
+            offset += size
+        return cls(name, value, epoch, interval), offset
 
     @classmethod
     def from_bytes(cls, data: bytes) -> "Metric":
-        return cls.from_dict(pickle.loads(data))
+        return cls.unpack_from(data)[0]
 
     def __str__(self) -> str:
         return f"{self.name}: {self.value} (epoch {self.epoch})"
@@ -60,23 +244,172 @@ class Metric:
         return str(self)
 
 
+def _reindexing(method):
+    """Wrap a list method that moves metrics around to rebuild the name index."""
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._reindex()
+        return result
+
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
 class MetricList(list):
+    """Metrics with unique names and a name to position index for get()."""
+
+    __slots__ = ("_index",)
 
-    def __init__(self, metrics: list[Metric] | None = None):
+    def __init__(self, metrics: Iterable[Metric] | None = None):
         if metrics is None:
             metrics = []
         super().__init__(metrics)
-        if len(set([metric.name for metric in self])) != len(self):
+        if isinstance(metrics, MetricList):
+            self._index = dict(metrics._index)
+        else:
+            self._reindex()
+
+    def _reindex(self) -> None:
+        index = {metric.name: position for position, metric in enumerate(self)}
+        if len(index) != len(self):
             raise ValueError("All metrics should have unique names")
+        self._index = index
+
+    def append(self, metric: Metric) -> None:
+        if metric.name in self._index:
+            raise ValueError(f"Metric {metric.name} already exists")
+        self._index[metric.name] = len(self)
+        super().append(metric)
+
+    def extend(self, metrics: Iterable[Metric]) -> None:
+        for metric in metrics:
+            self.append(metric)
+
+    def __iadd__(self, metrics: Iterable[Metric]) -> "MetricList":
+        self.extend(metrics)
+        return self
+
+    def __add__(self, metrics: Iterable[Metric]) -> "MetricList":
+        result = MetricList(self)
+        result.extend(metrics)
+        return result
+
+    insert = _reindexing(list.insert)
+    remove = _reindexing(list.remove)
+    pop = _reindexing(list.pop)
+    clear = _reindexing(list.clear)
+    sort = _reindexing(list.sort)
+    reverse = _reindexing(list.reverse)
+    __setitem__ = _reindexing(list.__setitem__)
+    __delitem__ = _reindexing(list.__delitem__)
 
     def get(self, name: str) -> Metric:
-        for metric in self:
-            if metric.name == name:
-                return metric
-        raise ValueError(f"Metric {name} not found")
+        position = self._index.get(name)
+        if position is None:
+            raise ValueError(f"Metric {name} not found")
+        return self[position]
+
+    def __contains__(self, item) -> bool:
+        if isinstance(item, str):
+            return item in self._index
+        return super().__contains__(item)
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+    def to_bytes(self) -> bytes:
+        return LENGTH_STRUCT.pack(len(self)) + b"".join(metric.to_bytes() for metric in self)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "MetricList":
+        count = LENGTH_STRUCT.unpack_from(data)[0]
+        offset = LENGTH_STRUCT.size
+        metrics = []
+        for _ in range(count):
+            metric, offset = Metric.unpack_from(data, offset)
+            metrics.append(metric)
+        return cls(metrics)
 
     def __str__(self) -> str:
         return "\n".join([str(metric) for metric in self])
 
     def __repr__(self) -> str:
         return str(self)
+
+
+class MetricBatch:
+    """Numeric samples as columns: one list of names and arrays of epochs and values.
+
+    The binary encoding stores the columns as they are, so from_bytes() views
+    the epochs and values of a buffer without copying them; such a batch is
+    read-only.
+    """
+
+    __slots__ = ("names", "epochs", "values", "_index")
+
+    def __init__(self, names: list[str] | None = None, epochs=None, values=None):
+        self.names = [sys.intern(name) for name in names or []]
+        self.epochs = epochs if epochs is not None else array("q")
+        self.values = values if values is not None else array("d")
+        if not len(self.names) == len(self.epochs) == len(self.values):
+            raise ValueError("All columns should have the same length")
+        self._index = {name: position for position, name in enumerate(self.names)}
+        if len(self._index) != len(self.names):
+            raise ValueError("All metrics should have unique names")
+
+    @classmethod
+    def from_metrics(cls, metrics: Iterable[Metric]) -> "MetricBatch":
+        """Build a batch of the numeric metrics, other values are left out."""
+        batch = cls()
+        for metric in metrics:
+            if isinstance(metric.value, (int, float)) and not isinstance(metric.value, bool):
+                batch.append(metric.name, float(metric.value), metric.epoch)
+        return batch
+
+    def append(self, name: str, value: float, epoch: int) -> None:
+        if name in self._index:
+            raise ValueError(f"Metric {name} already exists")
+        self._index[name] = len(self.names)
+        self.names.append(sys.intern(name))
+        self.epochs.append(epoch)
+        self.values.append(value)
+
+    def get(self, name: str) -> Metric:
+        position = self._index.get(name)
+        if position is None:
+            raise ValueError(f"Metric {name} not found")
+        return Metric(name, self.values[position], self.epochs[position])
+
+    def to_metrics(self) -> MetricList:
+        return MetricList(map(Metric, self.names, self.values, self.epochs))
+
+    def to_bytes(self) -> bytes:
+        names = b"\0".join(name.encode() for name in self.names)
+        padding = -(BATCH_HEADER_STRUCT.size + len(names)) % 8
+        return b"".join([
+            BATCH_HEADER_STRUCT.pack(len(self.names), len(names)),
+            names,
+            b"\0" * padding,
+            to_little_endian(array("q", self.epochs)),
+            to_little_endian(array("d", self.values)),
+        ])
+
+    @classmethod
+    def from_bytes(cls, buffer) -> "MetricBatch":
+        data = memoryview(buffer)
+        count, names_size = BATCH_HEADER_STRUCT.unpack_from(data)
+        offset = BATCH_HEADER_STRUCT.size
+        names = str(data[offset:offset + names_size], "utf-8").split("\0") if count else []
+        offset += names_size
+        offset += -offset % 8
+        epochs = cast_little_endian(data[offset:offset + count * 8], "q")
+        offset += count * 8
+        values = cast_little_endian(data[offset:offset + count * 8], "d")
+        return cls(names, epochs, values)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.to_metrics())
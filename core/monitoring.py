@@ -1,13 +1,15 @@
 
 import os
-import subprocess
 import threading
 import time
 from abc import abstractmethod, ABC
 from types import TracebackType
 from typing import Type, Optional
 
-from .metrics import Metric, MetricList
+from . import procfs
+from .aggregates import BatchAggregates
+from .metrics import Metric, MetricList, get_instance_pid
+from .scheduler import Scheduler, TickContext
 from .storage import BatchTempStorage
 from .logger import setup_logger
 
@@ -16,18 +18,32 @@ logger = setup_logger(f"smaug_{os.getpid()}")
 
 class StaticMonitor(ABC):
 
-    def __init__(self):
+    def __init__(self, interval: float = 0.5, records_ttl: float = 0.5):
         logger.info("Initializing StaticMonitor for %s", self.__class__.__name__)
         self.start_time = time.time()
+        self.interval = interval
+        self.records_ttl = records_ttl
         self.first_records = self.record_stats()
+        self._last_records = self.first_records
+        self._last_records_time = time.monotonic()
         logger.info("Initialized StaticMonitor for %s", self.__class__.__name__)
 
     @property
     def last_records(self) -> MetricList[Metric]:
-        return self.record_stats()
+        if time.monotonic() - self._last_records_time > self.records_ttl:
+            return self.update()
+        return self._last_records
+
+    def update(self, context: TickContext | None = None) -> MetricList[Metric]:
+        self._last_records = self.record_stats(context)
+        self._last_records_time = time.monotonic()
+        return self._last_records
+
+    def collect(self, context: TickContext) -> MetricList[Metric]:
+        return self.update(context)
 
     @abstractmethod
-    def record_stats(self) -> MetricList[Metric]:
+    def record_stats(self, context: TickContext | None = None) -> MetricList[Metric]:
         pass
 
     @abstractmethod
@@ -37,119 +53,202 @@ class StaticMonitor(ABC):
 
 class LiveMonitor(ABC):
 
-    def __init__(self):
+    def __init__(self, windows: tuple[float, ...] = (), interval: float = 0.1):
         logger.info("Initializing LiveMonitor for %s", self.__class__.__name__)
         self.stop_flag = None
-        self.time_point = 0.1  # 0.1 seconds
+        self.interval = interval
         self.temp_storages = BatchTempStorage()
-        self.collect_data_thread = threading.Thread(
-            target=self._save_stats_periodically
-        )
-        self.collect_data_thread.start()
+        self.aggregates = BatchAggregates(windows)
+        self.last_records = MetricList()
+        self._last_sample: float | None = None
+        self._released_pids: set[int] = set()
+        self._records_lock = threading.Lock()
         logger.info("Initialized LiveMonitor for %s", self.__class__.__name__)
 
-    def _save_stats_periodically(self) -> None:
-        logger.info("Starting the monitoring thread for %s", self.__class__.__name__)
-        while not self.stop_flag:
-            records = self.record_stats()
+    def collect(self, context: TickContext) -> MetricList[Metric]:
+        if self.stop_flag:
+            return self.last_records
+        records = self.record_stats(context)
+        self.last_records = records
+        # the sampling interval adapts, weight every sample by the time it stands for
+        interval = self.interval
+        if self._last_sample is not None:
+            interval = context.monotonic - self._last_sample
+        self._last_sample = context.monotonic
+        with self._records_lock:
             for record in records:
-                self.temp_storages[record.name].save_record(record)
-                time.sleep(self.time_point)
+                record.interval = interval
+                pid = get_instance_pid(record.name)
+                if pid is None:
+                    self.temp_storages[record.name].save_record(record)
+                elif pid in self._released_pids:
+                    continue  # sampled before its instance was untracked
+                # per-instance metrics only live as long as their instance, in memory
+                self.aggregates[record.name].add(float(record.value), context.timestamp,
+                                                 interval)
+        return records
+
+    def release_instance(self, pid: int) -> None:
+        """Drop the aggregates of an untracked instance."""
+        with self._records_lock:
+            self._released_pids.add(pid)
+            for name in [name for name in self.aggregates if get_instance_pid(name) == pid]:
+                del self.aggregates[name]
+
+    def reuse_instance(self, pid: int) -> None:
+        """Record the metrics of a tracked instance again, e.g. one with a reused pid."""
+        with self._records_lock:
+            self._released_pids.discard(pid)
 
     @abstractmethod
-    def record_stats(self) -> list[Metric]:
+    def record_stats(self, context: TickContext | None = None) -> MetricList[Metric]:
         pass
 
     @abstractmethod
     def get_average(self) -> float:
         pass
 
+    def get_summary(self, name: str, window: float | None = None) -> dict[str, float]:
+        return {
+            key: round(value, 3)
+            for key, value in self.aggregates[name].summary(window).items()
+        }
+
     def stop(self) -> None:
         self.stop_flag = True
-        logger.info("Stopping the monitoring thread for %s", self.__class__.__name__)
-
-    def is_thread_alive(self) -> bool:
-        return self.collect_data_thread.is_alive()
+        logger.info("Stopping the monitoring for %s", self.__class__.__name__)
 
 
 class CPUMonitor(LiveMonitor):
-
-    def record_stats(self):
-        cpu_times1 = self._get_cpu_times()
-        time.sleep(self.time_point)
-        cpu_times2 = self._get_cpu_times()
-        cpu_delta = [t2 - t1 for t1, t2 in zip(cpu_times1, cpu_times2)]
-        total_time = sum(cpu_delta)
-        idle_time_list_n = 3
-        idle_time = cpu_delta[idle_time_list_n]
-        cpu_usage = (
-            (total_time - idle_time) / total_time * 100 if total_time != 0 else 0
-        )
-        cpu_usage = round(cpu_usage, 3)
-        return MetricList([Metric("cpu usage", cpu_usage, int(time.time()))])
-
-    def _get_cpu_times(self) -> list[int]:
-        with open("/proc/stat", "r", encoding="utf-8") as file:
-            cpu_line = file.readline()
-        return list(map(int, cpu_line.split()[1:]))
+    """Host CPU usage, its user/system/iowait/steal split and the usage of every core.
+
+    With ``subtract_self`` the time Smaug itself spent is taken out of the host
+    usage and its split; the per-core usage is left as it is.
+    """
+
+    def __init__(self, windows: tuple[float, ...] = (), interval: float = 0.1,
+                 subtract_self: bool = False):
+        self.subtract_self = subtract_self
+        # primed, so that the first sample is a delta rather than the average since boot
+        context = TickContext()
+        self._last_cpu_times = self._get_all_cpu_times(context)
+        self._last_self_times = procfs.get_cpu_times(os.getpid(), context.read_bytes)
+        super().__init__(windows, interval)
+
+    def _get_self_delta(self, context: TickContext) -> tuple[int, int]:
+        """Return the user and system ticks Smaug spent since the previous tick."""
+        self_times = procfs.get_cpu_times(os.getpid(), context.read_bytes)
+        last_user, last_system = self._last_self_times
+        self._last_self_times = self_times
+        return self_times[0] - last_user, self_times[1] - last_system
+
+    def _get_usage(self, name: str, cpu_times: list[int]) -> tuple[list[int], int]:
+        """Return the time deltas of a cpu line since the previous tick and their total."""
+        # a core that came online since the previous tick is measured from boot
+        last_cpu_times = self._last_cpu_times.get(name) or [0] * len(cpu_times)
+        cpu_delta = [t2 - t1 for t1, t2 in zip(last_cpu_times, cpu_times)]
+        return cpu_delta, sum(cpu_delta)
+
+    def record_stats(self, context=None):
+        context = context or TickContext()
+        all_cpu_times = self._get_all_cpu_times(context)
+        metrics = MetricList()
+        for name, cpu_times in all_cpu_times.items():
+            cpu_delta, total_time = self._get_usage(name, cpu_times)
+            idle_time = cpu_delta[procfs.CPU_IDLE]
+            cpu_usage = (
+                (total_time - idle_time) / total_time * 100 if total_time != 0 else 0
+            )
+            if name != "cpu":
+                metrics.append(
+                    Metric(f"core {name[3:]} usage", round(cpu_usage, 3), context.epoch)
+                )
+                continue
+            split = {
+                "user": cpu_delta[procfs.CPU_USER] + cpu_delta[procfs.CPU_NICE],
+                "system": (cpu_delta[procfs.CPU_SYSTEM] + cpu_delta[procfs.CPU_IRQ]
+                           + cpu_delta[procfs.CPU_SOFTIRQ]),
+                "iowait": cpu_delta[procfs.CPU_IOWAIT],
+                "steal": cpu_delta[procfs.CPU_STEAL] if len(cpu_delta) > procfs.CPU_STEAL else 0,
+            }
+            if self.subtract_self and total_time:
+                self_user, self_system = self._get_self_delta(context)
+                split["user"] = max(0, split["user"] - self_user)
+                split["system"] = max(0, split["system"] - self_system)
+                busy_time = max(0, total_time - idle_time - self_user - self_system)
+                cpu_usage = busy_time / total_time * 100
+            metrics.append(Metric("cpu usage", round(cpu_usage, 3), context.epoch))
+            metrics.extend(
+                Metric(f"cpu {key}", round(value / total_time * 100 if total_time else 0, 3),
+                       context.epoch)
+                for key, value in split.items()
+            )
+        self._last_cpu_times = all_cpu_times
+        return metrics
+
+    def _get_all_cpu_times(self, context: TickContext | None = None) -> dict[str, list[int]]:
+        return procfs.read_cpu_times((context or TickContext()).read_bytes)
+
+    def _get_cpu_times(self, context: TickContext | None = None) -> list[int]:
+        return self._get_all_cpu_times(context)["cpu"]
 
     def get_average(self):
-        records = self.temp_storages["cpu usage"].get_last_records()
-        values = [float(record.value) for record in records]
-        return round(sum(values) / len(values),3) if values else 0
+        return round(self.aggregates["cpu usage"].mean(), 3)
 
 
 class MemoryMonitor(LiveMonitor):
+    """Host memory and swap usage; ``subtract_self`` leaves out the RSS of Smaug."""
 
-    def get_virtual_memory_usage(self) -> float:
-        with open("/proc/meminfo", "r", encoding="utf-8") as mem:
-            lines = mem.readlines()
+    meminfo_fields = ("MemTotal", "MemFree", "Buffers", "Cached", "SwapTotal", "SwapFree")
 
-        meminfo = {
-            line.split(":")[0]: int(line.split(":")[1].strip().split(" ")[0]) for line in lines
-        }
+    def __init__(self, windows: tuple[float, ...] = (), interval: float = 0.1,
+                 subtract_self: bool = False):
+        self.subtract_self = subtract_self
+        super().__init__(windows, interval)
+
+    def _get_meminfo(self, context: TickContext | None = None) -> dict[str, int]:
+        return (context or TickContext()).read_fields("/proc/meminfo", self.meminfo_fields)
+
+    def get_virtual_memory_usage(self, context: TickContext | None = None) -> float:
+        meminfo = self._get_meminfo(context)
         total_memory = meminfo["MemTotal"]
         free_memory = meminfo["MemFree"]
         buffers = meminfo["Buffers"]
         cached = meminfo["Cached"]
         used_memory = total_memory - free_memory - buffers - cached
+        if self.subtract_self:
+            _, self_rss, _ = procfs.read_statm(os.getpid(), (context or TickContext()).read_bytes)
+            # meminfo counts kB
+            used_memory = max(0, used_memory - self_rss // 1024)
         memory_usage = (
             round(used_memory / total_memory * 100, 4) if total_memory != 0 else 0
         )
         return memory_usage
 
-    def get_swap_memory_usage(self) -> float:
-        with open("/proc/meminfo", "r", encoding="utf-8") as mem:
-            lines = mem.readlines()
-
-        meminfo = {
-            line.split(":")[0]: int(line.split(":")[1].strip().split(" ")[0]) for line in lines
-        }
+    def get_swap_memory_usage(self, context: TickContext | None = None) -> float:
+        meminfo = self._get_meminfo(context)
         total_swap = meminfo["SwapTotal"]
         free_swap = meminfo["SwapFree"]
         used_swap = total_swap - free_swap
         swap_usage = round(used_swap / total_swap * 100, 4) if total_swap != 0 else 0
         return swap_usage
 
-    def record_stats(self):
-        virtual_memory_usage = round(self.get_virtual_memory_usage(), 3)
-        swap_memory_usage = round(self.get_swap_memory_usage(), 3)
+    def record_stats(self, context=None):
+        context = context or TickContext()
+        virtual_memory_usage = round(self.get_virtual_memory_usage(context), 3)
+        swap_memory_usage = round(self.get_swap_memory_usage(context), 3)
         return MetricList(
             [
-                Metric("memory usage", virtual_memory_usage, int(time.time())),
-                Metric("swap memory usage", swap_memory_usage, int(time.time())),
+                Metric("memory usage", virtual_memory_usage, context.epoch),
+                Metric("swap memory usage", swap_memory_usage, context.epoch),
             ]
         )
 
     def _get_memory_usage_avg(self) -> float:
-        records = self.temp_storages["memory usage"].get_last_records()
-        values = [float(record.value) for record in records]
-        return round(sum(values) / len(values),3) if values else 0
+        return round(self.aggregates["memory usage"].mean(), 3)
 
     def _get_swap_memory_usage_avg(self) -> float:
-        records = self.temp_storages["swap memory usage"].get_last_records()
-        values = [float(record.value) for record in records]
-        return round(sum(values) / len(values),3) if values else 0
+        return round(self.aggregates["swap memory usage"].mean(), 3)
 
     def get_average(self):
         return {
@@ -158,6 +257,435 @@ class MemoryMonitor(LiveMonitor):
         }
 
 
+class InstanceMonitor(LiveMonitor):
+    """Resource usage of the launched scripts and all of their descendants."""
+
+    def __init__(self, windows: tuple[float, ...] = (), interval: float = 0.1):
+        self.root_pids: list[int] = []
+        self._cpu_ticks: dict[int, tuple[int, int]] = {}
+        self._thread_ticks: dict[tuple[int, int], int] = {}  # by pid and tid
+        self._last_sample_time = time.monotonic()
+        self._peak_rss: dict[int, int] = {}
+        self._tree_peak_rss = 0
+        self._lock = threading.Lock()
+        super().__init__(windows, interval)
+        # the monitors that report per-instance metrics of the tracked instances
+        self.dependents: list[LiveMonitor] = [self]
+
+    def track(self, pid: int) -> None:
+        with self._lock:
+            self.root_pids.append(pid)
+            self._peak_rss[pid] = 0
+        for monitor in self.dependents:
+            monitor.reuse_instance(pid)
+        logger.info("Tracking process tree of %s", pid)
+
+    def untrack(self, pid: int) -> None:
+        with self._lock:
+            if pid in self.root_pids:
+                self.root_pids.remove(pid)
+            self._peak_rss.pop(pid, None)
+        for monitor in self.dependents:
+            monitor.release_instance(pid)
+        logger.info("Stopped tracking process tree of %s", pid)
+
+    def _sample_process(self, pid: int, context: TickContext) -> dict[str, int] | None:
+        try:
+            user_ticks, system_ticks = procfs.get_cpu_times(pid, context.read_bytes)
+            threads = procfs.get_thread_cpu_ticks(pid, context.read_bytes)
+            _, rss, _ = procfs.read_statm(pid, context.read_bytes)
+            hwm = procfs.read_status(
+                pid, ("VmHWM",), context.read_bytes
+            ).get("VmHWM", rss)
+        except (OSError, ValueError, IndexError):
+            return None  # the process exited while it was being read
+        pss = procfs.read_pss(pid, context.read_bytes)
+        return {
+            "user ticks": user_ticks,
+            "system ticks": system_ticks,
+            "threads": threads,
+            "rss": rss,
+            "pss": pss if pss is not None else rss,
+            "peak rss": hwm,
+        }
+
+    def _sample_tree(
+        self,
+        root_pid: int,
+        children_map: dict[int, list[int]] | None,
+        cpu_ticks: dict[int, tuple[int, int]],
+        thread_ticks: dict[tuple[int, int], int],
+        context: TickContext,
+    ) -> dict[str, int]:
+        totals = {"user ticks": 0, "system ticks": 0, "busiest thread ticks": 0,
+                  "active threads": 0, "rss": 0, "pss": 0, "peak rss": 0, "processes": 0}
+        for pid in procfs.get_process_tree(root_pid, children_map):
+            sample = self._sample_process(pid, context)
+            if sample is None:
+                continue
+            cpu_ticks[pid] = (sample["user ticks"], sample["system ticks"])
+            # a process first seen in this sample started after the previous one
+            last_user_ticks, last_system_ticks = self._cpu_ticks.get(pid, (0, 0))
+            totals["user ticks"] += sample["user ticks"] - last_user_ticks
+            totals["system ticks"] += sample["system ticks"] - last_system_ticks
+            for tid, ticks in sample["threads"].items():
+                thread_ticks[pid, tid] = ticks
+                delta = ticks - self._thread_ticks.get((pid, tid), 0)
+                totals["busiest thread ticks"] = max(totals["busiest thread ticks"], delta)
+                totals["active threads"] += delta > 0
+            totals["rss"] += sample["rss"]
+            totals["pss"] += sample["pss"]
+            totals["peak rss"] = max(totals["peak rss"], sample["peak rss"])
+            totals["processes"] += 1
+        return totals
+
+    def record_stats(self, context=None):
+        context = context or TickContext()
+        epoch_now = context.epoch
+        with self._lock:
+            now = context.monotonic
+            elapsed = now - self._last_sample_time
+            children_map = (
+                None if procfs.HAS_CHILDREN_FILES
+                else procfs.PROCESS_TABLE.get_children_map()
+            )
+            cpu_ticks: dict[int, tuple[int, int]] = {}
+            thread_ticks: dict[tuple[int, int], int] = {}
+            tree = {"cpu usage": 0.0, "rss": 0, "pss": 0, "peak rss": 0}
+            metrics = MetricList()
+            for root_pid in self.root_pids:
+                totals = self._sample_tree(
+                    root_pid, children_map, cpu_ticks, thread_ticks, context
+                )
+                # percent of one core, a tree busy on every core reaches 100 * cores
+                usage = {
+                    key: totals[f"{key} ticks"] / procfs.CLOCK_TICKS / elapsed * 100
+                    if elapsed > 0 else 0
+                    for key in ("user", "system", "busiest thread")
+                }
+                cpu_usage = usage["user"] + usage["system"]
+                self._peak_rss[root_pid] = max(
+                    self._peak_rss[root_pid], totals["rss"], totals["peak rss"]
+                )
+                tree["cpu usage"] += cpu_usage
+                tree["rss"] += totals["rss"]
+                tree["pss"] += totals["pss"]
+                prefix = f"instance {root_pid}"
+                metrics.extend([
+                    Metric(f"{prefix} cpu usage", round(cpu_usage, 3), epoch_now),
+                    Metric(f"{prefix} cpu share", round(cpu_usage / procfs.CPU_COUNT, 3),
+                           epoch_now),
+                    Metric(f"{prefix} user cpu", round(usage["user"], 3), epoch_now),
+                    Metric(f"{prefix} system cpu", round(usage["system"], 3), epoch_now),
+                    Metric(f"{prefix} busiest thread", round(usage["busiest thread"], 3),
+                           epoch_now),
+                    Metric(f"{prefix} active threads", totals["active threads"], epoch_now),
+                    Metric(f"{prefix} rss", totals["rss"], epoch_now),
+                    Metric(f"{prefix} pss", totals["pss"], epoch_now),
+                    Metric(f"{prefix} peak rss", self._peak_rss[root_pid], epoch_now),
+                    Metric(f"{prefix} processes", totals["processes"], epoch_now),
+                ])
+            for pid in self._cpu_ticks.keys() - cpu_ticks.keys():
+                procfs.READERS.discard_prefix(f"/proc/{pid}/")
+            for pid, tid in self._thread_ticks.keys() - thread_ticks.keys():
+                # the thread exited, its reader is never read again
+                procfs.READERS.discard(procfs.get_thread_stat_path(pid, tid))
+            self._cpu_ticks = cpu_ticks
+            self._thread_ticks = thread_ticks
+            self._last_sample_time = now
+            self._tree_peak_rss = max(self._tree_peak_rss, tree["rss"])
+            metrics.extend([
+                Metric("tree cpu usage", round(tree["cpu usage"], 3), epoch_now),
+                Metric("tree cpu share", round(tree["cpu usage"] / procfs.CPU_COUNT, 3),
+                       epoch_now),
+                Metric("tree rss", tree["rss"], epoch_now),
+                Metric("tree pss", tree["pss"], epoch_now),
+                Metric("tree peak rss", self._tree_peak_rss, epoch_now),
+            ])
+        return metrics
+
+    def get_average(self):
+        return {
+            "tree cpu usage": round(self.aggregates["tree cpu usage"].mean(), 3),
+            "tree rss": round(self.aggregates["tree rss"].mean(), 3),
+        }
+
+
+class NetworkMonitor(LiveMonitor):
+    """Traffic per network interface and the sockets of the launched scripts.
+
+    Interface counters belong to a network namespace, not to a process, so an
+    instance only gets its own traffic rates when it runs in a namespace of
+    its own. Socket counts cover the whole process tree of an instance.
+    """
+
+    def __init__(self, instance_monitor: InstanceMonitor, windows: tuple[float, ...] = (),
+                 interval: float = 0.5):
+        self.instance_monitor = instance_monitor
+        instance_monitor.dependents.append(self)
+        self.net_namespace = procfs.get_net_namespace("self")
+        self._counters: dict[str, dict[str, list[int]]] = {}
+        self._first_counters: dict[str, list[int]] = {}
+        self._last_sample_time = time.monotonic()
+        super().__init__(windows, interval)
+
+    def _get_rates(self, key: str, interfaces: dict[str, list[int]],
+                   elapsed: float) -> dict[str, dict[str, float]]:
+        """Return the byte and packet rates of every interface since the last sample."""
+        last_counters = self._counters.get(key, {})
+        self._counters[key] = interfaces
+        rates = {}
+        for name, counters in interfaces.items():
+            # the first sample of an interface has nothing to compare with
+            last = last_counters.get(name, counters)
+            rates[name] = {
+                field: (counters[index] - last[index]) / elapsed if elapsed > 0 else 0.0
+                for field, index in (
+                    ("receive rate", procfs.NET_DEV_RX_BYTES),
+                    ("transmit rate", procfs.NET_DEV_TX_BYTES),
+                    ("receive packets", procfs.NET_DEV_RX_PACKETS),
+                    ("transmit packets", procfs.NET_DEV_TX_PACKETS),
+                )
+            }
+        return rates
+
+    def _get_interface_metrics(self, context: TickContext, elapsed: float) -> MetricList:
+        interfaces = procfs.read_net_dev(read=context.read_bytes)
+        metrics = MetricList()
+        for name, rates in self._get_rates("host", interfaces, elapsed).items():
+            counters = interfaces[name]
+            first = self._first_counters.setdefault(name, counters)
+            errors = (counters[procfs.NET_DEV_RX_ERRS] + counters[procfs.NET_DEV_TX_ERRS]
+                      - first[procfs.NET_DEV_RX_ERRS] - first[procfs.NET_DEV_TX_ERRS])
+            drops = (counters[procfs.NET_DEV_RX_DROP] + counters[procfs.NET_DEV_TX_DROP]
+                     - first[procfs.NET_DEV_RX_DROP] - first[procfs.NET_DEV_TX_DROP])
+            metrics.extend(
+                Metric(f"network {name} {field}", round(rate, 3), context.epoch)
+                for field, rate in rates.items()
+            )
+            metrics.extend([
+                Metric(f"network {name} errors", errors, context.epoch),
+                Metric(f"network {name} drops", drops, context.epoch),
+            ])
+        return metrics
+
+    def _get_instance_metrics(self, root_pid: int, children_map: dict[int, list[int]] | None,
+                              context: TickContext, elapsed: float,
+                              socket_tables: dict[str, dict[int, str]]) -> MetricList:
+        prefix = f"instance {root_pid}"
+        inodes = set()
+        for pid in procfs.get_process_tree(root_pid, children_map):
+            try:
+                inodes |= procfs.get_socket_inodes(pid)
+            except OSError:
+                continue  # the process exited or its fds are not ours to read
+        try:
+            net_namespace = procfs.get_net_namespace(root_pid)
+        except OSError:
+            net_namespace = self.net_namespace
+        net_dir = "/proc/net" if net_namespace == self.net_namespace else f"/proc/{root_pid}/net"
+        kinds = {"tcp": 0, "udp": 0, "unix": 0}
+        if inodes:
+            # instances in the same namespace share the table, it is parsed once per tick
+            socket_table = socket_tables.get(net_dir)
+            if socket_table is None:
+                socket_table = procfs.read_socket_table(net_dir, context.read_bytes)
+                socket_tables[net_dir] = socket_table
+            for inode in inodes:
+                kind = socket_table.get(inode)
+                if kind is not None:
+                    kinds[kind] += 1
+        metrics = MetricList([Metric(f"{prefix} sockets", len(inodes), context.epoch)])
+        metrics.extend(
+            Metric(f"{prefix} {kind} sockets", count, context.epoch)
+            for kind, count in kinds.items()
+        )
+        if net_namespace != self.net_namespace:
+            try:
+                interfaces = procfs.read_net_dev(f"{net_dir}/dev", context.read_bytes)
+            except OSError:
+                return metrics
+            rates = self._get_rates(prefix, interfaces, elapsed).values()
+            for field in ("receive rate", "transmit rate"):
+                total = sum(interface[field] for interface in rates)
+                metrics.append(Metric(f"{prefix} {field}", round(total, 3), context.epoch))
+        return metrics
+
+    def record_stats(self, context=None):
+        context = context or TickContext()
+        now = context.monotonic
+        elapsed = now - self._last_sample_time
+        self._last_sample_time = now
+        metrics = self._get_interface_metrics(context, elapsed)
+        children_map = (
+            None if procfs.HAS_CHILDREN_FILES else procfs.PROCESS_TABLE.get_children_map()
+        )
+        root_pids = list(self.instance_monitor.root_pids)
+        socket_tables: dict[str, dict[int, str]] = {}
+        for root_pid in root_pids:
+            metrics.extend(self._get_instance_metrics(root_pid, children_map, context, elapsed,
+                                                      socket_tables))
+        for key in self._counters.keys() - {"host"} - {f"instance {pid}" for pid in root_pids}:
+            del self._counters[key]
+        return metrics
+
+    def get_average(self):
+        return {
+            name: round(aggregates.mean(), 3)
+            for name, aggregates in list(self.aggregates.items())
+            if name.startswith("network ") and name.endswith(("receive rate", "transmit rate"))
+        }
+
+
+class DiskIOMonitor(LiveMonitor):
+    """Storage I/O rates of the launched scripts and of the block devices."""
+
+    def __init__(self, instance_monitor: InstanceMonitor, windows: tuple[float, ...] = (),
+                 interval: float = 0.5):
+        self.instance_monitor = instance_monitor
+        instance_monitor.dependents.append(self)
+        self.devices = procfs.get_block_devices()
+        self._io: dict[int, dict[str, int]] = {}
+        self._diskstats: dict[str, list[int]] = {}
+        self._last_sample_time = time.monotonic()
+        super().__init__(windows, interval)
+
+    def _sample_tree(self, root_pid: int, children_map: dict[int, list[int]] | None,
+                     io: dict[int, dict[str, int]], context: TickContext) -> dict[str, int]:
+        totals = dict.fromkeys(procfs.IO_FIELDS, 0)
+        for pid in procfs.get_process_tree(root_pid, children_map):
+            try:
+                counters = procfs.read_io(pid, context.read_bytes)
+            except (OSError, KeyError, ValueError):
+                continue  # the process exited or its counters are not ours to read
+            io[pid] = counters
+            # a process first seen in this sample started after the previous one
+            last = self._io.get(pid, {})
+            for field, value in counters.items():
+                totals[field] += value - last.get(field, 0)
+        return totals
+
+    def _get_instance_metrics(self, context: TickContext, elapsed: float) -> MetricList:
+        children_map = (
+            None if procfs.HAS_CHILDREN_FILES else procfs.PROCESS_TABLE.get_children_map()
+        )
+        io: dict[int, dict[str, int]] = {}
+        tree = {"read rate": 0.0, "write rate": 0.0}
+        metrics = MetricList()
+        for root_pid in list(self.instance_monitor.root_pids):
+            totals = self._sample_tree(root_pid, children_map, io, context)
+            rates = {
+                name: totals[field] / elapsed if elapsed > 0 else 0.0
+                for name, field in (
+                    ("read rate", "read_bytes"),
+                    ("write rate", "write_bytes"),
+                    ("cancelled write rate", "cancelled_write_bytes"),
+                    ("read syscalls", "syscr"),
+                    ("write syscalls", "syscw"),
+                )
+            }
+            tree["read rate"] += rates["read rate"]
+            tree["write rate"] += rates["write rate"]
+            metrics.extend(
+                Metric(f"instance {root_pid} {name}", round(rate, 3), context.epoch)
+                for name, rate in rates.items()
+            )
+        self._io = io
+        metrics.extend(
+            Metric(f"tree {name}", round(rate, 3), context.epoch) for name, rate in tree.items()
+        )
+        return metrics
+
+    def _get_device_metrics(self, context: TickContext, elapsed: float) -> MetricList:
+        diskstats = procfs.read_diskstats(context.read_bytes)
+        elapsed_ms = elapsed * 1000
+        metrics = MetricList()
+        for device, counters in diskstats.items():
+            if self.devices is not None and device not in self.devices:
+                continue
+            last = self._diskstats.get(device, counters)
+            delta = [value - last_value for value, last_value in zip(counters, last)]
+            ios = delta[procfs.DISKSTATS_READS] + delta[procfs.DISKSTATS_WRITES]
+            io_time = delta[procfs.DISKSTATS_READ_TIME] + delta[procfs.DISKSTATS_WRITE_TIME]
+            values = {"read rate": 0.0, "write rate": 0.0, "utilization": 0.0,
+                      "queue depth": 0.0, "latency": io_time / ios if ios else 0.0}
+            if elapsed > 0:
+                values["read rate"] = (
+                    delta[procfs.DISKSTATS_SECTORS_READ] * procfs.SECTOR_SIZE / elapsed
+                )
+                values["write rate"] = (
+                    delta[procfs.DISKSTATS_SECTORS_WRITTEN] * procfs.SECTOR_SIZE / elapsed
+                )
+                values["utilization"] = min(
+                    delta[procfs.DISKSTATS_IO_TIME] / elapsed_ms * 100, 100
+                )
+                values["queue depth"] = delta[procfs.DISKSTATS_WEIGHTED_IO_TIME] / elapsed_ms
+            metrics.extend(
+                Metric(f"device {device} {name}", round(value, 3), context.epoch)
+                for name, value in values.items()
+            )
+        self._diskstats = diskstats
+        return metrics
+
+    def record_stats(self, context=None):
+        context = context or TickContext()
+        now = context.monotonic
+        elapsed = now - self._last_sample_time
+        self._last_sample_time = now
+        metrics = self._get_instance_metrics(context, elapsed)
+        metrics.extend(self._get_device_metrics(context, elapsed))
+        return metrics
+
+    def get_average(self):
+        return {
+            "tree read rate": round(self.aggregates["tree read rate"].mean(), 3),
+            "tree write rate": round(self.aggregates["tree write rate"].mean(), 3),
+        }
+
+
+class SelfMonitor(LiveMonitor):
+    """The cost of Smaug itself: its CPU time and memory, and how its scheduler keeps up."""
+
+    def __init__(self, scheduler: Scheduler, windows: tuple[float, ...] = (),
+                 interval: float = 0.1):
+        self.scheduler = scheduler
+        self._last_cpu_ticks = None
+        self._last_sample_time = time.monotonic()
+        super().__init__(windows, interval)
+
+    def record_stats(self, context=None):
+        context = context or TickContext()
+        pid = os.getpid()
+        fields = procfs.read_pid_stat(pid, context.read_bytes)
+        cpu_ticks = int(fields[procfs.STAT_UTIME]) + int(fields[procfs.STAT_STIME])
+        _, rss, _ = procfs.read_statm(pid, context.read_bytes)
+        elapsed = context.monotonic - self._last_sample_time
+        cpu_usage = 0.0
+        if self._last_cpu_ticks is not None and elapsed > 0:
+            cpu_usage = (cpu_ticks - self._last_cpu_ticks) / procfs.CLOCK_TICKS / elapsed * 100
+        self._last_cpu_ticks = cpu_ticks
+        self._last_sample_time = context.monotonic
+        metrics = MetricList([
+            Metric("smaug cpu usage", round(cpu_usage, 3), context.epoch),
+            Metric("smaug cpu time", round(cpu_ticks / procfs.CLOCK_TICKS, 3), context.epoch),
+            Metric("smaug rss", rss, context.epoch),
+            Metric("smaug threads", int(fields[procfs.STAT_NUM_THREADS]), context.epoch),
+            Metric("smaug tick jitter", round(self.scheduler.jitter * 1000, 3), context.epoch),
+            Metric("smaug missed ticks", self.scheduler.missed_ticks, context.epoch),
+        ])
+        metrics.extend(
+            Metric(f"smaug collector {name} latency", round(latency * 1000, 3), context.epoch)
+            for name, latency in list(self.scheduler.latencies.items())
+        )
+        return metrics
+
+    def get_average(self):
+        return {
+            "smaug cpu usage": round(self.aggregates["smaug cpu usage"].mean(), 3),
+            "smaug rss": round(self.aggregates["smaug rss"].mean(), 3),
+        }
+
+
 class DiskMonitor(StaticMonitor):
 
     def get_disk_usage(self, partition: str) -> float:
@@ -167,9 +695,10 @@ class DiskMonitor(StaticMonitor):
         percent = (used / total) * 100
         return percent
 
-    def record_stats(self):
+    def record_stats(self, context=None):
+        context = context or TickContext()
         disk_usage = round(self.get_disk_usage("/"), 3)
-        return MetricList([Metric("disk usage", disk_usage, int(time.time()))])
+        return MetricList([Metric("disk usage", disk_usage, context.epoch)])
 
     def get_diff(self):
         return round(
@@ -185,25 +714,19 @@ class ProcessMonitor(StaticMonitor):
         return int(time.time() - self.start_time)
 
     def get_process_info(self, pid: int = os.getpid()) -> str:
-        result = subprocess.run(
-            ["ps", "-p", str(pid), "-o", "comm="], stdout=subprocess.PIPE, check=True
-        )
-        return result.stdout.decode().strip()
+        return procfs.read_comm(pid)
 
     def get_total_thread_usage(self) -> int:
-        result = subprocess.run(["ps", "-eLF"], stdout=subprocess.PIPE)
-        output = result.stdout.decode()
-        header_line_num = 1
-        num_threads = len(output.strip().split("\n")) - header_line_num
-        return num_threads
+        return procfs.PROCESS_TABLE.get_total_thread_count()
 
-    def record_stats(self):
+    def record_stats(self, context=None):
+        context = context or TickContext()
         process_info = self.get_process_info()
         total_thread_usage = self.get_total_thread_usage()
         return MetricList(
             [
-                Metric("process info", process_info, int(time.time())),
-                Metric("total thread usage", total_thread_usage, int(time.time())),
+                Metric("process info", process_info, context.epoch),
+                Metric("total thread usage", total_thread_usage, context.epoch),
             ]
         )
 
@@ -228,18 +751,49 @@ class ProcessMonitor(StaticMonitor):
 
 class CombinedMonitor:
 
-    def __init__(self):
+    def __init__(self, windows: tuple[float, ...] = (), base_interval: float = 0.1,
+                 subtract_self: bool = False, max_interval: float | None = None):
         logger.info("Initializing CombinedMonitor")
-        self.cpu_monitor = CPUMonitor()
-        self.memory_monitor = MemoryMonitor()
+        self.cpu_monitor = CPUMonitor(windows, subtract_self=subtract_self)
+        self.memory_monitor = MemoryMonitor(windows, subtract_self=subtract_self)
+        self.instance_monitor = InstanceMonitor(windows)
+        self.network_monitor = NetworkMonitor(self.instance_monitor, windows)
+        self.disk_io_monitor = DiskIOMonitor(self.instance_monitor, windows)
         self.disk_monitor = DiskMonitor()
         self.process_monitor = ProcessMonitor()
+        self.scheduler = Scheduler(base_interval)
+        self.self_monitor = SelfMonitor(self.scheduler, windows)
+        for name, monitor in self.collectors.items():
+            # Smaug's own metrics describe the scheduler, they are always sampled densely
+            adaptive = max_interval is not None and monitor is not self.self_monitor
+            interval = max(monitor.interval, base_interval)
+            self.scheduler.add_collector(name, monitor, interval,
+                                         max(interval, max_interval) if adaptive else None)
+        self.scheduler.start()
         logger.info("Initialized CombinedMonitor")
 
+    @property
+    def collectors(self) -> dict[str, LiveMonitor | StaticMonitor]:
+        return {
+            "cpu": self.cpu_monitor,
+            "memory": self.memory_monitor,
+            "instance": self.instance_monitor,
+            "network": self.network_monitor,
+            "disk io": self.disk_io_monitor,
+            "disk": self.disk_monitor,
+            "process": self.process_monitor,
+            "self": self.self_monitor,
+        }
+
     def stop(self):
         logger.info("Stopping CombinedMonitor")
+        self.scheduler.stop()
         self.cpu_monitor.stop()
         self.memory_monitor.stop()
+        self.instance_monitor.stop()
+        self.network_monitor.stop()
+        self.disk_io_monitor.stop()
+        self.self_monitor.stop()
         logger.info("Stopped CombinedMonitor")
 
     def __enter__(self):
@@ -257,9 +811,11 @@ class CombinedMonitor:
 
 class TestedAppMonitor(CombinedMonitor):
 
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, windows: tuple[float, ...] = (),
+                 subtract_self: bool = False, base_interval: float = 0.1,
+                 max_interval: float | None = None) -> None:
         self.path = path
-        super().__init__()
+        super().__init__(windows, base_interval, subtract_self, max_interval)
 
     def get_app_size(self) -> int:
         return os.path.getsize(self.path)
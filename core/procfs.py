@@ -0,0 +1,411 @@
+"""This module contains helpers to read process information from /proc."""
+
+import os
+import threading
+import time
+from typing import Callable
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+CPU_COUNT = os.cpu_count() or 1
+
+# field positions in /proc/<pid>/stat counted after the "(comm)" field
+STAT_PPID = 1
+STAT_UTIME = 11
+STAT_STIME = 12
+STAT_NUM_THREADS = 17
+STAT_STARTTIME = 19
+
+# time positions in a "cpu" line of /proc/stat counted after the "cpuN" field
+CPU_USER = 0
+CPU_NICE = 1
+CPU_SYSTEM = 2
+CPU_IDLE = 3
+CPU_IOWAIT = 4
+CPU_IRQ = 5
+CPU_SOFTIRQ = 6
+CPU_STEAL = 7
+
+# counter positions in a /proc/net/dev line counted after the "<interface>:" field
+NET_DEV_RX_BYTES = 0
+NET_DEV_RX_PACKETS = 1
+NET_DEV_RX_ERRS = 2
+NET_DEV_RX_DROP = 3
+NET_DEV_TX_BYTES = 8
+NET_DEV_TX_PACKETS = 9
+NET_DEV_TX_ERRS = 10
+NET_DEV_TX_DROP = 11
+
+# counter positions in a /proc/diskstats line counted after the device name
+DISKSTATS_READS = 0
+DISKSTATS_SECTORS_READ = 2
+DISKSTATS_READ_TIME = 3
+DISKSTATS_WRITES = 4
+DISKSTATS_SECTORS_WRITTEN = 6
+DISKSTATS_WRITE_TIME = 7
+DISKSTATS_IO_TIME = 9
+DISKSTATS_WEIGHTED_IO_TIME = 10
+# diskstats counts 512-byte sectors whatever the sector size of the device is
+SECTOR_SIZE = 512
+
+IO_FIELDS = ("syscr", "syscw", "read_bytes", "write_bytes", "cancelled_write_bytes")
+
+# socket tables of a network namespace and the column of the socket inode
+SOCKET_TABLES = {
+    "tcp": (("tcp", 9), ("tcp6", 9)),
+    "udp": (("udp", 9), ("udp6", 9)),
+    "unix": (("unix", 6),),
+}
+
+# /proc/<pid>/task/<tid>/children needs CONFIG_PROC_CHILDREN
+HAS_CHILDREN_FILES = os.path.exists(f"/proc/{os.getpid()}/task/{os.getpid()}/children")
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as file:
+        return file.read()
+
+
+class ProcReader:
+    """Keeps a /proc file open and re-reads it from offset 0 into one buffer."""
+
+    def __init__(self, path: str, buffer_size: int = 4096):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self._buffer = bytearray(buffer_size)
+        self._lock = threading.Lock()
+
+    def read(self) -> bytes:
+        with self._lock:
+            while True:
+                size = os.preadv(self._fd, [self._buffer], 0)
+                if size < len(self._buffer):
+                    return bytes(memoryview(self._buffer)[:size])
+                # the file outgrew the buffer, grow it and read again
+                self._buffer = bytearray(len(self._buffer) * 2)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+    def __del__(self):
+        if getattr(self, "_fd", -1) >= 0:
+            os.close(self._fd)
+
+
+class ProcReaderPool:
+    """Lazily opened ProcReaders by path.
+
+    A reader whose file can no longer be read, e.g. because the process
+    exited, is closed and dropped, the next read opens the path again.
+    """
+
+    def __init__(self):
+        self._readers: dict[str, ProcReader] = {}
+        self._lock = threading.Lock()
+
+    def read(self, path: str) -> bytes:
+        reader = self._readers.get(path)
+        if reader is None:
+            with self._lock:
+                reader = self._readers.get(path)
+                if reader is None:
+                    reader = ProcReader(path)
+                    self._readers[path] = reader
+        try:
+            return reader.read()
+        except OSError:
+            self.discard(path)
+            raise
+
+    def discard(self, path: str) -> None:
+        with self._lock:
+            reader = self._readers.pop(path, None)
+        if reader is not None:
+            reader.close()
+
+    def discard_prefix(self, prefix: str) -> None:
+        with self._lock:
+            paths = [path for path in self._readers if path.startswith(prefix)]
+        for path in paths:
+            self.discard(path)
+
+    def close(self) -> None:
+        with self._lock:
+            readers, self._readers = self._readers, {}
+        for reader in readers.values():
+            reader.close()
+
+
+READERS = ProcReaderPool()
+
+
+def parse_fields(data: bytes, fields: tuple[str, ...]) -> dict[str, int]:
+    """Return the first number after each "<field>:" key in /proc key-value text."""
+    values = {}
+    for field in fields:
+        key = field.encode() + b":"
+        if data.startswith(key):
+            start = len(key)
+        else:
+            start = data.find(b"\n" + key)
+            if start < 0:
+                raise KeyError(field)
+            start += len(key) + 1
+        end = data.find(b"\n", start)
+        values[field] = int(data[start:end if end >= 0 else len(data)].split()[0])
+    return values
+
+
+def read_pid_stat(pid: int, read: Callable[[str], bytes] = read_file) -> list[bytes]:
+    data = read(f"/proc/{pid}/stat")
+    # comm may contain spaces and parentheses, so split after the last ')'
+    return data[data.rindex(b")") + 2:].split()
+
+
+def get_cpu_times(pid: int, read: Callable[[str], bytes] = read_file) -> tuple[int, int]:
+    """Return the user and system time of a process in clock ticks."""
+    fields = read_pid_stat(pid, read)
+    return int(fields[STAT_UTIME]), int(fields[STAT_STIME])
+
+
+def get_thread_stat_path(pid: int, tid: int | str) -> str:
+    return f"/proc/{pid}/task/{tid}/stat"
+
+
+def get_thread_cpu_ticks(pid: int, read: Callable[[str], bytes] = read_file) -> dict[int, int]:
+    """Return the user plus system time of every thread of a process in clock ticks."""
+    threads = {}
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            data = read(get_thread_stat_path(pid, tid))
+        except OSError:
+            continue  # the thread exited since the listing
+        fields = data[data.rindex(b")") + 2:].split()
+        threads[int(tid)] = int(fields[STAT_UTIME]) + int(fields[STAT_STIME])
+    return threads
+
+
+def read_cpu_times(read: Callable[[str], bytes] = read_file) -> dict[str, list[int]]:
+    """Return the times of the "cpu" line and of every "cpuN" line of /proc/stat."""
+    cpus = {}
+    for line in read("/proc/stat").splitlines():
+        if not line.startswith(b"cpu"):
+            break  # the cpu lines come first
+        name, *times = line.split()
+        cpus[name.decode()] = [int(value) for value in times]
+    return cpus
+
+
+def read_statm(pid: int, read: Callable[[str], bytes] = read_file) -> tuple[int, int, int]:
+    """Return the total, resident and shared size of a process in bytes."""
+    size, resident, shared = read(f"/proc/{pid}/statm").split()[:3]
+    return int(size) * PAGE_SIZE, int(resident) * PAGE_SIZE, int(shared) * PAGE_SIZE
+
+
+def read_status(pid: int, fields: tuple[str, ...],
+                read: Callable[[str], bytes] = read_file) -> dict[str, int]:
+    """Return the requested kB fields of /proc/<pid>/status in bytes."""
+    data = read(f"/proc/{pid}/status")
+    values = {}
+    for field in fields:
+        try:
+            values[field] = parse_fields(data, (field,))[field] * 1024
+        except KeyError:
+            continue  # kernel threads have no Vm* fields
+    return values
+
+
+def read_pss(pid: int, read: Callable[[str], bytes] = read_file) -> int | None:
+    """Return the proportional set size in bytes, None if it is not readable."""
+    try:
+        data = read(f"/proc/{pid}/smaps_rollup")
+    except OSError:
+        return None
+    try:
+        return parse_fields(data, ("Pss",))["Pss"] * 1024
+    except KeyError:
+        return None
+
+
+def read_net_dev(path: str = "/proc/net/dev",
+                 read: Callable[[str], bytes] = read_file) -> dict[str, list[int]]:
+    """Return the counters of every network interface, see the NET_DEV_* positions."""
+    interfaces = {}
+    # the first two lines are the table header
+    for line in read(path).splitlines()[2:]:
+        name, _, counters = line.partition(b":")
+        interfaces[name.strip().decode()] = [int(value) for value in counters.split()]
+    return interfaces
+
+
+def read_io(pid: int, read: Callable[[str], bytes] = read_file) -> dict[str, int]:
+    """Return the IO_FIELDS counters of /proc/<pid>/io."""
+    return parse_fields(read(f"/proc/{pid}/io"), IO_FIELDS)
+
+
+def get_block_devices() -> set[str] | None:
+    """Return the whole disks of the host, None if /sys/block is not available."""
+    try:
+        devices = os.listdir("/sys/block")
+    except OSError:
+        return None
+    return {device for device in devices if not device.startswith(("loop", "ram"))}
+
+
+def read_diskstats(read: Callable[[str], bytes] = read_file) -> dict[str, list[int]]:
+    """Return the counters of every block device, see the DISKSTATS_* positions."""
+    devices = {}
+    for line in read("/proc/diskstats").splitlines():
+        fields = line.split()
+        devices[fields[2].decode()] = [int(value) for value in fields[3:]]
+    return devices
+
+
+def get_net_namespace(pid: int | str) -> str:
+    """Return the network namespace of a process, e.g. 'net:[4026531840]'."""
+    return os.readlink(f"/proc/{pid}/ns/net")
+
+
+def get_socket_inodes(pid: int) -> set[int]:
+    """Return the inodes of the sockets a process has open."""
+    inodes = set()
+    fd_dir = f"/proc/{pid}/fd"
+    for fd in os.listdir(fd_dir):
+        try:
+            target = os.readlink(f"{fd_dir}/{fd}")
+        except OSError:
+            continue  # closed since the listing
+        if target.startswith("socket:["):
+            inodes.add(int(target[8:-1]))
+    return inodes
+
+
+def read_socket_table(net_dir: str = "/proc/net",
+                      read: Callable[[str], bytes] = read_file) -> dict[int, str]:
+    """Map the inode of every socket of a network namespace to its kind (tcp, udp, unix)."""
+    sockets = {}
+    for kind, tables in SOCKET_TABLES.items():
+        for table, column in tables:
+            try:
+                data = read(f"{net_dir}/{table}")
+            except OSError:
+                continue  # e.g. no IPv6
+            for line in data.splitlines()[1:]:
+                fields = line.split()
+                if len(fields) > column:
+                    sockets[int(fields[column])] = kind
+    return sockets
+
+
+def get_children(pid: int) -> list[int]:
+    if not HAS_CHILDREN_FILES:
+        return get_children_map().get(pid, [])
+    children = []
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children", "r", encoding="utf-8") as file:
+                children.extend(int(child) for child in file.read().split())
+        except FileNotFoundError:
+            continue
+    return children
+
+
+def get_children_map() -> dict[int, list[int]]:
+    """Map every pid to its children using the ppid field of /proc/<pid>/stat."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            ppid = int(read_pid_stat(int(entry))[STAT_PPID])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def get_process_tree(pid: int, children_map: dict[int, list[int]] | None = None) -> list[int]:
+    """Return the pid and all of its living descendants."""
+    if not os.path.exists(f"/proc/{pid}"):
+        return []
+    if children_map is None and not HAS_CHILDREN_FILES:
+        children_map = get_children_map()
+    tree = [pid]
+    index = 0
+    while index < len(tree):
+        if children_map is not None:
+            tree.extend(children_map.get(tree[index], []))
+        else:
+            try:
+                tree.extend(get_children(tree[index]))
+            except OSError:
+                pass
+        index += 1
+    return tree
+
+
+def read_comm(pid: int) -> str:
+    with open(f"/proc/{pid}/comm", "r", encoding="utf-8") as file:
+        return file.read().strip()
+
+
+def read_total_threads() -> int:
+    """Return the number of threads on the host from /proc/loadavg."""
+    # e.g. "0.20 0.18 0.12 1/80 11206", the fourth field is running/total
+    return int(READERS.read("/proc/loadavg").split()[3].split(b"/")[1])
+
+
+def _list_pids() -> list[int]:
+    return [int(entry) for entry in os.listdir("/proc") if entry.isdigit()]
+
+
+class ProcessTable:
+    """Time-cached scans of /proc: the children map and the host thread count.
+
+    Scans are reused for ``ttl`` seconds, so several readers that ask within
+    the same tick share a single walk of /proc.
+    """
+
+    def __init__(self, ttl: float = 0.5):
+        self.ttl = ttl
+        self._cache: dict[str, tuple[float, object]] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key: str, loader):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and now - cached[0] < self.ttl:
+                return cached[1]
+        # loaded without the lock, a slow scan must not hold up the other readers;
+        # two readers may both load, the later store wins
+        value = loader()
+        with self._lock:
+            self._cache[key] = (now, value)
+        return value
+
+    def get_children_map(self) -> dict[int, list[int]]:
+        return self._cached("children", get_children_map)
+
+    def get_total_thread_count(self) -> int:
+        return self._cached("threads", self._count_threads)
+
+    def _count_threads(self) -> int:
+        try:
+            return read_total_threads()
+        except (OSError, ValueError, IndexError):
+            pass
+        # loaders list /proc themselves rather than calling the cached accessors
+        total = 0
+        for pid in _list_pids():
+            try:
+                total += int(read_pid_stat(pid)[STAT_NUM_THREADS])
+            except (OSError, ValueError, IndexError):
+                continue  # the process exited during the scan
+        return total
+
+
+PROCESS_TABLE = ProcessTable()
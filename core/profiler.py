@@ -0,0 +1,193 @@
+"""This module contains the collection side of the profilers injected into the scripts.
+
+Each injected profiler streams lines back to Smaug over a pipe per instance;
+``get_environ()`` tells the injected sitecustomize which fd to write to and
+``get_handler()`` consumes the lines of one instance.
+"""
+
+import json
+import os
+import threading
+from collections import Counter
+from typing import Protocol
+
+from .capture import LineHandler
+from .metrics import Metric, MetricList
+from .scheduler import TickContext
+from .logger import setup_logger
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+
+class InjectedProfiler(Protocol):
+
+    def get_environ(self, write_fd: int) -> dict[str, str]:
+        ...
+
+    def get_handler(self, pid: int) -> LineHandler:
+        ...
+
+    def save(self, path_prefix: str) -> list[str]:
+        ...
+
+    def summary(self, top: int = 10) -> str:
+        ...
+
+
+class InstanceStacks(dict):
+    """Collapsed stack counts of every profiled instance, keyed by pid."""
+
+    def __missing__(self, pid: int) -> Counter:
+        self[pid] = Counter()
+        return self[pid]
+
+
+class StackProfiler:
+    """Gathers the collapsed stacks that the injected sampler streams back.
+
+    Every instance gets a pipe; its sampler writes ``frame;frame count``
+    lines to it, which are summed per instance and can be merged across
+    instances. The output is in the collapsed format that flamegraph.pl,
+    speedscope and inferno read.
+    """
+
+    def __init__(self, hz: float = 100.0):
+        self.hz = hz
+        self.stacks = InstanceStacks()
+        self._lock = threading.Lock()
+
+    def get_environ(self, write_fd: int) -> dict[str, str]:
+        """Variables that make the injected sitecustomize start the sampler."""
+        return {"SMAUG_PROFILE_FD": str(write_fd), "SMAUG_PROFILE_HZ": str(self.hz)}
+
+    def get_handler(self, pid: int) -> LineHandler:
+        def add_line(line: bytes, is_error: bool) -> None:
+            stack, _, count = line.decode(errors="replace").rpartition(" ")
+            if not stack or not count.isdigit():
+                logger.warning("Dropping a malformed profile line of %s: %r", pid, line[:100])
+                return
+            with self._lock:
+                self.stacks[pid][stack] += int(count)
+
+        return add_line
+
+    def merged(self) -> Counter:
+        merged = Counter()
+        with self._lock:
+            for stacks in self.stacks.values():
+                merged.update(stacks)
+        return merged
+
+    def get_self_time(self, stacks: Counter | None = None) -> Counter:
+        """Samples per function on top of the stack, i.e. the functions the time is spent in."""
+        stacks = self.merged() if stacks is None else stacks
+        self_time = Counter()
+        for stack, count in stacks.items():
+            self_time[stack.rpartition(";")[2]] += count
+        return self_time
+
+    @staticmethod
+    def to_collapsed(stacks: Counter) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+    def save(self, path_prefix: str) -> list[str]:
+        """Write ``<prefix>.folded`` with every instance and ``<prefix>_<pid>.folded`` per instance."""
+        with self._lock:
+            instances = {pid: Counter(stacks) for pid, stacks in self.stacks.items()}
+        paths = []
+        for pid, stacks in [(None, self.merged()), *instances.items()]:
+            path = f"{path_prefix}.folded" if pid is None else f"{path_prefix}_{pid}.folded"
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(self.to_collapsed(stacks))
+            paths.append(path)
+        return paths
+
+    def summary(self, top: int = 10) -> str:
+        self_time = self.get_self_time()
+        total = sum(self_time.values())
+        lines = [f"{total} samples at {self.hz:g} Hz of CPU time, top functions:"]
+        for function, count in self_time.most_common(top):
+            lines.append(f"{count / total:>7.1%}  {function}")
+        return "\n".join(lines)
+
+
+class AllocationProfiler:
+    """Gathers the tracemalloc snapshots that the injected tracer streams back.
+
+    Every instance sends a JSON line per snapshot, taken every ``interval``
+    seconds, with its traced memory and its ``top`` allocation sites by size
+    and their growth. Tracebacks are ``depth`` frames deep; both bound the
+    overhead of tracing.
+    """
+
+    def __init__(self, interval: float = 5.0, depth: int = 1, top: int = 10):
+        self.interval = interval
+        self.depth = depth
+        self.top = top
+        self.snapshots: dict[int, list[dict]] = {}
+        self._lock = threading.Lock()
+
+    def get_environ(self, write_fd: int) -> dict[str, str]:
+        """Variables that make the injected sitecustomize start the tracer."""
+        return {
+            "SMAUG_MEMORY_FD": str(write_fd),
+            "SMAUG_MEMORY_INTERVAL": str(self.interval),
+            "SMAUG_MEMORY_DEPTH": str(self.depth),
+            "SMAUG_MEMORY_TOP": str(self.top),
+        }
+
+    def get_handler(self, pid: int) -> LineHandler:
+        def add_line(line: bytes, is_error: bool) -> None:
+            try:
+                snapshot = json.loads(line)
+            except ValueError:
+                logger.warning("Dropping a malformed snapshot of %s: %r", pid, line[:100])
+                return
+            with self._lock:
+                self.snapshots.setdefault(pid, []).append(snapshot)
+
+        return add_line
+
+    def latest(self) -> dict[int, dict]:
+        with self._lock:
+            return {pid: snapshots[-1] for pid, snapshots in self.snapshots.items()}
+
+    def collect(self, context: TickContext) -> MetricList:
+        """Traced memory of every instance, as of its latest snapshot."""
+        metrics = MetricList()
+        for pid, snapshot in self.latest().items():
+            metrics.append(Metric(f"instance {pid} traced memory", snapshot["traced"],
+                                  context.epoch))
+            metrics.append(Metric(f"instance {pid} traced peak", snapshot["peak"],
+                                  context.epoch))
+        return metrics
+
+    def get_growth(self) -> Counter:
+        """Growth since the first snapshot per allocation site, summed over the instances."""
+        growth = Counter()
+        for snapshot in self.latest().values():
+            for site in snapshot["sites"]:
+                growth[" <- ".join(site["traceback"])] += site["growth"]
+        return growth
+
+    def save(self, path_prefix: str) -> list[str]:
+        """Write every snapshot of every instance to ``<prefix>.jsonl``, oldest first."""
+        with self._lock:
+            snapshots = [
+                dict(snapshot, pid=pid)
+                for pid, instance_snapshots in self.snapshots.items()
+                for snapshot in instance_snapshots
+            ]
+        path = f"{path_prefix}.jsonl"
+        with open(path, "w", encoding="utf-8") as file:
+            for snapshot in sorted(snapshots, key=lambda snapshot: snapshot["timestamp"]):
+                file.write(json.dumps(snapshot) + "\n")
+        return [path]
+
+    def summary(self, top: int = 10) -> str:
+        lines = ["Allocation sites that grew the most since the first snapshot:"]
+        for site, growth in self.get_growth().most_common(top):
+            if growth <= 0:
+                break
+            lines.append(f"{growth / 1024:>10.1f} KiB  {site}")
+        return "\n".join(lines)
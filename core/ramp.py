@@ -0,0 +1,231 @@
+"""This module contains the max-load ramp test."""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+
+from .aggregates import percentile
+from .runner import ScriptRunner
+from .scheduler import Snapshot
+from .logger import setup_logger
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+SCHEDULES = ("linear", "exponential", "binary")
+
+
+@dataclass
+class RampLimits:
+
+    cpu: float | None = None  # average host CPU usage during a step, %
+    memory: float | None = None  # peak host memory usage during a step, %
+    p95_latency: float | None = None  # p95 completion time of the instances, s
+    failures: int = 0  # failed instances allowed per step
+
+    def check(self, step: "RampStep") -> list[str]:
+        violations = []
+        if self.cpu is not None and step.cpu_average > self.cpu:
+            violations.append(f"cpu average {step.cpu_average}% > {self.cpu}%")
+        if self.memory is not None and step.memory_peak > self.memory:
+            violations.append(f"memory peak {step.memory_peak}% > {self.memory}%")
+        if self.p95_latency is not None and step.p95_latency > self.p95_latency:
+            violations.append(f"p95 latency {step.p95_latency}s > {self.p95_latency}s")
+        if step.failures > self.failures:
+            violations.append(f"{step.failures} failures > {self.failures}")
+        return violations
+
+
+@dataclass
+class RampStep:
+
+    concurrency: int
+    cpu_average: float = 0.0
+    cpu_peak: float = 0.0
+    memory_average: float = 0.0
+    memory_peak: float = 0.0
+    tree_cpu_average: float = 0.0
+    tree_rss_peak: int = 0
+    p50_latency: float = 0.0
+    p95_latency: float = 0.0
+    max_latency: float = 0.0
+    failures: int = 0
+    violations: list[str] = field(default_factory=list)
+
+    @property
+    def passed(self) -> bool:
+        return not self.violations
+
+
+@dataclass
+class RampReport:
+
+    schedule: str
+    steps: list[RampStep] = field(default_factory=list)
+
+    @property
+    def max_sustainable_concurrency(self) -> int:
+        return max((step.concurrency for step in self.steps if step.passed), default=0)
+
+    def to_dict(self) -> dict:
+        return {
+            "schedule": self.schedule,
+            "max_sustainable_concurrency": self.max_sustainable_concurrency,
+            "steps": [dict(asdict(step), passed=step.passed) for step in self.steps],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def __str__(self) -> str:
+        header = (
+            f"{'n':>5} | {'cpu avg':>8} | {'mem peak':>8} | {'p50 s':>8} "
+            f"| {'p95 s':>8} | {'failed':>6} | result"
+        )
+        lines = [header, "-" * len(header)]
+        for step in sorted(self.steps, key=lambda step: step.concurrency):
+            result = "ok" if step.passed else "; ".join(step.violations)
+            lines.append(
+                f"{step.concurrency:>5} | {step.cpu_average:>8} | {step.memory_peak:>8} "
+                f"| {step.p50_latency:>8} | {step.p95_latency:>8} "
+                f"| {step.failures:>6} | {result}"
+            )
+        lines.append(f"Max sustainable concurrency: {self.max_sustainable_concurrency}")
+        return "\n".join(lines)
+
+
+class LoadRamp:
+    """Runs the script at growing concurrency until a limit is crossed.
+
+    Every step launches ``concurrency`` instances at once and waits for all
+    of them. ``linear`` adds ``step`` instances per step, ``exponential``
+    doubles them, and ``binary`` doubles until a step fails and then
+    bisects between the last passing and the first failing concurrency.
+    """
+
+    def __init__(self, runner: ScriptRunner, limits: RampLimits, schedule: str = "linear",
+                 max_concurrency: int = 64, step: int = 1, timeout: float | None = None):
+        if schedule not in SCHEDULES:
+            raise ValueError(f"Unknown ramp schedule {schedule}, expected one of {SCHEDULES}")
+        if step < 1:
+            raise ValueError("The ramp should add at least one instance per step")
+        self.runner = runner
+        self.limits = limits
+        self.schedule = schedule
+        self.max_concurrency = max_concurrency
+        self.step = step
+        self.timeout = timeout
+        self._samples: dict[str, list[float]] | None = None
+        self._lock = threading.Lock()
+        runner.monitor.scheduler.add_listener(self._on_snapshot)
+
+    def _on_snapshot(self, snapshot: Snapshot) -> None:
+        with self._lock:
+            if self._samples is None:
+                return
+            for name in snapshot.updated:
+                for metric in snapshot.records[name]:
+                    if metric.name in self._samples:
+                        self._samples[metric.name].append(float(metric.value))
+
+    def _wait(self, process: subprocess.Popen, started: float, deadline: float | None) -> float:
+        try:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        return time.monotonic() - started
+
+    def _wait_all(self, processes: list[subprocess.Popen], started: float,
+                  deadline: float | None) -> list[float]:
+        """Wait for the instances in parallel, so each latency is its own exit time."""
+        latencies = [0.0] * len(processes)
+
+        def wait(index: int, process: subprocess.Popen) -> None:
+            latencies[index] = self._wait(process, started, deadline)
+
+        waiters = [
+            threading.Thread(target=wait, args=(index, process), daemon=True)
+            for index, process in enumerate(processes)
+        ]
+        for waiter in waiters:
+            waiter.start()
+        for waiter in waiters:
+            waiter.join()
+        return latencies
+
+    def run_step(self, concurrency: int) -> RampStep:
+        logger.info("Starting ramp step with %s instances", concurrency)
+        with self._lock:
+            self._samples = {
+                "cpu usage": [], "memory usage": [], "tree cpu usage": [], "tree rss": []
+            }
+        started = time.monotonic()
+        deadline = None if self.timeout is None else started + self.timeout
+        processes = self.runner.run_script_in_venv(concurrency)
+        latencies = self._wait_all(processes, started, deadline)
+        failures = sum(1 for process in processes if process.returncode != 0)
+        for process in processes:
+            self.runner.monitor.instance_monitor.untrack(process.pid)
+        with self._lock:
+            samples, self._samples = self._samples, None
+
+        def average(values: list[float]) -> float:
+            return round(sum(values) / len(values), 3) if values else 0.0
+
+        step = RampStep(
+            concurrency=concurrency,
+            cpu_average=average(samples["cpu usage"]),
+            cpu_peak=round(max(samples["cpu usage"], default=0.0), 3),
+            memory_average=average(samples["memory usage"]),
+            memory_peak=round(max(samples["memory usage"], default=0.0), 3),
+            tree_cpu_average=average(samples["tree cpu usage"]),
+            tree_rss_peak=int(max(samples["tree rss"], default=0)),
+            p50_latency=round(percentile(latencies, 0.5), 3),
+            p95_latency=round(percentile(latencies, 0.95), 3),
+            max_latency=round(max(latencies, default=0.0), 3),
+            failures=failures,
+        )
+        step.violations = self.limits.check(step)
+        logger.info(
+            "Finished ramp step with %s instances: %s",
+            concurrency,
+            "ok" if step.passed else "; ".join(step.violations),
+        )
+        return step
+
+    def _next_concurrency(self, concurrency: int) -> int:
+        if self.schedule == "linear":
+            return concurrency + self.step
+        return concurrency * 2
+
+    def run(self) -> RampReport:
+        report = RampReport(self.schedule)
+        passed, failed = 0, None
+        concurrency = 1
+        while concurrency <= self.max_concurrency:
+            step = self.run_step(concurrency)
+            report.steps.append(step)
+            if not step.passed:
+                failed = concurrency
+                break
+            passed = concurrency
+            if concurrency == self.max_concurrency:
+                break
+            concurrency = min(self._next_concurrency(concurrency), self.max_concurrency)
+        if self.schedule == "binary" and failed is not None:
+            while failed - passed > 1:
+                concurrency = (passed + failed) // 2
+                step = self.run_step(concurrency)
+                report.steps.append(step)
+                if step.passed:
+                    passed = concurrency
+                else:
+                    failed = concurrency
+        logger.info(
+            "Max sustainable concurrency: %s", report.max_sustainable_concurrency
+        )
+        return report
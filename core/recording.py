@@ -0,0 +1,209 @@
+"""This module contains the persistent recording format of monitoring runs.
+
+A recording starts with a header carrying the run metadata as JSON,
+followed by columnar chunks. Each chunk holds the samples of one metric:
+timestamps as millisecond deltas packed as int32 and values packed as
+float64, all little-endian. A metric is only recorded on the ticks it was
+sampled on, so the deltas are its actual, adaptive, sampling intervals.
+"""
+
+import csv
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Any, Iterator, TextIO
+
+from .metrics import MetricBatch, MetricList, cast_little_endian, to_little_endian
+from .scheduler import Snapshot
+from .logger import setup_logger
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+MAGIC = b"SMAUGREC"
+VERSION = 1
+# magic, version, metadata length
+HEADER_STRUCT = struct.Struct("<8sHI")
+# magic, name length, sample count, timestamp of the first sample in ms
+CHUNK_STRUCT = struct.Struct("<4sHIq")
+CHUNK_MAGIC = b"CHNK"
+
+
+class Recorder:
+    """Buffers numeric samples per metric and appends them as chunks."""
+
+    def __init__(self, path: str, metadata: dict[str, Any], chunk_size: int = 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._columns: dict[str, tuple[array, array]] = {}
+        self._last_timestamps: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._file = open(path, "wb")  # pylint: disable=consider-using-with
+        metadata_bytes = json.dumps(metadata).encode()
+        self._file.write(HEADER_STRUCT.pack(MAGIC, VERSION, len(metadata_bytes)))
+        self._file.write(metadata_bytes)
+        logger.info("Recording the run to %s", path)
+
+    def record_batch(self, batch: MetricBatch, timestamp: float) -> None:
+        timestamp_ms = int(timestamp * 1000)
+        with self._lock:
+            if self._file.closed:
+                return
+            for name, value in zip(batch.names, batch.values):
+                if name not in self._columns:
+                    self._columns[name] = (array("q"), array("d"))
+                timestamps, values = self._columns[name]
+                timestamps.append(timestamp_ms)
+                values.append(value)
+                if len(values) >= self.chunk_size:
+                    self._write_chunk(name)
+
+    def record_metrics(self, metrics: MetricList, timestamp: float) -> None:
+        # only numeric samples are recorded
+        self.record_batch(MetricBatch.from_metrics(metrics), timestamp)
+
+    def record(self, snapshot: Snapshot) -> None:
+        batch = MetricBatch.from_metrics(
+            metric for name in snapshot.updated for metric in snapshot.records[name]
+        )
+        self.record_batch(batch, snapshot.context.timestamp)
+
+    def _write_chunk(self, name: str) -> None:
+        timestamps, values = self._columns.pop(name)
+        if not values:
+            return
+        deltas = array("i", [0])
+        deltas.extend(t2 - t1 for t1, t2 in zip(timestamps, timestamps[1:]))
+        name_bytes = name.encode()
+        self._file.write(
+            CHUNK_STRUCT.pack(CHUNK_MAGIC, len(name_bytes), len(values), timestamps[0])
+        )
+        self._file.write(name_bytes)
+        self._file.write(to_little_endian(deltas))
+        self._file.write(to_little_endian(values))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            for name in list(self._columns):
+                self._write_chunk(name)
+            self._file.close()
+        logger.info("Finished recording the run to %s", self.path)
+
+    def __enter__(self) -> "Recorder":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class Chunk:
+    """Columns of one chunk, backed by the memory map of the recording."""
+
+    def __init__(self, name: str, base_timestamp: int, deltas: memoryview, values: memoryview):
+        self.name = name
+        self.base_timestamp = base_timestamp
+        self.deltas = deltas
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def timestamps(self) -> Iterator[float]:
+        timestamp = self.base_timestamp
+        for delta in self.deltas:
+            timestamp += delta
+            yield timestamp / 1000
+
+    def samples(self) -> Iterator[tuple[float, float]]:
+        return zip(self.timestamps(), self.values)
+
+
+class RecordingReader:
+    """Streams a recording through a memory map without loading it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")  # pylint: disable=consider-using-with
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, metadata_len = HEADER_STRUCT.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a Smaug recording")
+        if version != VERSION:
+            raise ValueError(f"Unsupported recording version {version}")
+        start = HEADER_STRUCT.size
+        self.metadata = json.loads(self._map[start:start + metadata_len])
+        self._data_offset = start + metadata_len
+
+    def _column(self, offset: int, count: int, typecode: str) -> memoryview:
+        size = array(typecode).itemsize * count
+        return cast_little_endian(memoryview(self._map)[offset:offset + size], typecode)
+
+    def chunks(self, name: str | None = None) -> Iterator[Chunk]:
+        offset = self._data_offset
+        while offset + CHUNK_STRUCT.size <= len(self._map):
+            magic, name_len, count, base_timestamp = CHUNK_STRUCT.unpack_from(self._map, offset)
+            if magic != CHUNK_MAGIC:
+                raise ValueError(f"Corrupted chunk at offset {offset} of {self.path}")
+            name_offset = offset + CHUNK_STRUCT.size
+            deltas_offset = name_offset + name_len
+            values_offset = deltas_offset + 4 * count
+            end = values_offset + 8 * count
+            if end > len(self._map):
+                logger.warning("Recording %s ends with a truncated chunk", self.path)
+                return
+            chunk_name = self._map[name_offset:deltas_offset].decode()
+            if name is None or chunk_name == name:
+                yield Chunk(
+                    chunk_name,
+                    base_timestamp,
+                    self._column(deltas_offset, count, "i"),
+                    self._column(values_offset, count, "d"),
+                )
+            offset = end
+
+    def metric_names(self) -> list[str]:
+        names = {}
+        for chunk in self.chunks():
+            names[chunk.name] = None
+        return list(names)
+
+    def samples(self, name: str | None = None) -> Iterator[tuple[str, float, float]]:
+        for chunk in self.chunks(name):
+            for timestamp, value in chunk.samples():
+                yield chunk.name, timestamp, value
+
+    def close(self) -> None:
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # chunks still reference the map, it is released with them
+        self._file.close()
+
+    def __enter__(self) -> "RecordingReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def export_csv(reader: RecordingReader, output: TextIO, name: str | None = None) -> None:
+    writer = csv.writer(output)
+    writer.writerow(["timestamp", "metric", "value"])
+    for metric_name, timestamp, value in reader.samples(name):
+        writer.writerow([f"{timestamp:.3f}", metric_name, value])
+
+
+def export_jsonl(reader: RecordingReader, output: TextIO, name: str | None = None) -> None:
+    output.write(json.dumps({"metadata": reader.metadata}) + "\n")
+    for metric_name, timestamp, value in reader.samples(name):
+        output.write(
+            json.dumps({"timestamp": round(timestamp, 3), "metric": metric_name, "value": value})
+            + "\n"
+        )
+
+
+EXPORTERS = {"csv": export_csv, "jsonl": export_jsonl}
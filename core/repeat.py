@@ -0,0 +1,227 @@
+"""This module contains the sequential repetition mode and its baseline comparison."""
+
+import json
+import os
+import statistics
+import subprocess
+import time
+from dataclasses import dataclass, field, asdict
+
+from .aggregates import bootstrap_interval, percentile
+from .runner import ScriptRunner
+from .logger import setup_logger
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+RUN_METRICS = ("wall time", "cpu time", "peak rss")
+# unit and scale of every metric in the printed report
+UNITS = {"wall time": ("s", 1), "cpu time": ("s", 1), "peak rss": ("MB", 2**20)}
+
+
+@dataclass
+class RunResult:
+
+    index: int
+    wall_time: float  # s, from the launch until every instance exited
+    cpu_time: float  # s, user and system time of the instances and their children
+    peak_rss: int  # B, highest RSS of a single instance or child
+    failures: int = 0
+
+    def get(self, metric: str) -> float:
+        return getattr(self, metric.replace(" ", "_"))
+
+
+@dataclass
+class RunSummary:
+
+    median: float
+    mean: float
+    stdev: float
+    min: float
+    max: float
+    p90: float
+    p95: float
+    ci_low: float  # bootstrap confidence interval of the median
+    ci_high: float
+
+    @classmethod
+    def from_values(cls, values: list[float], confidence: float) -> "RunSummary":
+        ci_low, ci_high = bootstrap_interval([values], confidence=confidence, seed=0)
+        return cls(
+            median=statistics.median(values),
+            mean=statistics.fmean(values),
+            stdev=statistics.stdev(values) if len(values) > 1 else 0.0,
+            min=min(values),
+            max=max(values),
+            p90=percentile(values, 0.9),
+            p95=percentile(values, 0.95),
+            ci_low=ci_low,
+            ci_high=ci_high,
+        )
+
+
+@dataclass
+class Regression:
+
+    metric: str
+    baseline: float  # median of the baseline runs
+    current: float  # median of the current runs
+    ratio_low: float  # bootstrap confidence interval of current / baseline
+    ratio_high: float
+
+    def __str__(self) -> str:
+        return (
+            f"{self.metric}: median {self.baseline:.6g} -> {self.current:.6g} "
+            f"(x{self.ratio_low:.3f} to x{self.ratio_high:.3f})"
+        )
+
+
+@dataclass
+class RepeatReport:
+
+    warmup: int
+    confidence: float
+    runs: list[RunResult] = field(default_factory=list)
+
+    @property
+    def failures(self) -> int:
+        return sum(run.failures for run in self.runs)
+
+    def values(self, metric: str) -> list[float]:
+        return [run.get(metric) for run in self.runs]
+
+    @property
+    def summaries(self) -> dict[str, RunSummary]:
+        if not self.runs:
+            return {}
+        return {
+            metric: RunSummary.from_values(self.values(metric), self.confidence)
+            for metric in RUN_METRICS
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "warmup": self.warmup,
+            "confidence": self.confidence,
+            "failures": self.failures,
+            "runs": [asdict(run) for run in self.runs],
+            "summaries": {
+                metric: asdict(summary) for metric, summary in self.summaries.items()
+            },
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def compare(self, baseline: dict, threshold: float) -> list[Regression]:
+        """Return the metrics that are significantly over ``threshold`` worse than the baseline.
+
+        A metric regressed when the whole bootstrap confidence interval of the
+        ratio of the current median to the baseline median lies above
+        ``1 + threshold``, so that noise alone does not fail a run.
+        """
+        regressions = []
+        for metric in RUN_METRICS:
+            key = metric.replace(" ", "_")
+            base_values = [run[key] for run in baseline.get("runs", []) if key in run]
+            values = self.values(metric)
+            if not base_values or not values:
+                continue
+            base_median = statistics.median(base_values)
+            if base_median <= 0:
+                continue
+
+            def ratio(current: list[float], base: list[float]) -> float:
+                base = statistics.median(base)
+                return statistics.median(current) / base if base > 0 else float("inf")
+
+            ratio_low, ratio_high = bootstrap_interval(
+                [values, base_values], ratio, self.confidence, seed=0
+            )
+            if ratio_low > 1 + threshold:
+                regressions.append(Regression(
+                    metric, base_median, statistics.median(values), ratio_low, ratio_high
+                ))
+        return regressions
+
+    def __str__(self) -> str:
+        header = f"{'run':>5} | {'wall s':>9} | {'cpu s':>9} | {'peak rss MB':>11} | failed"
+        lines = [header, "-" * len(header)]
+        for run in self.runs:
+            lines.append(
+                f"{run.index:>5} | {run.wall_time:>9.3f} | {run.cpu_time:>9.3f} "
+                f"| {run.peak_rss / 2**20:>11.1f} | {run.failures:>6}"
+            )
+        lines.append("")
+        header = (
+            f"{'metric':<13} | {'median':>9} | {'mean':>9} | {'stdev':>9} | {'p95':>9} "
+            f"| {f'{self.confidence:.0%} ci of the median':>24}"
+        )
+        lines.extend([header, "-" * len(header)])
+        for metric, summary in self.summaries.items():
+            unit, scale = UNITS[metric]
+            median, mean, stdev, p95, ci_low, ci_high = (
+                value / scale for value in (summary.median, summary.mean, summary.stdev,
+                                            summary.p95, summary.ci_low, summary.ci_high)
+            )
+            lines.append(
+                f"{f'{metric} {unit}':<13} | {median:>9.3f} | {mean:>9.3f} | {stdev:>9.3f} "
+                f"| {p95:>9.3f} | {f'{ci_low:.3f} - {ci_high:.3f}':>24}"
+            )
+        return "\n".join(lines)
+
+
+class RepeatedRun:
+    """Runs the script ``repeat`` times one after another, after ``warmup`` discarded runs.
+
+    Each run launches ``num`` instances at once and waits for all of them;
+    their CPU time and peak RSS come from the kernel's resource usage of
+    the waited-for processes, which includes their own children.
+    """
+
+    def __init__(self, runner: ScriptRunner, repeat: int, warmup: int = 1, num: int = 1,
+                 confidence: float = 0.95):
+        if repeat < 1:
+            raise ValueError("At least one run should be repeated")
+        self.runner = runner
+        self.repeat = repeat
+        self.warmup = warmup
+        self.num = num
+        self.confidence = confidence
+
+    def _wait(self, process: subprocess.Popen) -> tuple[float, int, int]:
+        """Reap an instance, return its CPU time, peak RSS and exit code."""
+        _, status, usage = os.wait4(process.pid, 0)
+        # tell Popen that the process is gone, it must not wait for it again
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024, process.returncode
+
+    def run_once(self, index: int) -> RunResult:
+        started = time.monotonic()
+        processes = self.runner.run_script_in_venv(self.num)
+        usages = [self._wait(process) for process in processes]
+        wall_time = time.monotonic() - started
+        for process in processes:
+            self.runner.monitor.instance_monitor.untrack(process.pid)
+        return RunResult(
+            index=index,
+            wall_time=wall_time,
+            cpu_time=sum(cpu_time for cpu_time, _, _ in usages),
+            peak_rss=max(peak_rss for _, peak_rss, _ in usages),
+            failures=sum(1 for _, _, returncode in usages if returncode != 0),
+        )
+
+    def run(self) -> RepeatReport:
+        for index in range(self.warmup):
+            logger.info("Starting warmup run %s of %s", index + 1, self.warmup)
+            self.run_once(-index - 1)
+        report = RepeatReport(self.warmup, self.confidence)
+        for index in range(self.repeat):
+            logger.info("Starting run %s of %s", index + 1, self.repeat)
+            result = self.run_once(index)
+            report.runs.append(result)
+            logger.info(
+                "Finished run %s in %.3fs, %.3fs cpu, %s failures",
+                index + 1, result.wall_time, result.cpu_time, result.failures,
+            )
+        return report
@@ -1,11 +1,14 @@
 
 import os
 import subprocess
-from threading import Thread
 from typing import NoReturn
 
 from .builder import Builder
+from .capture import LineHandler, OutputCapture
+from .profiler import AllocationProfiler, InjectedProfiler
+from .tail import BatchTailBuffer, RawFileTail
 from .monitoring import TestedAppMonitor
+from .telemetry import TelemetryCollector
 from .logger import setup_logger
 
 logger = setup_logger(f"smaug_{os.getpid()}")
@@ -13,18 +16,40 @@ logger = setup_logger(f"smaug_{os.getpid()}")
 
 class ScriptRunner:
 
-    def __init__(self, main_file: str, use_buffer: bool):
+    def __init__(self, main_file: str, use_buffer: bool,
+                 windows: tuple[float, ...] = (),
+                 builder: Builder | None = None, raw_output: bool = False,
+                 subtract_self: bool = False, base_interval: float = 0.1,
+                 max_interval: float | None = None,
+                 profilers: dict[str, InjectedProfiler] | None = None,
+                 telemetry: bool = False):
         logger.info(
             "Initializing ScriptRunner with main_file: %s",
             main_file,
         )
         self.main_file = main_file
         self.use_buffer = use_buffer
+        self.raw_output = raw_output
+        self.max_interval = max_interval
         self.filename = os.path.basename(self.main_file)
-        self.builder = Builder()
-        self.monitor = TestedAppMonitor(self.builder.build_dir)
+        self.builder = builder or Builder()
+        self.monitor = TestedAppMonitor(self.builder.build_dir, windows, subtract_self,
+                                        base_interval, max_interval)
         self.builder.build(self.dir_path)
+        # injected profilers, keyed by the path prefix of their output
+        self.profilers = profilers or {}
+        if self.profilers or telemetry:
+            self.inject_dir = self.builder.install_injected_modules()
+        for profiler in self.profilers.values():
+            if isinstance(profiler, AllocationProfiler):
+                self.monitor.scheduler.add_collector("allocations", profiler, profiler.interval)
+        self.telemetry = None
+        if telemetry:
+            self.telemetry = TelemetryCollector(self.monitor.instance_monitor)
+            self.monitor.scheduler.add_collector("telemetry", self.telemetry)
         self.processes = []
+        self.capture = OutputCapture()
+        self.tails = BatchTailBuffer()
         logger.info("Initialized ScriptRunner")
 
     @property
@@ -46,23 +71,27 @@ class ScriptRunner:
         if not os.path.exists(self._main_file):
             raise FileNotFoundError(f"Script {self._main_file} does not exist")
 
-    def _log_output(self, process) -> None:
+    def _get_output_handler(self, process: subprocess.Popen) -> LineHandler:
         test_logger = setup_logger(
             f"smaug_{os.getpid()}_test_{process.pid}", stream_handler=False
         )
-        while process.poll() is None:
-            output = process.stdout.readline().decode().strip()
-            while output:
-                test_logger.info(output)
-                output = process.stdout.readline().decode().strip()
-
-            error = process.stderr.readline().decode().strip()
-            while error:
-                test_logger.error(error)
-                error = process.stderr.readline().decode().strip()
-
-    def run_script_in_venv(self, num: int) -> None:
+        tail = self.tails[process.pid]
+
+        def log_line(line: bytes, is_error: bool) -> None:
+            tail.append(line, is_error)
+            text = line.decode(errors="replace").strip()
+            if not text:
+                return
+            if is_error:
+                test_logger.error(text)
+            else:
+                test_logger.info(text)
+
+        return log_line
+
+    def run_script_in_venv(self, num: int) -> list[subprocess.Popen]:
         logger.info("Starting to run script in virtual environment %s times", num)
+        processes = []
         for _ in range(num):
             python_exe = f"{self.builder.build_dir}/venv/bin/python"
             script_path = os.path.join(self.builder.build_dir, self.filename)
@@ -70,12 +99,55 @@ class ScriptRunner:
                 cmd_args = [python_exe, script_path]
             else:
                 cmd_args = [python_exe, "-u", script_path]
-            process = subprocess.Popen(
-                cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
+            pipes = [(profiler, *os.pipe()) for profiler in self.profilers.values()]
+            segment = self.telemetry.create_segment() if self.telemetry else None
+            env = None
+            if pipes or segment:
+                settings = {}
+                for profiler, _, write_fd in pipes:
+                    settings.update(profiler.get_environ(write_fd))
+                if segment:
+                    settings.update(self.telemetry.get_environ(segment))
+                env = self._get_inject_environ(settings)
+            try:
+                process = subprocess.Popen(
+                    cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                    pass_fds=[write_fd for _, _, write_fd in pipes],
+                )
+            except BaseException:
+                if segment:
+                    segment.close()
+                raise
+            finally:
+                for _, _, write_fd in pipes:
+                    os.close(write_fd)
+            for profiler, read_fd, _ in pipes:
+                self.capture.add_fd(read_fd, profiler.get_handler(process.pid))
+            processes.append(process)
             self.processes.append(process)
-            Thread(target=self._log_output, args=(process,), daemon=True).start()
+            self.monitor.instance_monitor.track(process.pid)
+            if segment:
+                # after track(), the collector drops the segments of untracked instances
+                self.telemetry.attach(process.pid, segment)
+            if self.raw_output:
+                path_prefix = f"logs/smaug_{os.getpid()}_test_{process.pid}"
+                self.capture.add_raw(process, path_prefix)
+                self.tails[f"{process.pid}.out"] = RawFileTail(f"{path_prefix}.out")
+                self.tails[f"{process.pid}.err"] = RawFileTail(f"{path_prefix}.err")
+            else:
+                self.capture.add(process, self._get_output_handler(process))
         logger.info("Finished running script in virtual environment")
+        return processes
+
+    def _get_inject_environ(self, settings: dict[str, str]) -> dict[str, str]:
+        """Environment that loads the injected sitecustomize with ``settings``."""
+        env = dict(os.environ, **settings)
+        env["SMAUG_PARENT_PID"] = str(os.getpid())
+        env["SMAUG_ROOT"] = self.builder.build_dir
+        env["PYTHONPATH"] = os.pathsep.join(
+            path for path in (self.inject_dir, os.environ.get("PYTHONPATH")) if path
+        )
+        return env
 
     def run(self, num: int = 1) -> None:
         logger.info("Starting to run the script %s times", num)
@@ -86,5 +158,16 @@ class ScriptRunner:
         logger.info("Stopping the script execution and monitoring")
         for process in self.processes:
             process.terminate()
+        self.capture.stop()
         self.monitor.stop()
+        if self.telemetry:
+            self.telemetry.close()
+        self.save_profiles()
         logger.info("Stopped the script execution and monitoring")
+
+    def save_profiles(self) -> None:
+        for path_prefix, profiler in self.profilers.items():
+            paths = profiler.save(path_prefix)
+            logger.info("Saved the %s output to %s", profiler.__class__.__name__,
+                        ", ".join(paths))
+            logger.info(profiler.summary())
@@ -0,0 +1,228 @@
+"""This module contains the tick-driven sampling scheduler shared by all monitors."""
+
+import math
+import os
+import threading
+import time
+from typing import Callable, Protocol
+
+from .metrics import MetricList, get_max_value
+from .procfs import READERS, parse_fields
+from .logger import setup_logger
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+
+class TickContext:
+    """State of a single tick; every /proc file is read at most once per tick."""
+
+    def __init__(self, tick: int = 0, timestamp: float | None = None,
+                 monotonic: float | None = None):
+        self.tick = tick
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.monotonic = time.monotonic() if monotonic is None else monotonic
+        self._reads: dict[str, bytes] = {}
+
+    @property
+    def epoch(self) -> int:
+        return int(self.timestamp)
+
+    def read_bytes(self, path: str) -> bytes:
+        if path not in self._reads:
+            self._reads[path] = READERS.read(path)
+        return self._reads[path]
+
+    def read(self, path: str) -> str:
+        return self.read_bytes(path).decode()
+
+    def read_fields(self, path: str, fields: tuple[str, ...]) -> dict[str, int]:
+        return parse_fields(self.read_bytes(path), fields)
+
+
+class Snapshot:
+    """Latest records of every collector, aligned on one tick."""
+
+    def __init__(self, context: TickContext, records: dict[str, MetricList],
+                 updated: tuple[str, ...] = ()):
+        self.context = context
+        self.records = records
+        self.updated = updated  # collectors that sampled on this tick
+
+    @property
+    def epoch(self) -> int:
+        return self.context.epoch
+
+    @property
+    def metrics(self) -> MetricList:
+        return MetricList([metric for records in self.records.values() for metric in records])
+
+
+class Collector(Protocol):
+
+    def collect(self, context: TickContext) -> MetricList:
+        ...
+
+
+class AdaptiveInterval:
+    """Sampling interval, in ticks, that follows how much the samples vary.
+
+    A numeric metric changes when it moved by more than ``threshold`` since
+    the previous sample and by more than ``noise`` standard deviations of its
+    usual moves; any change resets the interval to ``min_every``. After
+    ``patience`` steady samples in a row the interval doubles, up to
+    ``max_every``. A metric that keeps swinging around its mean thus lets the
+    sampling back off, while one that trends or jumps does not. Moves are
+    relative to the metric's max value, e.g. 100 for percentages, or else to
+    the metric itself; their mean and variance are weighted exponentially by
+    ``smoothing``.
+    """
+
+    def __init__(self, min_every: int, max_every: int, threshold: float = 0.1,
+                 patience: int = 3, noise: float = 3.0, smoothing: float = 0.2):
+        self.min_every = min_every
+        self.max_every = max(min_every, max_every)
+        self.threshold = threshold
+        self.patience = patience
+        self.noise = noise
+        self.smoothing = smoothing
+        self.every = min_every
+        self._steady = 0
+        self._last: dict[str, float] = {}
+        self._moves: dict[str, tuple[float, float]] = {}  # mean move and mean squared move
+
+    def _get_spread(self, name: str, move: float) -> float:
+        """Return the standard deviation of the previous moves, then add ``move``."""
+        mean, square = self._moves.get(name, (move, move * move))
+        spread = math.sqrt(max(0.0, square - mean * mean))
+        self._moves[name] = (mean + self.smoothing * (move - mean),
+                             square + self.smoothing * (move * move - square))
+        return spread
+
+    def get_change(self, records: MetricList) -> float:
+        change = 0.0
+        for metric in records:
+            value = metric.value
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            previous = self._last.get(metric.name)
+            self._last[metric.name] = value
+            if previous is None:
+                continue
+            move = value - previous
+            if abs(move) <= self.noise * self._get_spread(metric.name, move):
+                continue  # within the usual variability of the metric
+            scale = get_max_value(metric.name) or max(abs(previous), abs(value), 1.0)
+            change = max(change, abs(move) / scale)
+        return change
+
+    def update(self, records: MetricList) -> int:
+        if self.get_change(records) > self.threshold:
+            self.every = self.min_every
+            self._steady = 0
+        else:
+            self._steady += 1
+            if self._steady >= self.patience:
+                self.every = min(self.every * 2, self.max_every)
+                self._steady = 0
+        return self.every
+
+
+class Scheduler:
+    """Fires drift-free ticks on the monotonic clock.
+
+    Tick ``k`` is due at ``start + k * base_interval``; a late tick does not
+    push the following ones back, and ticks missed entirely are skipped.
+    Collectors and listeners run every ``interval // base_interval`` ticks.
+    Collectors given a ``max_interval`` sample adaptively between the two.
+    """
+
+    def __init__(self, base_interval: float = 0.1):
+        self.base_interval = base_interval
+        self.missed_ticks = 0
+        self.jitter = 0.0  # how late the last tick started, in seconds
+        self.latencies: dict[str, float] = {}  # last collect() duration per collector
+        self._collectors: list[tuple[str, Collector, AdaptiveInterval]] = []
+        self._next_ticks: dict[str, int] = {}  # tick on which a collector samples next
+        self._listeners: list[tuple[Callable[[Snapshot], None], int]] = []
+        self._records: dict[str, MetricList] = {}
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _every(self, interval: float | None) -> int:
+        if interval is None:
+            return 1
+        return max(1, round(interval / self.base_interval))
+
+    def add_collector(self, name: str, collector: Collector,
+                      interval: float | None = None,
+                      max_interval: float | None = None) -> None:
+        every = self._every(interval)
+        max_every = self._every(max_interval) if max_interval else every
+        sampler = AdaptiveInterval(every, max_every)
+        # copy on write, the tick thread iterates over the current list
+        self._collectors = self._collectors + [(name, collector, sampler)]
+
+    def get_interval(self, name: str) -> float:
+        """Return the current sampling interval of a collector, in seconds."""
+        for collector_name, _, sampler in self._collectors:
+            if collector_name == name:
+                return sampler.every * self.base_interval
+        raise KeyError(name)
+
+    def add_listener(self, listener: Callable[[Snapshot], None],
+                     interval: float | None = None) -> None:
+        self._listeners = self._listeners + [(listener, self._every(interval))]
+
+    def start(self) -> None:
+        logger.info("Starting the scheduler with a %ss tick", self.base_interval)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        logger.info("Stopping the scheduler")
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def tick(self, tick: int, context: TickContext | None = None) -> Snapshot:
+        context = context or TickContext(tick)
+        updated = []
+        for name, collector, sampler in self._collectors:
+            if tick < self._next_ticks.get(name, 0):
+                continue
+            started = time.perf_counter()
+            try:
+                records = collector.collect(context)
+                self._records[name] = records
+                updated.append(name)
+                self._next_ticks[name] = tick + sampler.update(records)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Collector %s failed on tick %s", name, tick)
+                self._next_ticks[name] = tick + sampler.min_every
+            self.latencies[name] = time.perf_counter() - started
+        snapshot = Snapshot(context, dict(self._records), tuple(updated))
+        for listener, every in self._listeners:
+            if tick % every == 0:
+                try:
+                    listener(snapshot)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Listener %s failed on tick %s", listener, tick)
+        return snapshot
+
+    def _run(self) -> None:
+        start = time.monotonic()
+        tick = 0
+        while not self._stop_event.is_set():
+            due = start + tick * self.base_interval
+            delay = due - time.monotonic()
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+            now = time.monotonic()
+            self.jitter = max(0.0, now - due)
+            wall_offset = time.time() - now
+            self.tick(tick, TickContext(tick, due + wall_offset, now))
+            next_tick = int((time.monotonic() - start) / self.base_interval) + 1
+            self.missed_ticks += max(0, next_tick - tick - 1)
+            tick = max(tick + 1, next_tick)
@@ -1,7 +1,10 @@
-
+import mmap
 import os
 import pickle
+import struct
 import tempfile
+import threading
+import time
 from pickle import UnpicklingError
 from typing import Any
 
@@ -10,6 +13,9 @@ from .logger import setup_logger
 
 logger = setup_logger(f"smaug_{os.getpid()}")
 
+# epoch (int64) + value (float64) + interval (float64)
+RECORD_STRUCT = struct.Struct("<qdd")
+
 
 class TempStorage:
 
@@ -28,9 +34,9 @@ class TempStorage:
         self._file.seek(0)
         while True:
             try:
-                record = pickle.load(self._file)
-                if record.get("epoch") == epoch:
-                    return Metric.from_dict(record)
+                metric = Metric.from_bytes(pickle.load(self._file))
+                if metric.epoch == epoch:
+                    return metric
             except EOFError:
                 break
         return None
@@ -52,7 +58,7 @@ class TempStorage:
         while True:
             try:
                 record = pickle.load(self._file)
-                if record.get("epoch") != epoch:
+                if Metric.from_bytes(record).epoch != epoch:
                     records.append(record)
             except EOFError:
                 break
@@ -66,8 +72,104 @@ class TempStorage:
         self._file.close()
 
 
+class RingBufferStorage:
+    """Fixed-width numeric records in a bounded, memory-mapped ring buffer.
+
+    The mapping is anonymous, so a storage holds no file descriptor, and its
+    pages are only committed once records are written to them.
+    """
+
+    def __init__(self, name: str = None, max_size: int = 1000):
+        self.name = name or ""
+        self.max_size = max_size * 1024  # in kilobytes
+        self.capacity = max(1, self.max_size // RECORD_STRUCT.size)
+        self._buffer = mmap.mmap(-1, self.capacity * RECORD_STRUCT.size)
+        self.last_saved = time.monotonic()
+        self._head = 0  # slot the next record is written to
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def save_record(self, data: Metric) -> None:
+        try:
+            value = float(data.value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(
+                f"Metric {data.name} has a non-numeric value: {data.value!r}"
+            ) from e
+        self.last_saved = time.monotonic()
+        with self._lock:
+            RECORD_STRUCT.pack_into(
+                self._buffer, self._head * RECORD_STRUCT.size, int(data.epoch), value,
+                float(data.interval)
+            )
+            self._head = (self._head + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def _slot(self, index: int) -> int:
+        """Map a 0-based position counted from the oldest record to a slot."""
+        return (self._head - self._count + index) % self.capacity
+
+    def _read_slot(self, slot: int) -> Metric:
+        epoch, value, interval = RECORD_STRUCT.unpack_from(
+            self._buffer, slot * RECORD_STRUCT.size
+        )
+        return Metric(self.name, value, epoch, interval)
+
+    def get_record(self, epoch: int) -> Metric | None:
+        with self._lock:
+            for index in range(self._count - 1, -1, -1):
+                record = self._read_slot(self._slot(index))
+                if record.epoch == epoch:
+                    return record
+        return None
+
+    def get_last_records(self, tail: int = 0) -> list[Metric]:
+        with self._lock:
+            count = self._count if tail <= 0 else min(tail, self._count)
+            return [
+                self._read_slot(self._slot(index))
+                for index in range(self._count - count, self._count)
+            ]
+
+    def delete_record(self, epoch: int) -> None:
+        with self._lock:
+            kept = []
+            for index in range(self._count):
+                slot = self._slot(index)
+                offset = slot * RECORD_STRUCT.size
+                if RECORD_STRUCT.unpack_from(self._buffer, offset)[0] != epoch:
+                    kept.append(self._buffer[offset:offset + RECORD_STRUCT.size])
+            for slot, record in enumerate(kept):
+                offset = slot * RECORD_STRUCT.size
+                self._buffer[offset:offset + RECORD_STRUCT.size] = record
+            self._count = len(kept)
+            self._head = self._count % self.capacity
+
+    def __del__(self):
+        if hasattr(self, "_buffer"):
+            self._buffer.close()
+
+
 class BatchTempStorage(dict):
+    """Storages by metric name, created on the first record of a metric.
+
+    At most ``max_storages`` exist; past that the storage written to the
+    longest ago is dropped, e.g. the one of a metric that is no longer sampled.
+    """
+
+    def __init__(self, storage_class: type = RingBufferStorage, max_size: int = 1000,
+                 max_storages: int = 256):
+        super().__init__()
+        self.storage_class = storage_class
+        self.max_size = max_size
+        self.max_storages = max_storages
 
-    def __missing__(self, key: Any) -> TempStorage:
-        self[key] = TempStorage(key)
+    def __missing__(self, key: Any) -> RingBufferStorage | TempStorage:
+        if len(self) >= self.max_storages:
+            stalest = min(self, key=lambda name: getattr(self[name], "last_saved", 0.0))
+            del self[stalest]
+        self[key] = self.storage_class(key, self.max_size)
         return self[key]
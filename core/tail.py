@@ -0,0 +1,92 @@
+"""This module contains the tails of the script output shown in the log pane."""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any
+
+from .capture import lookup_raw_timestamp
+
+
+def tail_file(path: str, num_lines: int, block_size: int = 8192) -> list[bytes]:
+    """Return the last lines of a file, reading it backwards block by block."""
+    if num_lines <= 0:
+        return []
+    with open(path, "rb") as file:
+        position = file.seek(0, os.SEEK_END)
+        data = b""
+        # one line more than needed, the first one may be cut
+        while position > 0 and data.count(b"\n") <= num_lines:
+            size = min(block_size, position)
+            position -= size
+            file.seek(position)
+            data = file.read(size) + data
+    return data.splitlines()[-num_lines:]
+
+
+def format_line(timestamp: float, is_error: bool, line: str) -> str:
+    stamp = time.strftime("%H:%M:%S", time.localtime(timestamp))
+    return f"{stamp},{int(timestamp % 1 * 1000):03d} {'ERROR' if is_error else 'INFO'} {line}"
+
+
+class TailBuffer:
+    """The last ``max_lines`` output lines of an instance, kept as raw bytes."""
+
+    def __init__(self, max_lines: int = 256):
+        self._lines: deque[tuple[float, bool, bytes]] = deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+
+    def append(self, line: bytes, is_error: bool = False) -> None:
+        with self._lock:
+            self._lines.append((time.time(), is_error, line))
+
+    def tail(self, num_lines: int) -> list[str]:
+        with self._lock:
+            count = min(num_lines, len(self._lines))
+            lines = [self._lines[-index] for index in range(count, 0, -1)]
+        return [
+            format_line(timestamp, is_error, line.decode(errors="replace").strip())
+            for timestamp, is_error, line in lines
+        ]
+
+
+class FileTail:
+    """Tail of a log file written by the logger, e.g. by an earlier run."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def tail(self, num_lines: int) -> list[str]:
+        try:
+            lines = tail_file(self.path, num_lines)
+        except FileNotFoundError:
+            return []
+        return [line.decode(errors="replace") for line in lines]
+
+
+class RawFileTail(FileTail):
+    """Tail of a raw output file, stamped from its side index."""
+
+    def tail(self, num_lines: int) -> list[str]:
+        try:
+            size = os.path.getsize(self.path)
+            lines = tail_file(self.path, num_lines)
+        except FileNotFoundError:
+            return []
+        if not lines:
+            return []
+        start = size - sum(len(line) + 1 for line in lines)
+        timestamp = lookup_raw_timestamp(self.path, max(0, start)) or time.time()
+        is_error = self.path.endswith(".err")
+        return [
+            format_line(timestamp, is_error, line.decode(errors="replace").strip())
+            for line in lines
+        ]
+
+
+class BatchTailBuffer(dict):
+
+    def __missing__(self, key: Any) -> TailBuffer:
+        self[key] = TailBuffer()
+        return self[key]
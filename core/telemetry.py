@@ -0,0 +1,120 @@
+"""This module contains the shared memory telemetry channel of the launched scripts.
+
+Every instance gets a segment that the injected smaug_telemetry shim writes
+its metrics to; the layout is the one the shim defines. Segments are mapped
+for the whole run, so reading them on a tick is a plain memory read, without
+a system call per metric.
+"""
+
+import os
+import threading
+from multiprocessing import shared_memory
+
+from .inject.smaug_telemetry import (
+    COUNT_OFFSET, COUNT_STRUCT, COUNTER, HEADER_SIZE, HEADER_STRUCT, MAGIC, SLOT_STRUCT,
+    VALUE_OFFSET, VALUE_STRUCT, VERSION,
+)
+from .metrics import Metric, MetricList
+from .monitoring import InstanceMonitor
+from .scheduler import TickContext
+from .logger import setup_logger
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+
+class TelemetrySegment:
+    """The segment of one instance, created and unlinked by Smaug."""
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=HEADER_SIZE + capacity * SLOT_STRUCT.size
+        )
+        HEADER_STRUCT.pack_into(self.shm.buf, 0, MAGIC, VERSION, capacity, 0)
+        self._slots: list[tuple[str, int]] = []  # names and kinds never change once published
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def read(self) -> list[tuple[str, int, float]]:
+        """Return the name, kind and value of every published slot."""
+        buffer = self.shm.buf
+        count = min(COUNT_STRUCT.unpack_from(buffer, COUNT_OFFSET)[0], self.capacity)
+        for index in range(len(self._slots), count):
+            name, kind, _ = SLOT_STRUCT.unpack_from(buffer, HEADER_SIZE + index * SLOT_STRUCT.size)
+            # a name cut at 48 bytes may end in a partial character
+            self._slots.append((name.rstrip(b"\0").decode(errors="ignore"), kind))
+        return [
+            (name, kind, VALUE_STRUCT.unpack_from(
+                buffer, HEADER_SIZE + index * SLOT_STRUCT.size + VALUE_OFFSET
+            )[0])
+            for index, (name, kind) in enumerate(self._slots)
+        ]
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+
+class TelemetryCollector:
+    """Reads the telemetry of every tracked instance on each tick.
+
+    Each published metric becomes ``instance <pid> <name>``; counters also
+    get ``instance <pid> <name> rate``, per second between two ticks. The
+    segments of instances that are no longer tracked are unlinked.
+    """
+
+    def __init__(self, instance_monitor: InstanceMonitor):
+        self.instance_monitor = instance_monitor
+        self.segments: dict[int, TelemetrySegment] = {}
+        self._counters: dict[str, tuple[float, float]] = {}  # last value and time
+        self._lock = threading.Lock()
+
+    def create_segment(self) -> TelemetrySegment:
+        return TelemetrySegment()
+
+    def get_environ(self, segment: TelemetrySegment) -> dict[str, str]:
+        """Variables that make the injected sitecustomize connect the shim."""
+        return {"SMAUG_TELEMETRY_SHM": segment.name}
+
+    def attach(self, pid: int, segment: TelemetrySegment) -> None:
+        with self._lock:
+            self.segments[pid] = segment
+
+    def _get_rate(self, name: str, value: float, context: TickContext) -> float:
+        last = self._counters.get(name)
+        self._counters[name] = (value, context.monotonic)
+        if last is None or context.monotonic <= last[1]:
+            return 0.0
+        return (value - last[0]) / (context.monotonic - last[1])
+
+    def collect(self, context: TickContext) -> MetricList:
+        tracked = set(self.instance_monitor.root_pids)
+        metrics = MetricList()
+        with self._lock:
+            for pid in [pid for pid in self.segments if pid not in tracked]:
+                self._release(pid)
+            for pid, segment in self.segments.items():
+                for name, kind, value in segment.read():
+                    metric_name = f"instance {pid} {name}"
+                    if metric_name in metrics:
+                        continue  # a custom metric named like a generated rate
+                    metrics.append(Metric(metric_name, round(value, 3), context.epoch))
+                    rate_name = f"{metric_name} rate"
+                    if kind == COUNTER and rate_name not in metrics:
+                        rate = self._get_rate(metric_name, value, context)
+                        metrics.append(Metric(rate_name, round(rate, 3), context.epoch))
+        return metrics
+
+    def _release(self, pid: int) -> None:
+        self.segments.pop(pid).close()
+        prefix = f"instance {pid} "
+        self._counters = {
+            name: last for name, last in self._counters.items() if not name.startswith(prefix)
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            for pid in list(self.segments):
+                self._release(pid)
@@ -1,14 +1,38 @@
+"""This module contains the terminal renderer of the metrics table and the log pane."""
 
 import os
-from itertools import zip_longest
-from .metrics import MetricList, MAX_VALUES, QUANTITIES
+import shutil
+import sys
+import threading
+import time
+from .logger import setup_logger
+from .metrics import MetricList, get_max_value, get_quantity
+from .tail import BatchTailBuffer, FileTail, RawFileTail
+
+logger = setup_logger(f"smaug_{os.getpid()}")
+
+# plain text and rendered (coloured) text of a cell, keyed by its (row, column)
+Frame = dict[tuple[int, int], tuple[str, str]]
 
 
 class MetricsDisplay:
+    """Renders the metrics on its own thread, at most ``fps`` frames per second.
+
+    Only the newest metrics are rendered; frames that arrive while the previous
+    one is drawn replace each other. Each frame is diffed against the previous
+    one and only the changed cells are written, using cursor addressing.
+    Extra sections, e.g. Smaug's own metrics, are drawn as tables of their own
+    below the metrics.
+    """
 
-    def __init__(self):
+    def __init__(self, tails: BatchTailBuffer | None = None, fps: float = 4.0):
         self.metrics = None
+        self.sections: dict[str, MetricList] = {}
+        self.tails = tails
+        self.fps = fps
         self.last_update = 0
+        self.dropped_frames = 0
+        self.render_time = 0.0  # seconds the last frame took
         self.colors = {
             "black": "\033[1;30m",
             "red": "\033[1;31m",
@@ -19,24 +43,47 @@ class MetricsDisplay:
             "cyan": "\033[1;36m",
             "white": "\033[1;37m",
         }
+        self.space_len = 10
+        self._frame: Frame = {}
+        self._layout = None
+        self._rows = 0
+        self._pending: tuple[MetricList, dict[str, MetricList]] | None = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
 
-    def clear_screen(self) -> None:
-        clear_code = "\033c"
-        print(clear_code, end="")
+    def clear_screen(self) -> str:
+        return "\033[?25l\033[H\033[2J"
+
+    def get_terminal_size(self) -> os.terminal_size:
+        return shutil.get_terminal_size()
 
     def get_terminal_height(self) -> int:
-        return os.get_terminal_size().lines
+        return self.get_terminal_size().lines
+
+    def get_log_sources(self) -> list[FileTail]:
+        """Tails of the log files of this run, for when no tail buffers are fed."""
+        sources = []
+        for log_file in os.listdir("logs"):
+            if not log_file.startswith(f"smaug_{os.getpid()}_test"):
+                continue
+            if log_file.endswith((".out", ".err")):
+                sources.append(RawFileTail(f"logs/{log_file}"))
+            elif log_file.endswith(".log"):
+                sources.append(FileTail(f"logs/{log_file}"))
+        return sources
 
     def get_logs(self) -> list[str]:
         num_lines = self.get_terminal_height() - 1
-        log_files = [
-            f for f in os.listdir("logs") if f.startswith(f"smaug_{os.getpid()}_test")
-        ]
-        lines_per_file = num_lines // len(log_files)
+        sources = list(self.tails.values()) if self.tails else self.get_log_sources()
+        if not sources:
+            return []
+        lines_per_source = num_lines // len(sources)
         logs = []
-        for log_file in log_files:
-            with open(f"logs/{log_file}", "r", encoding="utf-8") as f:
-                logs.extend(f.readlines()[-lines_per_file:])
+        for source in sources:
+            logs.extend(source.tail(lines_per_source))
         return logs
 
     def colored(self, text: str, color: str):
@@ -75,31 +122,11 @@ class MetricsDisplay:
     def color_word(self, word: str, color: str):
         return f"{self.colors[color]}{word}\033[0m"
 
-    def color_table(self, table_line: str) -> str:
-        borders_color = "cyan"
-        header_color = "cyan"
-        if table_line.startswith("+"):
-            return f"{self.colors[borders_color]}{table_line}\033[0m"
-        if "Metric name" in table_line:
-            for word in table_line.split("|"):
-                if word.strip():
-                    table_line = table_line.replace(
-                        word.strip(), self.color_word(word.strip(), header_color)
-                    )
-        else:
-            metric_name = table_line.split("|")[1].strip()
-            metric_max_value = MAX_VALUES.get(metric_name, 0)
-
-            color = self.rate_value_color(
-                float(table_line.split("|")[2].strip()), metric_max_value
-            )
-            for word in table_line.split("|"):
-                if word.strip():
-                    table_line = table_line.replace(word, self.color_word(word, color))
-        table_line = table_line.replace(
-            "|", self.colors[borders_color] + "|" + "\033[0m"
-        )
-        return table_line
+    def get_metric_color(self, name: str, value) -> str:
+        try:
+            return self.rate_value_color(float(value), get_max_value(name))
+        except (TypeError, ValueError):
+            return "magenta"
 
     def get_max_len(self) -> int:
         return max(
@@ -108,50 +135,136 @@ class MetricsDisplay:
                 if len(metric.name) > len(str(metric.value))
                 else len(str(metric.value))
             )
-            for metric in self.metrics
+            for metric in self.get_all_metrics()
         )
 
+    def get_all_metrics(self) -> list:
+        return [metric for metrics in [self.metrics, *self.sections.values()]
+                for metric in metrics]
+
+    def _add_row(self, frame: Frame, row: int, cells: list[str], widths: list[int],
+                 color: str) -> None:
+        """Add a table row as a border cell followed by a cell per column."""
+        border = self.color_word("|", "cyan")
+        col = 0
+        for text, width in zip(cells, widths):
+            text = f" {text.center(width)} "
+            frame[(row, col)] = ("|", border)
+            frame[(row, col + 1)] = (text, self.color_word(text, color))
+            col += len(text) + 1
+        frame[(row, col)] = ("|", border)
+
+    def build_frame(self, columns: int, lines: int) -> tuple[Frame, int]:
+        """Return the cells of the next frame and the column of the log pane."""
+        quantities = [get_quantity(metric.name) for metric in self.get_all_metrics()]
+        widths = [self.get_max_len() + 2, 10, max(map(len, quantities), default=1)]
+        split_row = "+" + "-" * (sum(widths) + 8) + "+"
+        split_cell = (split_row, self.color_word(split_row, "cyan"))
+
+        frame: Frame = {}
+        row = 0
+        for title, metrics in [("Metric name", self.metrics), *self.sections.items()]:
+            frame[(row, 0)] = split_cell
+            self._add_row(frame, row + 1, [title, "Value", "Q"], widths, "cyan")
+            frame[(row + 2, 0)] = split_cell
+            row += 3
+            for metric in metrics:
+                value = str(metric.value)
+                cells = [metric.name, value, get_quantity(metric.name)]
+                self._add_row(frame, row, cells, widths, self.get_metric_color(metric.name, value))
+                row += 1
+            frame[(row, 0)] = split_cell
+            row += 2  # an empty row between the tables
+
+        # the last line stays empty, so that nothing scrolls the frame
+        visible = lines - 1
+        frame = {key: cell for key, cell in frame.items() if key[0] < visible}
+
+        log_col = len(split_row) + self.space_len + 1
+        log_len = columns - log_col
+        if log_len > 0:
+            for row, log_line in enumerate(self.get_logs()[:visible]):
+                log_line = log_line.strip()[:log_len]
+                frame[(row, log_col)] = (log_line, self.color_log(log_line))
+        return frame, log_col
+
+    def diff_frame(self, frame: Frame) -> str:
+        """Return the escape sequences that turn the previous frame into ``frame``."""
+        rows: dict[int, list[int]] = {}
+        previous_rows: dict[int, list[int]] = {}
+        for row, col in frame:
+            rows.setdefault(row, []).append(col)
+        for row, col in self._frame:
+            previous_rows.setdefault(row, []).append(col)
+
+        output = []
+        for row in previous_rows.keys() - rows.keys():
+            output.append(f"\033[{row + 1};1H\033[2K")
+        for row, cols in rows.items():
+            if cols != previous_rows.get(row):
+                # the cells of the row moved, e.g. a value overflowed its column
+                output.append(f"\033[{row + 1};1H\033[2K")
+                output.extend(f"\033[{row + 1};{col + 1}H{frame[(row, col)][1]}" for col in cols)
+                continue
+            for col in cols:
+                cell = frame[(row, col)]
+                previous = self._frame[(row, col)]
+                if previous == cell:
+                    continue
+                padding = len(previous[0]) - len(cell[0])
+                output.append(f"\033[{row + 1};{col + 1}H{cell[1]}{' ' * max(padding, 0)}")
+        return "".join(output)
+
     def display(self) -> None:
-        metric_col_len = self.get_max_len() + 2
-        value_col_len = 10
-        q_col_len = 1
-        space_len = 10
-        split_row_len = metric_col_len + value_col_len + q_col_len + 8
-        table_len = split_row_len
-
-        split_row = "+" + "-" * split_row_len + "+\n"
-        header = (
-            f"| {'Metric name'.center(metric_col_len)} | {'Value'.center(value_col_len)}"
-            f" | {'Q'.center(q_col_len)} |\n"
-        )
+        size = self.get_terminal_size()
+        frame, log_col = self.build_frame(size.columns, size.lines)
+        layout = (size, log_col)
+        output = ""
+        if layout != self._layout:
+            # the table moved or the terminal was resized, redraw everything
+            self._layout = layout
+            self._frame = {}
+            output = self.clear_screen()
+        output += self.diff_frame(frame)
+        self._frame = frame
+        self._rows = max((row for row, _ in frame), default=-1) + 1
+        if output:
+            sys.stdout.write(output)
+            sys.stdout.flush()
 
-        self.clear_screen()
-        table = ""
-        table += split_row
-        table += header
-        table += split_row
-        for metric in self.metrics:
-            table += (
-                f"| {metric.name.center(metric_col_len)} "
-                f"| {str(metric.value).center(value_col_len)} "
-                f"| {QUANTITIES.get(metric.name, 'n').center(q_col_len)} |\n"
-            )
-        table += split_row
-        table_lines = table.split("\n")
-
-        logs = self.get_logs()
-        logs = [line.strip() for line in logs]
-        for table_line, log_line in zip_longest(table_lines, logs, fillvalue=""):
-            if table_line and table_len != "\n" and table_lines[-1] != table_line:
-                print(
-                    f"{self.color_table(table_line)}{' '.center(space_len)}"
-                    f" {self.color_log(log_line)}"
-                )
-            else:
-
-                offset = table_len + space_len + 2
-                print(f"{' '.center(offset)} {self.color_log(log_line)}")
-
-    def update(self, new_metrics: MetricList) -> None:
-        self.metrics = new_metrics
-        self.display()
+    def update(self, new_metrics: MetricList,
+               sections: dict[str, MetricList] | None = None) -> None:
+        with self._lock:
+            if self._pending is not None:
+                self.dropped_frames += 1
+            self._pending = (new_metrics, sections or {})
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        min_interval = 1 / self.fps
+        while not self._stop_event.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                pending, self._pending = self._pending, None
+            if pending is None or self._stop_event.is_set():
+                continue
+            self.metrics, self.sections = pending
+            started = time.monotonic()
+            try:
+                self.display()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to render the metrics")
+            self.render_time = time.monotonic() - started
+            self.last_update = time.time()
+            self._stop_event.wait(max(0.0, min_interval - self.render_time))
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        if self._layout is not None:
+            # leave the cursor below the last frame
+            sys.stdout.write(f"\033[{self._rows + 1};1H\033[?25h")
+            sys.stdout.flush()
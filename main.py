@@ -1,14 +1,22 @@
 import argparse
+import json
 import logging
 import os
+import platform
 import signal
+import socket
 import sys
-import threading
 import time
 
+from core.builder import LINK_MODES, Builder, VenvCache
 from core.logger import setup_logger, LoggerWriter
 from core.metrics import Metric, MetricList
+from core.profiler import AllocationProfiler, InjectedProfiler, StackProfiler
+from core.ramp import SCHEDULES, LoadRamp, RampLimits, RampReport
+from core.recording import EXPORTERS, Recorder, RecordingReader
+from core.repeat import RepeatedRun
 from core.runner import ScriptRunner
+from core.scheduler import Snapshot
 from core.visual import MetricsDisplay
 
 logger = setup_logger(f"smaug_{os.getpid()}")
@@ -17,17 +25,37 @@ sys.stderr = LoggerWriter(logger, logging.ERROR)
 
 class App:
 
-    def __init__(self, script_file: str, num: int, use_buffer: bool):
+    def __init__(self, script_file: str, num: int, use_buffer: bool,
+                 windows: tuple[float, ...] = (), percentiles: bool = False,
+                 record: str | None = None, builder: Builder | None = None,
+                 raw_output: bool = False, fps: float = 4.0, headless: bool = False,
+                 subtract_self: bool = False, sample_interval: float = 0.1,
+                 max_sample_interval: float | None = None,
+                 profilers: dict[str, InjectedProfiler] | None = None,
+                 telemetry: bool = False):
         os.makedirs("logs", exist_ok=True)
 
-        self.runner = ScriptRunner(script_file, use_buffer)
+        self.windows = windows
+        self.percentiles = percentiles
+        self.refresh_interval = 1 / fps
+        self.runner = ScriptRunner(script_file, use_buffer, windows, builder, raw_output,
+                                   subtract_self, sample_interval, max_sample_interval,
+                                   profilers, telemetry)
         self.runner.run(num)
         self.monitor = self.runner.monitor
-        self.display = MetricsDisplay()
+        self.display = None
+        if not headless:
+            self.display = MetricsDisplay(self.runner.tails, fps)
+        self.recorder = None
+        if record:
+            self.recorder = Recorder(record, self._get_run_metadata(script_file, num))
+            self.monitor.scheduler.add_listener(self.recorder.record)
 
         self.stop_flag = False
-        self.collect_data_thread = threading.Thread(target=self._collect_data)
-        self.collect_data_thread.start()
+        if self.display:
+            self.monitor.scheduler.add_listener(self._collect_data, self.refresh_interval)
+        else:
+            logger.info("Running headless, the metrics are not rendered")
         signal.signal(signal.SIGINT, self.signal_handler)
 
         self._wait_scripts()
@@ -36,51 +64,119 @@ class App:
         self.stop()
 
     def stop(self) -> None:
+        if self.stop_flag:
+            return  # SIGINT stops the app, then _wait_scripts() returns and stops it again
         self.stop_flag = True
+        if self.display:
+            self.display.stop()
         self.runner.stop()
+        if self.recorder:
+            self.recorder.close()
 
-    def _collect_data(self) -> None:
-        collect_interval = 0.3  # 0.3 seconds
-        while not self.stop_flag:
-            epoch_now = int(time.time())
+    def _get_run_metadata(self, script_file: str, num: int) -> dict:
+        return {
+            "script": os.path.abspath(script_file),
+            "num": num,
+            "host": socket.gethostname(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "started_at": time.time(),
+            "base_interval": self.monitor.scheduler.base_interval,
+            "max_interval": self.runner.max_interval,
+            "profilers": [
+                profiler.__class__.__name__ for profiler in self.runner.profilers.values()
+            ],
+            "telemetry": self.runner.telemetry is not None,
+            "argv": sys.argv,
+        }
 
-            cpu_metrics = self.monitor.cpu_monitor.record_stats()
-            cpu_metrics.append(
-                Metric('cpu average', self.monitor.cpu_monitor.get_average(), epoch=epoch_now)
-            )
+    def _collect_data(self, snapshot: Snapshot) -> None:
+        if self.stop_flag:
+            return
+        epoch_now = snapshot.epoch
 
-            memory_metrics = self.monitor.memory_monitor.record_stats()
-            for key, value in self.monitor.memory_monitor.get_average().items():
-                memory_metrics.append(Metric(f'{key} average', value, epoch=epoch_now))
+        cpu_metrics = MetricList(snapshot.records.get("cpu", []))
+        cpu_metrics.append(
+            Metric('cpu average', self.monitor.cpu_monitor.get_average(), epoch=epoch_now)
+        )
 
-            disk_metrics = self.monitor.disk_monitor.record_stats()
-            disk_metrics.append(
-                Metric('disk usage difference',
-                       self.monitor.disk_monitor.get_diff(),
-                       epoch=epoch_now)
-            )
+        memory_metrics = MetricList(snapshot.records.get("memory", []))
+        for key, value in self.monitor.memory_monitor.get_average().items():
+            memory_metrics.append(Metric(f'{key} average', value, epoch=epoch_now))
 
-            process_metrics = MetricList([
-                Metric('execution time',
-                       self.monitor.process_monitor.get_execution_time(),
-                       epoch=epoch_now),
-                Metric('total thread usage',
-                       self.monitor.process_monitor.get_total_thread_usage(),
-                       epoch=epoch_now),
-            ])
-            thread_usage_diff = self.monitor.process_monitor.get_diff()['total thread usage diff']
-            process_metrics.append(
-                Metric('total thread usage difference', thread_usage_diff, epoch=epoch_now)
+        if self.percentiles or self.windows:
+            cpu_metrics += self._get_summary_metrics(
+                self.monitor.cpu_monitor, ["cpu usage"], epoch_now
             )
+            memory_metrics += self._get_summary_metrics(
+                self.monitor.memory_monitor,
+                ["memory usage", "swap memory usage"],
+                epoch_now,
+            )
+
+        network_metrics = MetricList(snapshot.records.get("network", []))
+
+        disk_metrics = MetricList(snapshot.records.get("disk io", []))
+        disk_metrics += snapshot.records.get("disk", [])
+        disk_metrics.append(
+            Metric('disk usage difference',
+                   self.monitor.disk_monitor.get_diff(),
+                   epoch=epoch_now)
+        )
+
+        process_metrics = MetricList([
+            Metric('execution time',
+                   self.monitor.process_monitor.get_execution_time(),
+                   epoch=epoch_now),
+        ])
+        process_records = snapshot.records.get("process", MetricList())
+        if process_records:
+            process_metrics.append(process_records.get('total thread usage'))
+        thread_usage_diff = self.monitor.process_monitor.get_diff()['total thread usage diff']
+        process_metrics.append(
+            Metric('total thread usage difference', thread_usage_diff, epoch=epoch_now)
+        )
+
+        instance_metrics = MetricList(snapshot.records.get("instance", []))
+        instance_metrics += snapshot.records.get("allocations", [])
+        instance_metrics += snapshot.records.get("telemetry", [])
+        for key, value in self.monitor.instance_monitor.get_average().items():
+            instance_metrics.append(Metric(f'{key} average', value, epoch=epoch_now))
+
+        app_metrics = MetricList([
+            Metric('app size', self.monitor.get_app_size(), epoch=epoch_now),
+            Metric('staging time', round(self.runner.builder.staging_time, 3),
+                   epoch=epoch_now),
+        ])
 
-            app_size_metric = Metric('app size',
-                                     self.monitor.get_app_size(), epoch=epoch_now)
+        metrics = (cpu_metrics + memory_metrics + instance_metrics + network_metrics
+                   + disk_metrics + app_metrics + process_metrics)
 
-            metrics = (cpu_metrics + memory_metrics + disk_metrics
-                       + MetricList([app_size_metric]) + process_metrics)
+        self_metrics = MetricList(snapshot.records.get("self", []))
+        self_metrics.append(
+            Metric('smaug render time', round(self.display.render_time * 1000, 3),
+                   epoch=epoch_now)
+        )
+        self_metrics.append(
+            Metric('smaug dropped frames', self.display.dropped_frames, epoch=epoch_now)
+        )
 
-            self.display.update(metrics)
-            time.sleep(collect_interval)
+        self.display.update(metrics, {"Smaug": self_metrics})
+
+    def _get_summary_metrics(self, monitor, names: list[str], epoch: int) -> MetricList:
+        stats = ["p50", "p95", "p99"] if self.percentiles else []
+        metrics = MetricList()
+        for name in names:
+            summary = monitor.get_summary(name)
+            for stat in stats:
+                metrics.append(Metric(f"{name} {stat}", summary[stat], epoch=epoch))
+            for window in self.windows:
+                summary = monitor.get_summary(name, window)
+                for stat in ["average"] + stats:
+                    metrics.append(
+                        Metric(f"{name} {stat} {window:g}s", summary[stat], epoch=epoch)
+                    )
+        return metrics
 
     def _wait_scripts(self) -> None:
         for process in self.runner.processes:
@@ -88,6 +184,92 @@ class App:
         self.stop()
 
 
+def positive_float(value: str) -> float:
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+
+def run_load_ramp(script_file: str, use_buffer: bool, builder: Builder,
+                  args: argparse.Namespace) -> RampReport:
+    os.makedirs("logs", exist_ok=True)
+    runner = ScriptRunner(script_file, use_buffer, builder=builder,
+                          raw_output=args.raw_output, base_interval=args.sample_interval,
+                          max_interval=args.max_sample_interval,
+                          profilers=get_profilers(args), telemetry=args.telemetry)
+    limits = RampLimits(
+        cpu=args.limit_cpu,
+        memory=args.limit_memory,
+        p95_latency=args.limit_p95,
+        failures=args.limit_failures,
+    )
+    ramp = LoadRamp(runner, limits, args.ramp, args.ramp_max, args.ramp_step,
+                    args.ramp_timeout)
+    try:
+        report = ramp.run()
+    finally:
+        runner.stop()
+    if args.ramp_report:
+        with open(args.ramp_report, "w", encoding="utf-8") as file:
+            file.write(report.to_json())
+    return report
+
+
+def get_profilers(args: argparse.Namespace) -> dict[str, InjectedProfiler]:
+    """Profilers to inject into the scripts, keyed by the path prefix of their output."""
+    profilers = {}
+    if args.profile:
+        path_prefix = args.profile_output or f"logs/smaug_{os.getpid()}_profile"
+        profilers[path_prefix] = StackProfiler(args.profile_hz)
+    if args.trace_memory:
+        path_prefix = args.trace_memory_output or f"logs/smaug_{os.getpid()}_memory"
+        profilers[path_prefix] = AllocationProfiler(
+            args.trace_memory_interval, args.trace_memory_depth, args.trace_memory_top
+        )
+    return profilers
+
+
+def run_repeated(script_file: str, use_buffer: bool, builder: Builder,
+                 args: argparse.Namespace) -> int:
+    """Run the script --repeat times in a row, return the exit code for CI."""
+    os.makedirs("logs", exist_ok=True)
+    runner = ScriptRunner(script_file, use_buffer, builder=builder,
+                          raw_output=args.raw_output, base_interval=args.sample_interval,
+                          max_interval=args.max_sample_interval,
+                          profilers=get_profilers(args), telemetry=args.telemetry)
+    repeated = RepeatedRun(runner, args.repeat, args.warmup, args.num, args.confidence)
+    try:
+        report = repeated.run()
+    finally:
+        runner.stop()
+    print(report)
+    if args.repeat_report:
+        with open(args.repeat_report, "w", encoding="utf-8") as file:
+            file.write(report.to_json())
+    exit_code = 0
+    if report.failures:
+        print(f"{report.failures} instances failed")
+        exit_code = 1
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = report.compare(json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"Regression of {regression}")
+        if regressions:
+            exit_code = 1
+        else:
+            print(f"No significant regression over the baseline {args.baseline}")
+    return exit_code
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Run the application with a specified main file."
@@ -109,10 +291,295 @@ if __name__ == "__main__":
         default=True,
         help="Use buffer for the script output. Default is True",
     )
+    parser.add_argument(
+        "-p",
+        "--percentiles",
+        action="store_true",
+        help="Show p50/p95/p99 of CPU and memory usage next to the averages",
+    )
+    parser.add_argument(
+        "-w",
+        "--windows",
+        type=float,
+        nargs="*",
+        default=[],
+        help="Sliding windows (seconds) to aggregate CPU and memory usage over",
+    )
+
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        help="Save every sample of the run to a recording file (path)",
+    )
+    parser.add_argument(
+        "--no-venv-cache",
+        action="store_true",
+        help="Build a fresh virtual environment instead of reusing a cached one",
+    )
+    parser.add_argument(
+        "--venv-cache-dir",
+        type=str,
+        default=None,
+        help="Directory of the virtual environment cache. Default is ~/.cache/smaug/venvs",
+    )
+    parser.add_argument(
+        "--venv-cache-size",
+        type=int,
+        default=2048,
+        help="Size limit of the virtual environment cache in MB. Default is 2048",
+    )
+    parser.add_argument(
+        "--raw-output",
+        action="store_true",
+        help="Write the script output to disk as raw bytes instead of through"
+             " the logger, for scripts that print a lot",
+    )
+    parser.add_argument(
+        "--fps",
+        type=positive_float,
+        default=4.0,
+        help="The highest number of times per second the metrics are redrawn. Default is 4",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Do not render the metrics, e.g. for CI or batch runs with --record",
+    )
+    parser.add_argument(
+        "--subtract-self",
+        action="store_true",
+        help="Leave the CPU time and memory of Smaug itself out of the host CPU"
+             " and memory usage",
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=positive_float,
+        default=0.1,
+        help="The shortest time between two samples of a metric (seconds)."
+             " Default is 0.1",
+    )
+    parser.add_argument(
+        "--max-sample-interval",
+        type=positive_float,
+        default=2.0,
+        help="The longest time between two samples of a metric (seconds); sampling"
+             " backs off up to it while the metrics are steady or only swing within"
+             " their usual variability, and speeds up again"
+             " when they change. Set it to --sample-interval to sample at a fixed"
+             " rate. Default is 2",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Sample the stacks of the scripts and save them as collapsed stacks,"
+             " per instance and merged, e.g. for flamegraph.pl or speedscope",
+    )
+    parser.add_argument(
+        "--profile-hz",
+        type=float,
+        default=100.0,
+        help="Stack samples per second of CPU time with --profile. Default is 100",
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=str,
+        default=None,
+        help="Path prefix of the collapsed stack files with --profile."
+             " Default is logs/smaug_<pid>_profile",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Trace the allocations of the scripts with tracemalloc and report the"
+             " allocation sites that grow, e.g. to find leaks in soak runs",
+    )
+    parser.add_argument(
+        "--trace-memory-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between two allocation snapshots with --trace-memory. Default is 5",
+    )
+    parser.add_argument(
+        "--trace-memory-depth",
+        type=int,
+        default=1,
+        help="Frames kept per allocation traceback with --trace-memory; deeper"
+             " tracebacks cost more memory and time. Default is 1",
+    )
+    parser.add_argument(
+        "--trace-memory-top",
+        type=int,
+        default=10,
+        help="Allocation sites sent per snapshot with --trace-memory. Default is 10",
+    )
+    parser.add_argument(
+        "--trace-memory-output",
+        type=str,
+        default=None,
+        help="Path prefix of the allocation snapshots file with --trace-memory."
+             " Default is logs/smaug_<pid>_memory",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store_true",
+        help="Inject the telemetry shim into the scripts, which publishes their GC"
+             " activity and their own counters over shared memory",
+    )
+    parser.add_argument(
+        "--exclude",
+        type=str,
+        nargs="*",
+        default=[],
+        help="Extra .gitignore-style patterns to leave out when staging the project",
+    )
+    parser.add_argument(
+        "--link-mode",
+        choices=LINK_MODES,
+        default="auto",
+        help="How to stage project files. auto tries reflink, then copy; hardlink is"
+             " faster but the staged files share their content with the originals, so"
+             " a script that writes to its own files changes them. Default is auto",
+    )
+    parser.add_argument(
+        "--ramp",
+        choices=SCHEDULES,
+        default=None,
+        help="Find the max sustainable concurrency by ramping up instances"
+             " instead of running -n of them",
+    )
+    parser.add_argument(
+        "--ramp-max",
+        type=int,
+        default=64,
+        help="The highest concurrency the ramp tries. Default is 64",
+    )
+    parser.add_argument(
+        "--ramp-step",
+        type=positive_int,
+        default=1,
+        help="Instances added per step of the linear ramp. Default is 1",
+    )
+    parser.add_argument(
+        "--ramp-timeout",
+        type=float,
+        default=None,
+        help="Seconds after which the instances of a step are killed and counted as failed",
+    )
+    parser.add_argument(
+        "--ramp-report",
+        type=str,
+        default=None,
+        help="Save the ramp report as JSON (path)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=None,
+        help="Run the script this many times one after another, each time with"
+             " --num instances, and report the distribution of wall time, CPU time"
+             " and peak memory",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Runs before the --repeat runs that are left out of the results."
+             " Default is 1",
+    )
+    parser.add_argument(
+        "--repeat-report",
+        type=str,
+        default=None,
+        help="Save the runs and their statistics as JSON (path), e.g. to use"
+             " them as a baseline",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Compare the --repeat runs with an earlier --repeat-report (path)"
+             " and exit with 1 on a significant regression",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.05,
+        help="Slowdown over the baseline median below which a regression is"
+             " ignored, even when significant. Default is 0.05 (5%%)",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Confidence level of the bootstrap intervals. Default is 0.95",
+    )
+    parser.add_argument(
+        "--limit-cpu",
+        type=float,
+        default=None,
+        help="Ramp limit on the average host CPU usage of a step (%%)",
+    )
+    parser.add_argument(
+        "--limit-memory",
+        type=float,
+        default=None,
+        help="Ramp limit on the peak host memory usage of a step (%%)",
+    )
+    parser.add_argument(
+        "--limit-p95",
+        type=float,
+        default=None,
+        help="Ramp limit on the p95 completion time of a step (seconds)",
+    )
+    parser.add_argument(
+        "--limit-failures",
+        type=int,
+        default=0,
+        help="Failed instances allowed per ramp step. Default is 0",
+    )
+    parser.add_argument(
+        "--export",
+        type=str,
+        default=None,
+        help="Export a recording file (path) instead of running a script",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(EXPORTERS),
+        default="csv",
+        help="Format of the exported recording. Default is csv",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="File to export the recording to (path). Default is stdout",
+    )
 
     args = parser.parse_args()
-    if args.main_file:
+    if args.export:
+        with RecordingReader(args.export) as reader:
+            if args.output:
+                with open(args.output, "w", encoding="utf-8", newline="") as output:
+                    EXPORTERS[args.format](reader, output)
+            else:
+                EXPORTERS[args.format](reader, sys.stdout)
+    elif args.main_file:
         num = args.num
         main_file = args.main_file
         use_buffer = args.use_buffer
-        app = App(main_file, num, use_buffer)
+        venv_cache = None
+        if not args.no_venv_cache:
+            venv_cache = VenvCache(args.venv_cache_dir, args.venv_cache_size)
+        builder = Builder(venv_cache, args.exclude, args.link_mode)
+        if args.ramp:
+            print(run_load_ramp(main_file, use_buffer, builder, args))
+            sys.exit(0)
+        if args.repeat:
+            sys.exit(run_repeated(main_file, use_buffer, builder, args))
+        app = App(main_file, num, use_buffer, tuple(args.windows), args.percentiles,
+                  args.record, builder, args.raw_output, args.fps, args.headless,
+                  args.subtract_self, args.sample_interval, args.max_sample_interval,
+                  get_profilers(args), args.telemetry)
@@ -0,0 +1,113 @@
+import random
+import unittest
+
+from core.aggregates import QuantileSketch, RunningStats
+
+
+def weighted_stats(samples: list[tuple[float, float]]) -> tuple[float, float]:
+    total = sum(weight for _, weight in samples)
+    mean = sum(value * weight for value, weight in samples) / total
+    variance = sum(weight * (value - mean) ** 2 for value, weight in samples) / total
+    return mean, variance
+
+
+class RunningStatsTest(unittest.TestCase):
+
+    def test_weighted_add_matches_direct_computation(self):
+        rng = random.Random(1)
+        samples = [(rng.uniform(-50, 150), rng.uniform(0.1, 2.0)) for _ in range(200)]
+        stats = RunningStats()
+        for value, weight in samples:
+            stats.add(value, weight)
+        mean, variance = weighted_stats(samples)
+        self.assertAlmostEqual(stats.mean, mean, places=9)
+        self.assertAlmostEqual(stats.variance, variance, places=6)
+        self.assertAlmostEqual(stats.weight, sum(weight for _, weight in samples), places=9)
+        self.assertEqual(stats.count, 200)
+
+    def test_weighted_remove_matches_the_remaining_samples(self):
+        rng = random.Random(2)
+        samples = [(rng.uniform(0, 100), rng.uniform(0.1, 2.0)) for _ in range(300)]
+        stats = RunningStats()
+        for value, weight in samples:
+            stats.add(value, weight)
+        # evict the oldest samples like a window does
+        for value, weight in samples[:250]:
+            stats.remove(value, weight)
+        mean, variance = weighted_stats(samples[250:])
+        self.assertAlmostEqual(stats.mean, mean, places=6)
+        self.assertAlmostEqual(stats.variance, variance, places=4)
+        self.assertEqual(stats.count, 50)
+
+    def test_remove_down_to_one_sample(self):
+        stats = RunningStats()
+        stats.add(10.0, 0.5)
+        stats.add(30.0, 1.5)
+        stats.remove(10.0, 0.5)
+        self.assertAlmostEqual(stats.mean, 30.0)
+        self.assertAlmostEqual(stats.variance, 0.0)
+        stats.remove(30.0, 1.5)
+        self.assertEqual(stats.count, 0)
+        self.assertEqual(stats.weight, 0.0)
+
+    def test_unit_weights_are_plain_welford(self):
+        stats = RunningStats()
+        for value in (2, 4, 4, 4, 5, 5, 7, 9):
+            stats.add(value)
+        self.assertAlmostEqual(stats.mean, 5.0)
+        self.assertAlmostEqual(stats.variance, 4.0)
+
+
+class QuantileSketchTest(unittest.TestCase):
+
+    def assertClose(self, actual: float, expected: float, accuracy: float = 0.01):
+        self.assertLessEqual(abs(actual - expected), abs(expected) * accuracy,
+                             f"{actual} is not within {accuracy:.0%} of {expected}")
+
+    def test_unit_weight_quantiles(self):
+        sketch = QuantileSketch()
+        for value in range(1, 101):
+            sketch.add(float(value))
+        self.assertClose(sketch.quantile(0.0), 1)
+        self.assertClose(sketch.quantile(0.5), 50)
+        self.assertClose(sketch.quantile(0.95), 95)
+        self.assertClose(sketch.quantile(1.0), 100)
+
+    def test_quantiles_follow_the_weights(self):
+        # 10 for 0.9 of the time, then 100 for 0.1 of it
+        sketch = QuantileSketch()
+        for _ in range(9):
+            sketch.add(10.0, 0.1)
+        sketch.add(100.0, 0.1)
+        self.assertClose(sketch.quantile(0.5), 10)
+        self.assertClose(sketch.quantile(0.95), 100)
+        # the same time spread over samples of different weights
+        weighted = QuantileSketch()
+        weighted.add(10.0, 0.9)
+        weighted.add(100.0, 0.1)
+        for q in (0.0, 0.5, 0.89, 0.95, 1.0):
+            self.assertClose(weighted.quantile(q), sketch.quantile(q))
+
+    def test_removed_weight_leaves_the_quantiles(self):
+        sketch = QuantileSketch()
+        sketch.add(100.0, 2.0)
+        sketch.add(10.0, 0.5)
+        sketch.add(-5.0, 0.5)
+        sketch.add(0.0, 1.0)
+        sketch.remove(100.0, 2.0)
+        self.assertEqual(sketch.count, 3)
+        self.assertAlmostEqual(sketch.weight, 2.0)
+        self.assertClose(sketch.quantile(0.0), -5)
+        self.assertEqual(sketch.quantile(0.5), 0.0)
+        self.assertClose(sketch.quantile(1.0), 10)
+
+    def test_negative_values_only(self):
+        sketch = QuantileSketch()
+        for value in (-1.0, -2.0, -3.0):
+            sketch.add(value)
+        self.assertClose(sketch.quantile(0.0), -3)
+        self.assertClose(sketch.quantile(1.0), -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from core.metrics import Metric, MetricList
+from core.scheduler import AdaptiveInterval
+
+
+def records(**values: float) -> MetricList:
+    return MetricList([Metric(name.replace("_", " "), value, 0) for name, value in values.items()])
+
+
+class AdaptiveIntervalTest(unittest.TestCase):
+
+    def test_doubles_after_patience_steady_samples(self):
+        sampler = AdaptiveInterval(1, 8, threshold=0.1, patience=3)
+        intervals = [sampler.update(records(queue=50)) for _ in range(12)]
+        self.assertEqual(intervals, [1, 1, 2, 2, 2, 4, 4, 4, 8, 8, 8, 8])
+
+    def test_resets_when_a_metric_moves_past_the_threshold(self):
+        sampler = AdaptiveInterval(1, 8, threshold=0.1, patience=2)
+        for _ in range(6):
+            sampler.update(records(queue=50, errors=0))
+        self.assertEqual(sampler.every, 8)
+        # 10% of the value is not past the threshold
+        self.assertEqual(sampler.update(records(queue=55, errors=0)), 8)
+        self.assertEqual(sampler.update(records(queue=55, errors=2)), 1)
+        # the count of steady samples starts over after a reset
+        self.assertEqual(sampler.update(records(queue=55, errors=2)), 1)
+        self.assertEqual(sampler.update(records(queue=55, errors=2)), 2)
+
+    def test_changes_are_relative_to_the_max_value(self):
+        sampler = AdaptiveInterval(1, 4, threshold=0.1, patience=1)
+        sampler.update(records(cpu_usage=50))
+        # 8 points of a 0-100% metric, steady although the value moved by 16%
+        self.assertEqual(sampler.update(records(cpu_usage=58)), 4)
+        self.assertEqual(sampler.update(records(cpu_usage=70)), 1)
+
+    def test_backs_off_on_a_metric_swinging_around_its_mean(self):
+        sampler = AdaptiveInterval(1, 8, threshold=0.1, patience=2)
+        intervals = [sampler.update(records(cpu_usage=44 + 12 * (i % 2))) for i in range(12)]
+        self.assertEqual(intervals[-1], 8)
+        # a move well out of its usual swings still resets the interval
+        self.assertEqual(sampler.update(records(cpu_usage=100)), 1)
+
+    def test_keeps_the_fastest_rate_on_a_trending_metric(self):
+        sampler = AdaptiveInterval(1, 8, threshold=0.1, patience=2)
+        intervals = [sampler.update(records(cpu_usage=15 * i % 100)) for i in range(6)]
+        self.assertEqual(intervals, [1] * 6)
+
+    def test_ignores_values_that_are_not_numbers(self):
+        sampler = AdaptiveInterval(1, 4, threshold=0.1, patience=1)
+        sampler.update(MetricList([Metric("state", "idle", 0), Metric("ok", True, 0)]))
+        interval = sampler.update(MetricList([Metric("state", "busy", 0), Metric("ok", False, 0)]))
+        self.assertEqual(interval, 4)
+
+    def test_never_leaves_its_bounds(self):
+        sampler = AdaptiveInterval(2, 1, patience=1)
+        self.assertEqual(sampler.max_every, 2)
+        self.assertEqual(sampler.update(records(queue=1)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()